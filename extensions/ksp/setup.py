@@ -15,6 +15,9 @@ ksp = Extension('ksp',
                     ],
                     libraries = ['boost_regex'],
                     library_dirs = [os.path.abspath(os.path.join(sys.executable, "..", "Library", "lib"))],
+                    # std::thread is used for batch queries
+                    extra_compile_args = [] if sys.platform == 'win32' else ['-pthread'],
+                    extra_link_args = [] if sys.platform == 'win32' else ['-pthread'],
                     sources = sources)
 
 setup (name = 'ksp',
@@ -6,7 +6,28 @@ Copyright (c) 2017 Theodoros Chondrogiannis
 
 typedef priority_queue<pair<double,Edge>> PathEdges;
 
-double compute_priority(RoadNetwork *rN, Edge &e, vector<double> &bounds, unordered_set<Edge,boost::hash<Edge>> &deletedEdges);
+/*
+ *	Mfolini: EdgePriorities computes the priorities of the edges of a path (see
+ *	compute_paths_through) for the current set of deleted edges. The A*
+ *	searches between the neighbours of all edges of the path run on
+ *	the threads of the search context.
+ */
+
+class EdgePriorities {
+public:
+	unordered_set<Edge,boost::hash<Edge>> deletedEdges;
+	
+	EdgePriorities(RoadNetwork *rN, const vector<double> &bounds, const Landmarks *landmarks, SearchContext &context);
+	vector<double> compute(const Path &path);
+
+private:
+	RoadNetwork *rN;
+	const vector<double> &bounds;
+	const Landmarks *landmarks;
+	SearchContext &context;
+	
+	void neighbour_pairs(const Edge &e, vector< pair<NodeID,NodeID> > &pairs);
+};
 
 /*
  *
@@ -16,25 +37,35 @@ double compute_priority(RoadNetwork *rN, Edge &e, vector<double> &bounds, unorde
  *
  */
 
-vector<Path> esx(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta) {
+vector<Path> esx(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta, SearchContext &context) {
     
 	vector<Path> resPaths;
-	EdgeList::iterator iterAdj;
 	
-	pair<Path,vector<double>> resDijkstra= dijkstra_path_and_bounds(rN,source,target);
+	pair<Path,shared_ptr<const TargetBounds>> resDijkstra= dijkstra_path_and_bounds(rN,source,target,context);
+	// Mfolini: No paths if the target cannot be reached.
+	if(resDijkstra.first.nodes.empty())
+		return resPaths;
 	resPaths.push_back(resDijkstra.first);
+	if(!context.found(resPaths.back()))
+		return resPaths;
 	
 	if(k==1)
 		return resPaths;
+	
+	// Mfolini: The bounds to the target are not valid for the searches between the neighbours of an edge in
+	// compute_paths_through. If the road network has landmarks, these are used for them instead.
+	shared_ptr<const Landmarks> landmarks = graph_landmarks(rN);
+	EdgePriorities priorities(rN, resDijkstra.second->distances, landmarks.get(), context);
+	unordered_set<Edge,boost::hash<Edge>> &deletedEdges = priorities.deletedEdges;
 
 	vector<PathEdges> pathEdges(k);
 	
 	unordered_set<Edge,boost::hash<Edge>> untouchableEdges;
-	unordered_set<Edge,boost::hash<Edge>> deletedEdges;
 
-	for(double j=0;j<resPaths[0].nodes.size()-1;j++) {
+	vector<double> edgePriorities = priorities.compute(resPaths[0]);
+	for(double j=0;j<edgePriorities.size();j++) {
 		Edge e(resPaths[0].nodes[j],resPaths[0].nodes[j+1]);
-		pathEdges[0].push(make_pair(compute_priority(rN,e,resDijkstra.second,deletedEdges),e));
+		pathEdges[0].push(make_pair(edgePriorities[j],e));
 	}
 	
 	vector<double> overlaps(k,0);
@@ -88,9 +119,15 @@ vector<Path> esx(RoadNetwork *rN, NodeID source, NodeID target, double k, double
 			
 			//cout << "Untouchable checked" << endl;	
 			
-			Path newP = astar_limited(rN,source,target,resDijkstra.second,deletedEdges);
+			Path newP = astar_limited(rN,source,target,resDijkstra.second->distances,deletedEdges,context);
 			//cout << "A-start done" << endl;	
 			
+			// Mfolini: Stop with the paths found so far once the budgets ran out.
+			if(context.exhausted()) {
+				possible = false;
+				break;
+			}
+			
 			if(newP.nodes.size() == 0) { // If astar_limited did not find a path
 				double size = deletedEdges.size();
 				deletedEdges.erase(e);
@@ -111,17 +148,20 @@ vector<Path> esx(RoadNetwork *rN, NodeID source, NodeID target, double k, double
 			bool check = false; // true if it violates theta
 			for(double j=0;j<resPaths.size();j++) {
 				if(newP.overlap_ratio(rN,resPaths[j]) > theta) {
-					check = true;					
+					check = true;
+					context.overlapRejections++;
 					break;
 				}
 			}
 			if(!check) {
 				resPaths.push_back(newP);
+				if(!context.found(newP))
+					return resPaths;
 				overlaps[resPaths.size()-1] = 1;
-				for(double j=0;j<resPaths.back().nodes.size()-1;j++) {
+				edgePriorities = priorities.compute(resPaths.back());
+				for(double j=0;j<edgePriorities.size();j++) {
 					Edge e(resPaths.back().nodes[j],resPaths.back().nodes[j+1]);
-					double sim = compute_priority(rN,e,resDijkstra.second,deletedEdges);
-					pathEdges[resPaths.size()-1].push(make_pair(sim,e));
+					pathEdges[resPaths.size()-1].push(make_pair(edgePriorities[j],e));
 				}
 				break;
 			}
@@ -132,39 +172,54 @@ vector<Path> esx(RoadNetwork *rN, NodeID source, NodeID target, double k, double
 	return resPaths;
 }
 
+EdgePriorities::EdgePriorities(RoadNetwork *rN, const vector<double> &bounds, const Landmarks *landmarks, SearchContext &context) : bounds(bounds), context(context) {
+	this->rN = rN;
+	this->landmarks = landmarks;
+}
+
 /*
 	Let Sources be all the nodes which are the starting podoubles of all incoming edges to the source of the given edge.
 	Let Target be all the nodes which are the ending podoubles of all outgoing edges from the target of the given edge.
-	This function returns the number of shortest paths from some source to some target that contain the given edge. 
+	The priority of an edge is the number of shortest paths from some source to some target that contain the given edge.
+	Mfolini: neighbour_pairs appends the (source, target) pairs, compute runs the searches for all of them. Edges disabled
+	for the query do not connect neighbours.
 */
 
-double compute_paths_through(RoadNetwork *rN, Edge &e, vector<double> &bounds, unordered_set<Edge,boost::hash<Edge>> &deletedEdges) {
-	double strength2 = 0;
-	EdgeList::iterator iterAdj;
+void EdgePriorities::neighbour_pairs(const Edge &e, vector< pair<NodeID,NodeID> > &pairs) {
 	vector<NodeID> sources, targets;
-	for (iterAdj = rN->adjListInc[e.first].begin(); iterAdj != rN->adjListInc[e.first].end(); iterAdj++) {
-		if(iterAdj->first != e.second)
-			sources.push_back(iterAdj->first);
+	for (EdgeID iterAdj = rN->incOffsets[e.first]; iterAdj < rN->incOffsets[e.first+1]; iterAdj++) {
+		if(rN->incNodes[iterAdj] != e.second && !context.disabled(rN->incEdges[iterAdj]))
+			sources.push_back(rN->incNodes[iterAdj]);
 	}
-	for (iterAdj = rN->adjListOut[e.second].begin(); iterAdj != rN->adjListOut[e.second].end(); iterAdj++) {
-		if(iterAdj->first != e.first)	
-			targets.push_back(iterAdj->first);
+	for (EdgeID iterAdj = rN->outOffsets[e.second]; iterAdj < rN->outOffsets[e.second+1]; iterAdj++) {
+		if(rN->outNodes[iterAdj] != e.first && !context.disabled(rN->outEdges[iterAdj]))	
+			targets.push_back(rN->outNodes[iterAdj]);
 	}
-	for(double m=0;m<sources.size();m++) {
-		for(double n=0;n<targets.size();n++) {
-			Path tempP = astar_limited(rN,sources[m],targets[n],bounds,deletedEdges);
-			if(tempP.nodes.size() > 0 && tempP.containsEdge(e))
-				strength2++;
-			}
+	for(size_t m=0;m<sources.size();m++) {
+		for(size_t n=0;n<targets.size();n++)
+			pairs.push_back(make_pair(sources[m],targets[n]));
 	}
-	
-	return strength2;
 }
 
-/*
-	This is the function that computes the priority of a given edge.
-*/
-
-double compute_priority(RoadNetwork *rN, Edge &e, vector<double> &bounds, unordered_set<Edge,boost::hash<Edge>> &deletedEdges) {
-	return compute_paths_through(rN,e,bounds,deletedEdges); // Paths through
+vector<double> EdgePriorities::compute(const Path &path) {
+	size_t edgeCount = path.nodes.size() > 0 ? path.nodes.size()-1 : 0;
+	vector<double> result(edgeCount, 0);
+	vector< pair<NodeID,NodeID> > pairs;
+	vector<size_t> pairEdges; // Index of the path edge the pair belongs to
+	
+	for(size_t j=0;j<edgeCount;j++) {
+		neighbour_pairs(Edge(path.nodes[j],path.nodes[j+1]), pairs);
+		pairEdges.resize(pairs.size(), j);
+	}
+	
+	vector<char> through(pairs.size(), 0);
+	parallel_for(pairs.size(), context.nThreads, [&](size_t i) {
+		Edge e(path.nodes[pairEdges[i]],path.nodes[pairEdges[i]+1]);
+		Path tempP = landmarks ? astar_limited(rN,pairs[i].first,pairs[i].second,*landmarks,deletedEdges,context) : astar_limited(rN,pairs[i].first,pairs[i].second,bounds,deletedEdges,context);
+		through[i] = tempP.nodes.size() > 0 && tempP.containsEdge(e);
+	});
+	
+	for(size_t i=0;i<pairs.size();i++)
+		result[pairEdges[i]] += through[i];
+	return result;
 }
@@ -14,35 +14,120 @@ Copyright (c) 2017 Theodoros Chondrogiannis
 
 using namespace std;
 
-// Class for the Label which contains an overlap vector
-class OlLabel : public Label {
+// Mfolini: Per-query storage of the labels which contain an overlap vector. Instead of allocating every label on the
+// heap, the labels are stored in structure-of-arrays form and referred to by their index. The overlap vector of
+// label i occupies overlaps[i*width, (i+1)*width), where width is the number of paths the overlap is tracked for.
+class OlLabelArena {
 public:
-	//float ratio;
-	vector<double> overlapList;
-    double overlapForK;
+	size_t width;
+	vector<NodeID> nodeId;
+	vector<double> length;
+	vector<double> lowerBound;
+	vector<int> previous; // -1 for the source label
+	vector<int> overlapForK;
+	vector<double> overlaps;
 	
-	OlLabel(NodeID node_id, double length, vector<double> &overlapList, double overlapForK) : Label(node_id,length) {
-        this->overlapList = overlapList;
-        this->overlapForK = overlapForK;
-        this->previous = NULL;
-    };
+	OlLabelArena(size_t width) {
+		this->width = width;
+	};
 	
-	OlLabel(NodeID node_id, double length, vector<double> &overlapList, double overlapForK, OlLabel* previous) : Label(node_id,length,previous) {
-        this->overlapList = overlapList;
-        this->overlapForK = overlapForK;
-    };
-    
-    OlLabel(NodeID node_id, double length, double fDist, vector<double> &overlapList, double overlapForK) : Label(node_id,length,fDist) {
-        this->overlapList = overlapList;
-        this->overlapForK = overlapForK;
-        this->previous = NULL;
-    };
+	// Appends a label whose overlap vector is a copy of the one of previous (zero for the source label).
+	int add(NodeID nodeId, double length, double lowerBound, int overlapForK, int previous) {
+		int label = this->nodeId.size();
+		this->nodeId.push_back(nodeId);
+		this->length.push_back(length);
+		this->lowerBound.push_back(lowerBound);
+		this->previous.push_back(previous);
+		this->overlapForK.push_back(overlapForK);
+		this->overlaps.resize(this->overlaps.size() + width, 0);
+		if (previous != -1)
+			copy(this->overlapList(previous), this->overlapList(previous) + width, this->overlapList(label));
+		return label;
+	};
 	
-	OlLabel(NodeID node_id, double length, double fDist, vector<double> &overlapList, double overlapForK, OlLabel* previous) : Label(node_id,length,fDist,previous) {
-        this->overlapList = overlapList;
-        this->overlapForK = overlapForK;
-    };
-    
+	// Removes the most recently added label, e.g. when it turns out to violate the overlap threshold.
+	void pop() {
+		this->nodeId.pop_back();
+		this->length.pop_back();
+		this->lowerBound.pop_back();
+		this->previous.pop_back();
+		this->overlapForK.pop_back();
+		this->overlaps.resize(this->overlaps.size() - width);
+	};
+	
+	double *overlapList(int label) {
+		return &this->overlaps[size_t(label) * width];
+	};
+	
+	const double *overlapList(int label) const {
+		return &this->overlaps[size_t(label) * width];
+	};
+	
+	bool pathContains(int label, NodeID node) const {
+		for (; label != -1; label = this->previous[label]) {
+			if (this->nodeId[label] == node)
+				return true;
+		}
+		return false;
+	};
+	
+	Path path(int label) const {
+		Path resPath;
+		resPath.length = this->length[label];
+		for (; label != -1; label = this->previous[label])
+			resPath.nodes.push_back(this->nodeId[label]);
+		reverse(resPath.nodes.begin(), resPath.nodes.end());
+		return resPath;
+	};
+};
+
+// Mfolini: Test whether a node lies on the path of a label, used to avoid cycles when the label is expanded. The path of
+// the label is marked node by node, so the tests for its adjacent nodes are lookups. The marked path is kept as a stack
+// of labels, and switching to another label only unmarks and marks the nodes below their common ancestor. The cost is
+// thus amortized over the tests of a label and proportional to the length of the branch switched to, which is short as
+// consecutively expanded labels mostly share long prefixes.
+class PathMembership {
+public:
+	PathMembership(const OlLabelArena &arena, int numNodes) : arena(&arena), marked(numNodes, 0), depth(numNodes, 0) {};
+	
+	bool contains(int label, NodeID node) {
+		mark(label);
+		return this->marked[node] != 0;
+	};
+
+private:
+	const OlLabelArena *arena;
+	vector<char> marked;   // Nodes on the marked path
+	vector<int> depth;     // Position of a marked node in path
+	vector<int> path;      // Labels of the marked path, starting with the source label
+	vector<int> branch;
+	
+	bool onPath(int label) const {
+		NodeID node = this->arena->nodeId[label];
+		return this->marked[node] && this->path[this->depth[node]] == label;
+	};
+	
+	void mark(int label) {
+		if(!this->path.empty() && this->path.back() == label)
+			return;
+		int cur = label;
+		this->branch.clear();
+		while(cur != -1 && !onPath(cur)) {
+			this->branch.push_back(cur);
+			cur = this->arena->previous[cur];
+		}
+		size_t keep = cur == -1 ? 0 : this->depth[this->arena->nodeId[cur]] + 1;
+		while(this->path.size() > keep) {
+			this->marked[this->arena->nodeId[this->path.back()]] = 0;
+			this->path.pop_back();
+		}
+		for(size_t i = this->branch.size(); i > 0; i--) {
+			NodeID node = this->arena->nodeId[this->branch[i-1]];
+			this->marked[node] = 1;
+			this->depth[node] = this->path.size();
+			this->path.push_back(this->branch[i-1]);
+		}
+	};
 };
 
 /*
@@ -52,36 +137,49 @@ public:
 
 class SkylineContainer {
 	public:
-		unordered_map<double,vector<OlLabel*>> container; // Consider replacing the unordered_map with a vector
-		void insert(OlLabel*);
-		bool contains(double);
-		vector<OlLabel*> get(double);
-		bool dominates(OlLabel*);
+		SkylineContainer(const OlLabelArena &arena, int numNodes) : arena(&arena), slots(numNodes, -1) {};
+		void insert(int);
+		bool contains(NodeID);
+		const vector<int> &get(NodeID);
+		bool dominates(int);
 		long contentsSize();
+	
+	private:
+		// Mfolini: Skyline of a single node. The labels are kept sorted by the sum of their overlaps. Entry i of
+		// packed holds the sum for labels[i], followed by a copy of its overlap vector (stride arena->width+1).
+		class NodeSkyline {
+		public:
+			vector<int> labels;
+			vector<double> packed;
+		};
+		
+		const OlLabelArena *arena;
+		vector<int> slots; // Index of the node's skyline in skylines, -1 if it has none
+		vector<NodeSkyline> skylines;
 };
 
 class AstarComparator2 {
-    bool reverse;
+    const OlLabelArena *arena;
 public:
-    AstarComparator2(const bool& revparam=false) {
-    	reverse=revparam;
+    AstarComparator2(const OlLabelArena &arena) : arena(&arena) {
     }
-    bool operator() (const OlLabel* lhs, const OlLabel* rhs) const     {
-        if(lhs->lowerBound > rhs->lowerBound)
+    bool operator() (int lhs, int rhs) const     {
+        if(arena->lowerBound[lhs] > arena->lowerBound[rhs])
         	return true;
-        else if(lhs->lowerBound < rhs->lowerBound)
+        else if(arena->lowerBound[lhs] < arena->lowerBound[rhs])
         	return false;
     	else {
+    		const double *lhsOverlap = arena->overlapList(lhs), *rhsOverlap = arena->overlapList(rhs);
     		float minLhs = 1;
-    		for(double i=0;i<lhs->overlapList.size();i++) {
-    			if(lhs->overlapList[i] < minLhs)
-    				minLhs = lhs->overlapList[i];
+    		for(size_t i=0;i<arena->width;i++) {
+    			if(lhsOverlap[i] < minLhs)
+    				minLhs = lhsOverlap[i];
     		}
     		
     		float minRhs = 1;
-    		for(double i=0;i<rhs->overlapList.size();i++) {
-    			if(rhs->overlapList[i] < minRhs)
-    				minRhs = rhs->overlapList[i];
+    		for(size_t i=0;i<arena->width;i++) {
+    			if(rhsOverlap[i] < minRhs)
+    				minRhs = rhsOverlap[i];
     		}
     		
     		return minLhs > minRhs;
@@ -89,15 +187,41 @@ public:
     }
 };
 
-typedef priority_queue<OlLabel*,std::vector<OlLabel*>,AstarComparator2> PriorityQueueAS2;
+// Orders arena labels by their lower bound only, like AstarComparator does for Labels.
+class AstarComparatorArena {
+    const OlLabelArena *arena;
+public:
+    AstarComparatorArena(const OlLabelArena &arena) : arena(&arena) {
+    }
+    bool operator() (int lhs, int rhs) const     {
+        return (arena->lowerBound[lhs]>arena->lowerBound[rhs]);
+    }
+};
+
+typedef priority_queue<int,std::vector<int>,AstarComparator2> PriorityQueueAS2;
+// Mfolini: Key of arena labels for RadixHeap, matching AstarComparatorArena.
+class ArenaLowerBound {
+    const OlLabelArena *arena;
+public:
+    ArenaLowerBound(const OlLabelArena &arena) : arena(&arena) {
+    }
+    double operator() (int label) const {
+        return arena->lowerBound[label];
+    }
+};
+
+typedef priority_queue<int,std::vector<int>,AstarComparatorArena> PriorityQueueArena;
+typedef RadixHeap<int,ArenaLowerBound> RadixQueueArena;
 
 // Declarations of exact algorithms
-vector<Path> onepass(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta);
-vector<Path> multipass(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta);
+vector<Path> onepass(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta, SearchContext &context);
+vector<Path> multipass(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta, SearchContext &context);
 
 // Declarations of heuristic algorithms
-vector<Path> svp_plus(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta);
-vector<Path> onepass_plus(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta);
-vector<Path> esx(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta);
+vector<Path> svp_plus(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta, SearchContext &context);
+vector<Path> onepass_plus(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta, SearchContext &context);
+vector<Path> esx(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta, SearchContext &context);
+vector<Path> penalty(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta, SearchContext &context);
+vector<Path> plateau(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta, SearchContext &context);
 
 #endif
@@ -4,7 +4,7 @@ Copyright (c) 2017 Theodoros Chondrogiannis
 
 #include "kspwlo.hpp"
 
-Path next_spwlo_bounds(RoadNetwork *rN, NodeID source, NodeID target, double theta, unordered_map<Edge, vector<double>,boost::hash<Edge>> &resEdges, vector<Path> &resPaths, vector<double> &bounds);
+Path next_spwlo_bounds(RoadNetwork *rN, NodeID source, NodeID target, double theta, unordered_map<Edge, vector<double>,boost::hash<Edge>> &resEdges, vector<Path> &resPaths, const vector<double> &bounds, SearchContext &context);
 
 /*
  *
@@ -15,18 +15,24 @@ Path next_spwlo_bounds(RoadNetwork *rN, NodeID source, NodeID target, double the
  *
  */ 
 
-vector<Path> multipass(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta) {
+vector<Path> multipass(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta, SearchContext &context) {
    	double count = 0;
     Edge edge;
     unordered_map<Edge, vector<double>,boost::hash<Edge>> resEdges;
     unordered_map<Edge, vector<double>,boost::hash<Edge>>::iterator iterE;
 	
 	vector<Path> resPaths;
-	pair<Path,vector<double>> resDijkstra= dijkstra_path_and_bounds(rN,source,target);
+	pair<Path,shared_ptr<const TargetBounds>> resDijkstra= dijkstra_path_and_bounds(rN,source,target,context);
 	
     Path resNext = resDijkstra.first;
     
+    // Mfolini: No paths if the target cannot be reached.
+    if(resNext.nodes.empty())
+    	return resPaths;
+    
     resPaths.push_back(resNext);
+    if(!context.found(resNext))
+    	return resPaths;
     
     if(k==1)
 		return resPaths;
@@ -42,12 +48,14 @@ vector<Path> multipass(RoadNetwork *rN, NodeID source, NodeID target, double k,
     	}
     	count++;
     	
-        resNext = next_spwlo_bounds(rN, source, target, theta, resEdges, resPaths, resDijkstra.second);
+        resNext = next_spwlo_bounds(rN, source, target, theta, resEdges, resPaths, resDijkstra.second->distances, context);
         
 		if(resNext.length == -1)
 			break;
 
 		resPaths.push_back(resNext);
+		if(!context.found(resNext))
+			break;
     }
     
     return resPaths;
@@ -58,62 +66,70 @@ vector<Path> multipass(RoadNetwork *rN, NodeID source, NodeID target, double k,
 	-----
 	This is the doubleernal function called by MultiPass to produce the shortest
 	alternative to the provided set of paths.
+	Mfolini: The returned path has length -1 if there is no such alternative or
+	the budgets of the context ran out.
 */
 
-Path next_spwlo_bounds(RoadNetwork *rN, NodeID source, NodeID target, double theta, unordered_map<Edge, vector<double>,boost::hash<Edge>> &resEdges, vector<Path> &resPaths, vector<double> &bounds) {
+Path next_spwlo_bounds(RoadNetwork *rN, NodeID source, NodeID target, double theta, unordered_map<Edge, vector<double>,boost::hash<Edge>> &resEdges, vector<Path> &resPaths, const vector<double> &bounds, SearchContext &context) {
 	Path resPath;
 	resPath.length = -1;
-	PriorityQueueAS2 Q;
-    SkylineContainer skyline;
+	OlLabelArena labels(resPaths.size());
+	PriorityQueueAS2 Q((AstarComparator2(labels)));
+    SkylineContainer skyline(labels, rN->numNodes);
     double newLength = 0;
-    vector<double> newOverlap;
-    EdgeList::iterator iterAdj;
     unordered_map<Edge, vector<double>,boost::hash<Edge>>::iterator iterE;
     Edge edge;
     bool check = true;
-    vector<OlLabel*> allCreatedLabels;
    	
-    newOverlap.resize(resPaths.size(), 0);
     double newLowerBound = bounds[source];
-    Q.push(new OlLabel(source, newLength, newLowerBound, newOverlap, -1));
+    Q.push(labels.add(source, newLength, newLowerBound, -1, -1));
     
     while (!Q.empty()) {
-        OlLabel *curLabel = static_cast<OlLabel*> (Q.top());
+        int curLabel = Q.top();
         Q.pop();
+        if (!context.pop())
+            break;
+        NodeID curNode = labels.nodeId[curLabel];
                 
         // Found target.
-        if (curLabel->node_id == target) {
-            OlLabel *tempLabel = curLabel;
-        	
-        	while(tempLabel != NULL) {
-               	resPath.nodes.push_back(tempLabel->node_id);
-    			tempLabel = static_cast<OlLabel*> (tempLabel->previous);
-    		}
-    		reverse(resPath.nodes.begin(),resPath.nodes.end());
-            resPath.length = curLabel->length;
+        if (curNode == target) {
+            resPath = labels.path(curLabel);
             break;
         }
-        if(skyline.dominates(curLabel))
+        if(skyline.dominates(curLabel)) {
+            context.dominanceRejections++;
             continue;
+        }
 		skyline.insert(curLabel);
+		context.skylineSize++;
 		
         // Expand search. For each outgoing edge.
-        for(iterAdj = rN->adjListOut[curLabel->node_id].begin(); iterAdj != rN->adjListOut[curLabel->node_id].end(); iterAdj++) {
+        for (EdgeID iterAdj = rN->outOffsets[curNode]; iterAdj < rN->outOffsets[curNode+1]; iterAdj++) {
+            if(context.disabled(rN->outEdges[iterAdj]))
+                continue;
+            NodeID adjNode = rN->outNodes[iterAdj];
 
-            if(curLabel->previous !=NULL && curLabel->previous->node_id == iterAdj->first) 
+            if(labels.previous[curLabel] != -1 && labels.nodeId[labels.previous[curLabel]] == adjNode) 
+            	continue;
+            
+            // Mfolini: Nodes without a bound cannot reach the target (within the bounds radius).
+            if(bounds[adjNode] == DBL_MAX)
             	continue;
             
-            newLength = curLabel->length + iterAdj->second;
-            newOverlap = curLabel->overlapList;
-            newLowerBound = newLength + bounds[iterAdj->first];
-            OlLabel* newPrevious = curLabel;
-            edge = make_pair(curLabel->node_id,iterAdj->first);
+            newLength = labels.length[curLabel] + rN->outWeight(iterAdj);
+            newLowerBound = newLength + bounds[adjNode];
+            edge = make_pair(curNode,adjNode);
             check = true;
+            
+            // The new label starts with the overlap vector of its predecessor and is dropped again if it
+            // exceeds the threshold.
+            int label = labels.add(adjNode, newLength, newLowerBound, -1, curLabel);
+            double *newOverlap = labels.overlapList(label);
         	   
             if ((iterE = resEdges.find(edge)) != resEdges.end()) {
             	for(double j = 0; j < iterE->second.size(); j++) {
-                    newOverlap[iterE->second[j]] += iterAdj->second;
-            		if (newOverlap[iterE->second[j]]/resPaths[iterE->second[j]].length > theta) {
+                    newOverlap[int(iterE->second[j])] += rN->outWeight(iterAdj);
+            		if (newOverlap[int(iterE->second[j])]/resPaths[iterE->second[j]].length > theta) {
                         check = false;
                         break;
                 	}
@@ -121,15 +137,15 @@ Path next_spwlo_bounds(RoadNetwork *rN, NodeID source, NodeID target, double the
             }
         	   
             if (check) {
-            	OlLabel *label = new OlLabel(iterAdj->first, newLength, newLowerBound, newOverlap, -1,newPrevious);
                 Q.push(label);
-                allCreatedLabels.push_back(label);     
-            } 
+                context.addLabel();
+            }
+            else {
+            	labels.pop();
+            	context.overlapRejections++;
+            }
         }
     }
-    
-    for(double i=0;i<allCreatedLabels.size();i++)
-    	delete allCreatedLabels[i];
 	
     return resPath;
-}
\ No newline at end of file
+}
@@ -12,27 +12,32 @@ Copyright (c) 2017 Theodoros Chondrogiannis
  * 
  */
 
-vector<Path> onepass(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta) {
+vector<Path> onepass(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta, SearchContext &context) {
    	vector<Path> resPaths;
    	    
     double count = 0;
     NodeID resid;
-    PriorityQueueAS2 queue;
     double newLength = 0;
-    vector<double> newOverlap;
-    EdgeList::iterator iterAdj;
     Edge edge;
     bool check;
     
     unordered_map<Edge, vector<double>,boost::hash<Edge>> resEdges;
     unordered_map<Edge, vector<double>,boost::hash<Edge>>::iterator iterE;
-	vector<OlLabel*> allCreatedLabels;
+	OlLabelArena labels(k);
+    PriorityQueueAS2 queue((AstarComparator2(labels)));
 
-    pair<Path,vector<double>> resDijkstra= dijkstra_path_and_bounds(rN,source,target);	
+    pair<Path,shared_ptr<const TargetBounds>> resDijkstra= dijkstra_path_and_bounds(rN,source,target,context);	
+    const vector<double> &bounds = resDijkstra.second->distances;
     Path resNext = resDijkstra.first;
     
+    // Mfolini: No paths if the target cannot be reached.
+    if(resNext.nodes.empty())
+    	return resPaths;
+    
     resPaths.push_back(resNext);
-    double newLowerBound = resDijkstra.second[source];
+    if(!context.found(resNext))
+    	return resPaths;
+    double newLowerBound = bounds[source];
     
     // Only the shortest path is requested
     if(k==1)
@@ -47,25 +52,19 @@ vector<Path> onepass(RoadNetwork *rN, NodeID source, NodeID target, double k, do
     }
     count++;
 		
-    newOverlap.resize(k, 0);
-    queue.push(new OlLabel(source, newLength, newLowerBound, newOverlap, -1));
+    queue.push(labels.add(source, newLength, newLowerBound, -1, -1));
         
     while(!queue.empty()) {
-    	OlLabel* curLabel = static_cast<OlLabel*> (queue.top());
+    	int curLabel = queue.top();
     	queue.pop();
+    	if(!context.pop())
+    		break;
     	    	
-    	if(curLabel->overlapForK < count-1) {
+    	if(labels.overlapForK[curLabel] < count-1) {
     		check = true;
     		
-    		OlLabel *tempLabel = curLabel;
-    		
-        	Path tempPath;
-        	while(tempLabel != NULL) {
-               	tempPath.nodes.push_back(tempLabel->node_id);
-    			tempLabel = static_cast<OlLabel*> (tempLabel->previous);
-    		}
-    		
-    		reverse(tempPath.nodes.begin(),tempPath.nodes.end());
+        	Path tempPath = labels.path(curLabel);
+        	double *curOverlap = labels.overlapList(curLabel);
     		
     		for(double j=0;j<tempPath.nodes.size()-1 && check;j++) {
     			edge = make_pair(tempPath.nodes[j],tempPath.nodes[j+1]);
@@ -73,9 +72,9 @@ vector<Path> onepass(RoadNetwork *rN, NodeID source, NodeID target, double k, do
     				for(double i = 0; i < iterE->second.size(); i++) {
                         resid = iterE->second[i];
                         
-                        if (resid > curLabel->overlapForK && resid < count) {
-                        	curLabel->overlapList[resid] += rN->getEdgeWeight(edge.first,edge.second);
-                            if (curLabel->overlapList[resid]/resPaths[resid].length > theta) {
+                        if (resid > labels.overlapForK[curLabel] && resid < count) {
+                        	curOverlap[resid] += rN->getEdgeWeight(edge.first,edge.second);
+                            if (curOverlap[resid]/resPaths[resid].length > theta) {
                                 check = false;
                                 break;
                             }
@@ -83,24 +82,19 @@ vector<Path> onepass(RoadNetwork *rN, NodeID source, NodeID target, double k, do
                     }
     			}
     		}
-    		curLabel->overlapForK = count-1;
-            if (!check)
+    		labels.overlapForK[curLabel] = count-1;
+            if (!check) {
+                context.overlapRejections++;
                 continue;
+            }
    		}
    		
-   		if (curLabel->node_id == target) { // Found target.
+   		if (labels.nodeId[curLabel] == target) { // Found target.
    			                
-        	OlLabel *tempLabel = curLabel;
-        	Path tempPath;
-        	while(tempLabel != NULL) {
-               	tempPath.nodes.push_back(tempLabel->node_id);
-    			tempLabel = static_cast<OlLabel*> (tempLabel->previous);
-    		}
-    		reverse(tempPath.nodes.begin(),tempPath.nodes.end());
-    		tempPath.length = curLabel->length;
+        	Path tempPath = labels.path(curLabel);
     		resPaths.push_back(tempPath);
     		        
-    		if (count == k-1)
+    		if (!context.found(tempPath) || count == k-1)
         		break;        
     		        		
         	for(double j = 0; j < tempPath.nodes.size()-1; j++) {
@@ -114,31 +108,32 @@ vector<Path> onepass(RoadNetwork *rN, NodeID source, NodeID target, double k, do
             count++;
    		}
    		else { // Expand Search
+   			NodeID curNode = labels.nodeId[curLabel];
    			// For each outgoing edge
-   			for(iterAdj = rN->adjListOut[curLabel->node_id].begin(); iterAdj != rN->adjListOut[curLabel->node_id].end(); iterAdj++) {
+   			for (EdgeID iterAdj = rN->outOffsets[curNode]; iterAdj < rN->outOffsets[curNode+1]; iterAdj++) {
+   				if(context.disabled(rN->outEdges[iterAdj]))
+   					continue;
+   				NodeID adjNode = rN->outNodes[iterAdj];
                  // Avoid cycles.
-                bool containsLoop = false;
-                OlLabel *tempLabel = curLabel;
-                while(tempLabel != NULL) {
-                	if(tempLabel->node_id == iterAdj->first) {
-                		containsLoop = true;
-                		break;
-                	}
-    				tempLabel = static_cast<OlLabel*> (tempLabel->previous);
-    			}
-    			if(!containsLoop) {
+    			if(!labels.pathContains(curLabel, adjNode)) {
     				
-                	newLength = curLabel->length + iterAdj->second;;
-					newOverlap = curLabel->overlapList;
-					newLowerBound = newLength + resDijkstra.second[iterAdj->first];
-					OlLabel* newPrevious = curLabel;
-					edge = make_pair(curLabel->node_id,iterAdj->first);
+					// Mfolini: Nodes without a bound cannot reach the target (within the bounds radius).
+					if(bounds[adjNode] == DBL_MAX)
+						continue;
+                	newLength = labels.length[curLabel] + rN->outWeight(iterAdj);
+					newLowerBound = newLength + bounds[adjNode];
+					edge = make_pair(curNode,adjNode);
 					check = true;
+					
+					// The new label starts with the overlap vector of its predecessor and is dropped again if it
+					// exceeds the threshold.
+					int label = labels.add(adjNode, newLength, newLowerBound, (count-1), curLabel);
+					double *newOverlap = labels.overlapList(label);
 
                     if ((iterE = resEdges.find(edge)) != resEdges.end()) {
                         for(double j = 0; j < iterE->second.size(); j++) {
-                            newOverlap[iterE->second[j]] += iterAdj->second;
-                            if (newOverlap[iterE->second[j]]/resPaths[iterE->second[j]].length > theta) {
+                            newOverlap[int(iterE->second[j])] += rN->outWeight(iterAdj);
+                            if (newOverlap[int(iterE->second[j])]/resPaths[iterE->second[j]].length > theta) {
                                 check = false;
                                 break;
                             }
@@ -146,18 +141,19 @@ vector<Path> onepass(RoadNetwork *rN, NodeID source, NodeID target, double k, do
                     }
                     
                     if (check) {
-                    	OlLabel* label = new OlLabel(iterAdj->first, newLength, newLowerBound, newOverlap, (count-1), newPrevious);
                         queue.push(label);
-                        allCreatedLabels.push_back(label);
-               		}
+                        context.addLabel();
+                    }
+                    else {
+                    	labels.pop();
+                    	context.overlapRejections++;
+                    }
                 } 
             }
    		}
     }
     
 	resEdges.clear();
-    for(double i=0;i<allCreatedLabels.size();i++)
-    	delete allCreatedLabels[i];
     
     return resPaths;
 }
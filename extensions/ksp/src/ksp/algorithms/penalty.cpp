@@ -0,0 +1,146 @@
+/*
+Copyright (c) 2017 Theodoros Chondrogiannis
+*/
+
+#include "kspwlo.hpp"
+
+// Mfolini: Factor by which the weights of the edges of every path found are multiplied, and number of rounds per
+// requested path after which the penalty method gives up.
+static const double PENALTY_FACTOR = 1.4;
+static const int PENALTY_ROUNDS_PER_PATH = 10;
+
+// Mfolini: Per-query search state, reset between the rounds for the touched nodes only.
+class PenaltySearch {
+public:
+	vector<double> distances;
+	vector<EdgeID> previous; // Position of the edge the node was reached over, -1 for the source
+	vector<char> settled;
+	vector<NodeID> touched;
+	
+	PenaltySearch(int numNodes) : distances(numNodes, DBL_MAX), previous(numNodes, -1), settled(numNodes, 0) {};
+	
+	void reset() {
+		for(size_t i=0;i<touched.size();i++) {
+			distances[touched[i]] = DBL_MAX;
+			previous[touched[i]] = -1;
+			settled[touched[i]] = 0;
+		}
+		touched.clear();
+	};
+};
+
+/*
+ *
+ *	penalized_astar(RoadNetwork*, NodeID, NodeID, vector<double>, vector<double>, PenaltySearch, SearchContext)
+ *	-----
+ *	Mfolini: A* search from the source to the target on the penalized weights.
+ *	The distances to the target for the original weights remain lower bounds,
+ *	as the penalties only increase the weights. The length of the returned
+ *	path is measured with the original weights.
+ *
+ */
+
+static Path penalized_astar(RoadNetwork *rN, NodeID source, NodeID target, const vector<double> &bounds, const vector<double> &penalized,
+		PenaltySearch &search, SearchContext &context) {
+	Path resPath;
+	priority_queue< pair<double,NodeID>, vector< pair<double,NodeID> >, greater< pair<double,NodeID> > > queue;
+	
+	search.reset();
+	search.distances[source] = 0;
+	search.touched.push_back(source);
+	queue.push(make_pair(bounds[source], source));
+	
+	while(!queue.empty()) {
+		NodeID node = queue.top().second;
+		queue.pop();
+		if(!context.pop())
+			return resPath;
+		if(search.settled[node])
+			continue;
+		search.settled[node] = 1;
+		
+		if(node == target) {
+			vector<EdgeID> positions;
+			for(NodeID cur = target; search.previous[cur] != -1; cur = rN->outSource(search.previous[cur])) {
+				resPath.nodes.push_back(cur);
+				positions.push_back(search.previous[cur]);
+			}
+			resPath.nodes.push_back(source);
+			reverse(resPath.nodes.begin(),resPath.nodes.end());
+			resPath.length = 0;
+			for(size_t i=positions.size();i>0;i--)
+				resPath.length += rN->outWeight(positions[i-1]);
+			return resPath;
+		}
+		
+		for(EdgeID iterAdj = rN->outOffsets[node]; iterAdj < rN->outOffsets[node+1]; iterAdj++) {
+			if(context.disabled(rN->outEdges[iterAdj]))
+				continue;
+			NodeID adjNode = rN->outNodes[iterAdj];
+			double newLength = search.distances[node] + penalized[rN->outEdges[iterAdj]];
+			if(bounds[adjNode] == DBL_MAX || newLength >= search.distances[adjNode])
+				continue;
+			if(search.distances[adjNode] == DBL_MAX)
+				search.touched.push_back(adjNode);
+			search.distances[adjNode] = newLength;
+			search.previous[adjNode] = iterAdj;
+			queue.push(make_pair(newLength + bounds[adjNode], adjNode));
+			context.addLabel();
+		}
+	}
+	return resPath;
+}
+
+/*
+ *
+ *	penalty(RoadNetwork*, NodeID, NodeID, double, double)
+ *	-----
+ *	Mfolini: Implementation of the penalty method. Shortest paths are computed
+ *	repeatedly, each time after the weights of the edges of the previous path
+ *	have been multiplied by PENALTY_FACTOR, which pushes the next search onto
+ *	other roads. A path is added to the result if its overlap with every
+ *	path found so far is at most theta. The weights of the road network are
+ *	not modified, the penalties are applied to a copy.
+ *
+ */
+
+vector<Path> penalty(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta, SearchContext &context) {
+	vector<Path> resPaths;
+
+	pair<Path,shared_ptr<const TargetBounds>> resDijkstra = dijkstra_path_and_bounds(rN,source,target,context);
+	if(resDijkstra.first.nodes.empty())
+		return resPaths;
+	resPaths.push_back(resDijkstra.first);
+	if(!context.found(resPaths.back()) || k==1)
+		return resPaths;
+
+	vector<double> penalized(rN->weights);
+	PenaltySearch search(rN->numNodes);
+	Path lastPath = resDijkstra.first;
+	lastPath.index_edges(rN);
+
+	for(double round=0;round<k*PENALTY_ROUNDS_PER_PATH && resPaths.size()<k;round++) {
+		for(size_t i=0;i<lastPath.edgeIds.size();i++)
+			penalized[lastPath.edgeIds[i]] *= PENALTY_FACTOR;
+
+		lastPath = penalized_astar(rN,source,target,resDijkstra.second->distances,penalized,search,context);
+		if(context.exhausted() || lastPath.nodes.empty())
+			break;
+		lastPath.index_edges(rN);
+
+		bool check = true;
+		for(size_t j=0;j<resPaths.size();j++) {
+			if(lastPath.overlap_ratio(rN,resPaths[j]) > theta || lastPath.edgeIds == resPaths[j].edgeIds) {
+				check = false;
+				context.overlapRejections++;
+				break;
+			}
+		}
+		if(check) {
+			resPaths.push_back(lastPath);
+			if(!context.found(lastPath))
+				break;
+		}
+	}
+	return resPaths;
+}
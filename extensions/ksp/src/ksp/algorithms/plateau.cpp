@@ -0,0 +1,223 @@
+/*
+Copyright (c) 2017 Theodoros Chondrogiannis
+*/
+
+#include "kspwlo.hpp"
+
+// Mfolini: Route through the end node of a plateau, i.e. the forward tree path to it followed by the backward tree path
+// from it to the target.
+class PlateauCandidate {
+public:
+	double length;
+	double plateauLength;
+	NodeID end;
+
+	bool operator<(const PlateauCandidate &other) const {
+		if(length != other.length)
+			return length < other.length;
+		return plateauLength > other.plateauLength;
+	}
+};
+
+// Mfolini: Length shared with a result path of the forward tree path to every node (prefix) and of the backward tree
+// path from every node (suffix). Their sum is the overlap of a simple candidate route with the result path.
+class PlateauOverlap {
+public:
+	double length;
+	vector<double> prefix;
+	vector<double> suffix;
+};
+
+/*
+ *
+ *	plateau_overlap(RoadNetwork*, Path, vector<NodeID>, vector<NodeID>, vector<EdgeID>, vector<NodeID>)
+ *	-----
+ *	Mfolini: Computes the shared lengths of the forward and backward tree paths
+ *	with the given path for the nodes settled by the forward search.
+ *
+ */
+
+static PlateauOverlap plateau_overlap(RoadNetwork *rN, Path &path, const vector<NodeID> &order, const vector<NodeID> &parent,
+		const vector<EdgeID> &parentPos, const vector<NodeID> &nextHop) {
+	PlateauOverlap overlap;
+	overlap.length = path.length;
+	overlap.prefix.assign(rN->numNodes, 0);
+	overlap.suffix.assign(rN->numNodes, -1);
+
+	path.index_edges(rN);
+	vector<char> onPath(rN->numEdges, 0);
+	for(size_t i=0;i<path.edgeIds.size();i++)
+		onPath[path.edgeIds[i]] = 1;
+
+	for(size_t i=0;i<order.size();i++) {
+		NodeID node = order[i];
+		if(parent[node] == -1)
+			continue;
+		EdgeID pos = parentPos[node];
+		overlap.prefix[node] = overlap.prefix[parent[node]] + (onPath[rN->outEdges[pos]] ? rN->outWeight(pos) : 0);
+	}
+
+	vector<NodeID> stack;
+	for(size_t i=0;i<order.size();i++) {
+		NodeID node = order[i];
+		while(node != -1 && overlap.suffix[node] < 0) {
+			stack.push_back(node);
+			node = nextHop[node];
+		}
+		double shared = node == -1 ? 0 : overlap.suffix[node];
+		while(!stack.empty()) {
+			NodeID cur = stack.back();
+			stack.pop_back();
+			if(nextHop[cur] != -1) {
+				EdgeID edge = rN->getEdgeID(cur, nextHop[cur]);
+				if(onPath[edge])
+					shared += rN->weights[edge];
+			}
+			overlap.suffix[cur] = shared;
+		}
+	}
+	return overlap;
+}
+
+/*
+ *
+ *	plateau(RoadNetwork*, NodeID, NodeID, double, double)
+ *	-----
+ *	Mfolini: Implementation of the plateau method. A forward shortest path
+ *	tree from the source is intersected with the backward shortest path
+ *	tree towards the target. The edges contained in both form plateaus,
+ *	i.e. chains along which both trees coincide. Every plateau gives the
+ *	route through it, which consists of the forward tree path to its end
+ *	followed by the backward tree path from there. The routes are tried by
+ *	increasing length (longer plateaus first on ties) and added to the
+ *	result if they are simple and their overlap with every path found so far
+ *	is at most theta. The overlaps are first estimated from the shared
+ *	lengths accumulated along both trees, so only promising routes are
+ *	built.
+ *
+ */
+
+vector<Path> plateau(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta, SearchContext &context) {
+	vector<Path> resPaths;
+
+	double start = context.elapsed();
+	shared_ptr<const TargetBounds> bounds = target_bounds(rN, target, source, context);
+	context.boundsSeconds += context.elapsed() - start;
+	const vector<double> &distancesB = bounds->distances;
+	const vector<NodeID> &nextHop = bounds->nextHop;
+
+	if(distancesB[source] == DBL_MAX)
+		return resPaths;
+	Path sp;
+	sp.length = distancesB[source];
+	for(NodeID node = source; node != -1; node = nextHop[node])
+		sp.nodes.push_back(node);
+	resPaths.push_back(sp);
+	if(!context.found(sp) || k==1)
+		return resPaths;
+
+	// Forward shortest path tree, restricted to the nodes which can reach the target.
+	priority_queue< pair<double,NodeID>, vector< pair<double,NodeID> >, greater< pair<double,NodeID> > > queue;
+	vector<double> distancesF(rN->numNodes, DBL_MAX);
+	vector<NodeID> parent(rN->numNodes, -1);
+	vector<EdgeID> parentPos(rN->numNodes, -1);
+	vector<char> settled(rN->numNodes, 0);
+	vector<NodeID> order;
+	distancesF[source] = 0;
+	queue.push(make_pair(0.0, source));
+	while(!queue.empty()) {
+		NodeID node = queue.top().second;
+		queue.pop();
+		if(!context.pop())
+			return resPaths;
+		if(settled[node])
+			continue;
+		settled[node] = 1;
+		order.push_back(node);
+		for(EdgeID iterAdj = rN->outOffsets[node]; iterAdj < rN->outOffsets[node+1]; iterAdj++) {
+			if(context.disabled(rN->outEdges[iterAdj]))
+				continue;
+			NodeID adjNode = rN->outNodes[iterAdj];
+			double newLength = distancesF[node] + rN->outWeight(iterAdj);
+			if(distancesB[adjNode] == DBL_MAX || newLength >= distancesF[adjNode])
+				continue;
+			distancesF[adjNode] = newLength;
+			parent[adjNode] = node;
+			parentPos[adjNode] = iterAdj;
+			queue.push(make_pair(newLength, adjNode));
+			context.addLabel();
+		}
+	}
+
+	// The edge parent[v] -> v is part of a plateau if it is also the first edge of the backward tree path from
+	// parent[v]. Every node at which a plateau ends gives a candidate.
+	vector<PlateauCandidate> candidates;
+	for(size_t i=0;i<order.size();i++) {
+		NodeID node = order[i];
+		if(parent[node] == -1 || nextHop[parent[node]] != node)
+			continue;
+		if(nextHop[node] != -1 && parent[nextHop[node]] == node)
+			continue;
+		NodeID first = parent[node];
+		while(parent[first] != -1 && nextHop[parent[first]] == first)
+			first = parent[first];
+		PlateauCandidate candidate;
+		candidate.length = distancesF[node] + distancesB[node];
+		candidate.plateauLength = distancesF[node] - distancesF[first];
+		candidate.end = node;
+		candidates.push_back(candidate);
+	}
+	sort(candidates.begin(), candidates.end());
+
+	vector<PlateauOverlap> overlaps;
+	overlaps.push_back(plateau_overlap(rN, resPaths[0], order, parent, parentPos, nextHop));
+	vector<char> onRoute(rN->numNodes, 0);
+	for(size_t c=0;c<candidates.size() && resPaths.size()<k;c++) {
+		NodeID end = candidates[c].end;
+		bool check = true;
+		for(size_t j=0;j<overlaps.size();j++) {
+			if(overlaps[j].prefix[end] + overlaps[j].suffix[end] > theta * overlaps[j].length * (1 + 1e-9)) {
+				check = false;
+				context.overlapRejections++;
+				break;
+			}
+		}
+		if(!check)
+			continue;
+
+		// The backward tree path must not return to a node of the forward tree path.
+		Path route;
+		for(NodeID node = end; node != -1; node = parent[node]) {
+			route.nodes.push_back(node);
+			onRoute[node] = 1;
+		}
+		reverse(route.nodes.begin(), route.nodes.end());
+		route.length = distancesF[end];
+		for(NodeID node = end; nextHop[node] != -1 && check; node = nextHop[node]) {
+			if(onRoute[nextHop[node]])
+				check = false;
+			route.nodes.push_back(nextHop[node]);
+			route.length += rN->getEdgeWeight(node, nextHop[node]);
+		}
+		for(NodeID node = end; node != -1; node = parent[node])
+			onRoute[node] = 0;
+		if(!check)
+			continue;
+
+		for(size_t j=0;j<resPaths.size();j++) {
+			if(route.overlap_ratio(rN,resPaths[j]) > theta || route.edgeIds == resPaths[j].edgeIds) {
+				check = false;
+				context.overlapRejections++;
+				break;
+			}
+		}
+		if(check) {
+			resPaths.push_back(route);
+			if(!context.found(route))
+				break;
+			if(resPaths.size() < k)
+				overlaps.push_back(plateau_overlap(rN, resPaths.back(), order, parent, parentPos, nextHop));
+		}
+	}
+	return resPaths;
+}
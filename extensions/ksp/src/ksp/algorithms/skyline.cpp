@@ -4,48 +4,68 @@ Copyright (c) 2017 Theodoros Chondrogiannis
 
 #include "kspwlo.hpp"
 
-void SkylineContainer::insert(OlLabel* msv) {
-	if(!this->contains(msv->node_id)) {
-		vector<OlLabel*> newVector;
-		newVector.push_back(msv);
-		container.insert(make_pair(msv->node_id,newVector));
-	}
-	else {
-		container[msv->node_id].push_back(msv);
+void SkylineContainer::insert(int msv) {
+	NodeID node = arena->nodeId[msv];
+	if(slots[node] == -1) {
+		slots[node] = skylines.size();
+		skylines.push_back(NodeSkyline());
 	}
+	NodeSkyline &skyline = skylines[slots[node]];
+	size_t stride = arena->width + 1;
+	const double *overlap = arena->overlapList(msv);
+	double sum = 0;
+	for(size_t j=0;j<arena->width;j++)
+		sum += overlap[j];
+	
+	size_t pos = skyline.labels.size();
+	while(pos > 0 && skyline.packed[(pos-1)*stride] > sum)
+		pos--;
+	skyline.labels.insert(skyline.labels.begin()+pos, msv);
+	skyline.packed.insert(skyline.packed.begin()+pos*stride, stride, sum);
+	copy(overlap, overlap+arena->width, skyline.packed.begin()+pos*stride+1);
 }
 
-bool SkylineContainer::contains(double id) {
-	if(container.find(id) != container.end())
-		return true;
-	return false;
+bool SkylineContainer::contains(NodeID id) {
+	return slots[id] != -1;
 }
 
-vector<OlLabel*> SkylineContainer::get(double id) {
-	return container[id];
+const vector<int> &SkylineContainer::get(NodeID id) {
+	static const vector<int> empty;
+	return slots[id] == -1 ? empty : skylines[slots[id]].labels;
 }
 
 long SkylineContainer::contentsSize() {
 	long contentsSize = 0;
 	
-	for(unordered_map<double,vector<OlLabel*>>::iterator iterator = container.begin(); iterator != container.end(); iterator++) {
-		contentsSize += iterator->second.size();
-	}
+	for(size_t i=0;i<skylines.size();i++)
+		contentsSize += skylines[i].labels.size();
 
 	return contentsSize;
 }
 
-bool SkylineContainer::dominates(OlLabel* current) {
-	
-	if(!this->contains(current->node_id))
+// Mfolini: A stored label dominates the current one if none of its overlaps is larger. Its overlap sum is then not
+// larger either (floating point addition in the same order is monotone), so the scan ends at the first stored label
+// with a larger sum.
+bool SkylineContainer::dominates(int current) {
+	int slot = slots[arena->nodeId[current]];
+	if(slot == -1)
 		return false;
 
-	for(double i=0;i<container[current->node_id].size();i++) {
-		OlLabel* temp = container[current->node_id].at(i);
+	const NodeSkyline &skyline = skylines[slot];
+	size_t stride = arena->width + 1;
+	const double *currentOverlap = arena->overlapList(current);
+	double sum = 0;
+	for(size_t j=0;j<arena->width;j++)
+		sum += currentOverlap[j];
+	
+	for(size_t i=0;i<skyline.labels.size();i++) {
+		const double *temp = &skyline.packed[i*stride];
+		if(temp[0] > sum)
+			break;
 		bool flag = true;
 		
-		for(double j=0;j<current->overlapList.size();j++) {
-			if(current->overlapList[j] < temp->overlapList[j]) {
+		for(size_t j=0;j<arena->width;j++) {
+			if(currentOverlap[j] < temp[j+1]) {
 				flag = false;
 				break;
 			}
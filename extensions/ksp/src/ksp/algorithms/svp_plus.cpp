@@ -27,7 +27,7 @@ typedef priority_queue<SvpLabel,std::vector<SvpLabel>,SvpLabelComparator> SvpLab
  *
  */
 
-vector<Path> svp_plus(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta) {
+vector<Path> svp_plus(RoadNetwork *rN, NodeID source, NodeID target, double k, double theta, SearchContext &context) {
 	vector<Path> resPathsFinal;
 	SvpLabelQueue svpQueue;
 	vector<pair<Label*,Label*>> svpLabels(rN->numNodes);
@@ -38,9 +38,8 @@ vector<Path> svp_plus(RoadNetwork *rN, NodeID source, NodeID target, double k, d
 	
     PriorityQueue queue;
     double newLength = 0;
-    EdgeList::iterator iterAdj;
-    vector<NodeID> distancesF(rN->numNodes, DBL_MAX);
-    vector<NodeID> distancesB(rN->numNodes, DBL_MAX);
+    vector<double> distancesF(rN->numNodes, DBL_MAX);
+    vector<double> distancesB(rN->numNodes, DBL_MAX);
     
     Label* tempLabel = NULL;
     distancesF[source]=0;
@@ -55,6 +54,8 @@ vector<Path> svp_plus(RoadNetwork *rN, NodeID source, NodeID target, double k, d
     while (!queue.empty()) {
         Label* curLabel = queue.top();
         queue.pop();
+        if (!context.pop())
+            break;
         
         if (resPaths[curLabel->node_id].length != -1)
             continue;
@@ -72,13 +73,16 @@ vector<Path> svp_plus(RoadNetwork *rN, NodeID source, NodeID target, double k, d
         
         else { // Expand search
             // For each outgoing edge.
-            for (iterAdj = rN->adjListOut[curLabel->node_id].begin(); iterAdj != rN->adjListOut[curLabel->node_id].end(); iterAdj++) {
-                newLength = curLabel->length + iterAdj->second;
+            for (EdgeID iterAdj = rN->outOffsets[curLabel->node_id]; iterAdj < rN->outOffsets[curLabel->node_id+1]; iterAdj++) {
+                if(context.disabled(rN->outEdges[iterAdj]))
+                    continue;
+                newLength = curLabel->length + rN->outWeight(iterAdj);
                 Label* newPrevious = curLabel;
-                if (distancesF[iterAdj->first] > newLength) {
-                	Label* label = new Label(iterAdj->first, newLength, newPrevious);
+                if (distancesF[rN->outNodes[iterAdj]] > newLength) {
+                	Label* label = new Label(rN->outNodes[iterAdj], newLength, newPrevious);
                 	allCreatedLabels.push_back(label);
                     queue.push(label);
+                    context.addLabel();
                 }
             }
         }
@@ -101,6 +105,8 @@ vector<Path> svp_plus(RoadNetwork *rN, NodeID source, NodeID target, double k, d
     while (!queue.empty()) {
         Label* curLabel = queue.top();
         queue.pop();
+        if (!context.pop())
+            break;
         
         if (visited[curLabel->node_id])
             continue;
@@ -116,23 +122,39 @@ vector<Path> svp_plus(RoadNetwork *rN, NodeID source, NodeID target, double k, d
         
         else { // Expand search
             // For each outgoing edge.
-            for (iterAdj = rN->adjListInc[curLabel->node_id].begin(); iterAdj != rN->adjListInc[curLabel->node_id].end(); iterAdj++) {
-                newLength = curLabel->length + iterAdj->second;
+            for (EdgeID iterAdj = rN->incOffsets[curLabel->node_id]; iterAdj < rN->incOffsets[curLabel->node_id+1]; iterAdj++) {
+                if(context.disabled(rN->incEdges[iterAdj]))
+                    continue;
+                newLength = curLabel->length + rN->incWeight(iterAdj);
                 Label* newPrevious = curLabel;
-                if (distancesB[iterAdj->first] > newLength) {
-                	Label* label = new Label(iterAdj->first, newLength, newPrevious);
+                if (distancesB[rN->incNodes[iterAdj]] > newLength) {
+                	Label* label = new Label(rN->incNodes[iterAdj], newLength, newPrevious);
                 	allCreatedLabels.push_back(label);
                     queue.push(label);
+                    context.addLabel();
                 }
             }
         }
     }
+    // Mfolini: No paths are known before both searches completed.
+    if(context.exhausted()) {
+    	for(double i=0;i<allCreatedLabels.size();i++)
+    		delete allCreatedLabels[i];
+    	return resPathsFinal;
+    }
+    
     //sort(resSimplePathsOrdered.begin(),resSimplePathsOrdered.end());
     for(double i=0;i<rN->numNodes;i++) {
     	if(svpLabels[i].first == NULL || svpLabels[i].second == NULL)
     		continue;
     	svpQueue.push(svpLabels[i]);
     }
+    // Mfolini: No paths if the target cannot be reached.
+    if(svpQueue.empty()) {
+    	for(double i=0;i<allCreatedLabels.size();i++)
+    		delete allCreatedLabels[i];
+    	return resPathsFinal;
+    }
     
     // Adding shortest path to the result set
     Path sp;
@@ -151,8 +173,9 @@ vector<Path> svp_plus(RoadNetwork *rN, NodeID source, NodeID target, double k, d
     }
     resPathsFinal.push_back(sp);
     svpQueue.pop();
+    context.found(sp);
     			
-	while(resPathsFinal.size()<k && !svpQueue.empty()) {
+	while(resPathsFinal.size()<k && !svpQueue.empty() && !context.exhausted()) {
 		Path tempP;
 		SvpLabel svpLabelCurrent = svpQueue.top();
 		
@@ -187,13 +210,14 @@ vector<Path> svp_plus(RoadNetwork *rN, NodeID source, NodeID target, double k, d
 			
 		for(double k=0;k<resPathsFinal.size();k++) {
 			if(tempP.overlap_ratio(rN,resPathsFinal[k]) > theta) {
-				check = false;					
+				check = false;
+				context.overlapRejections++;
 				break;
 			}
 		} 
 		if(check) {
 			resPathsFinal.push_back(tempP);
-			if(resPathsFinal.size() == k)
+			if(!context.found(tempP) || resPathsFinal.size() == k)
 				break;
 		}
 	}
@@ -1,10 +1,340 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+#include <pybind11/numpy.h>
 #include "ksp.hpp"
 
 namespace py = pybind11;
 
+typedef py::array_t<double, py::array::c_style | py::array::forcecast> DoubleArray;
+typedef py::array_t<NodeID, py::array::c_style | py::array::forcecast> NodeIDArray;
+typedef py::array_t<EdgeID, py::array::c_style | py::array::forcecast> EdgeIDArray;
+
+// Numpy view on a vector owned by the C++ object wrapped by self. The view keeps self alive.
+template <typename T>
+py::array_t<T> vector_view(py::object self, vector<T> &v) {
+    return py::array_t<T>(v.size(), v.data(), self);
+}
+
+vector< pair<NodeID,NodeID> > to_query_pairs(NodeIDArray queries) {
+    if (queries.ndim() != 2 || queries.shape(1) != 2)
+        throw std::invalid_argument("queries must be an array of shape (n, 2) containing (source, target) pairs");
+    auto q = queries.unchecked<2>();
+    vector< pair<NodeID,NodeID> > pairs;
+    for (size_t i = 0; i < size_t(q.shape(0)); i++)
+        pairs.push_back(make_pair(q(i, 0), q(i, 1)));
+    return pairs;
+}
+
+// Edges disabled for a query, given either as a boolean array with one entry per edge id (True disables the edge) or as
+// the ids of the disabled edges (an array, list or set). None disables no edge. Of several parallel edges the road
+// network only links one, which is disabled once all of them are. Disabling it while a parallel edge of another weight
+// stays enabled raises ValueError (see RoadNetwork::linkDisabledEdges).
+shared_ptr<const vector<char>> to_disabled_edges(RoadNetwork &rN, py::object edges) {
+    if (edges.is_none())
+        return shared_ptr<const vector<char>>();
+    if (py::isinstance<py::set>(edges))
+        edges = py::list(edges);
+    py::array array = py::array::ensure(edges);
+    if (!array || array.ndim() != 1)
+        throw std::invalid_argument("disabled_edges must be a 1d boolean mask or a collection of edge ids");
+    shared_ptr< vector<char> > disabled = make_shared< vector<char> >(rN.numEdges, 0);
+    if (array.dtype().kind() == 'b') {
+        if (array.size() != rN.numEdges)
+            throw std::invalid_argument("A boolean disabled_edges mask must have one entry per edge");
+        py::array_t<bool, py::array::c_style | py::array::forcecast> mask(array);
+        copy(mask.data(), mask.data() + mask.size(), disabled->begin());
+    }
+    else {
+        EdgeIDArray ids(array);
+        for (size_t i = 0; i < size_t(ids.size()); i++) {
+            if (ids.data()[i] < 0 || ids.data()[i] >= rN.numEdges)
+                throw std::out_of_range("Edge id out of range [0, numEdges)");
+            (*disabled)[ids.data()[i]] = 1;
+        }
+    }
+    rN.linkDisabledEdges(*disabled);
+    return disabled;
+}
+
+SearchContext make_context(int n_threads, long long max_labels, long long max_pops, double max_seconds, double bounds_radius,
+                           shared_ptr<CancellationToken> cancel_token, shared_ptr<const vector<char>> disabled_edges) {
+    if (bounds_radius != 0 && bounds_radius < 1)
+        throw std::invalid_argument("bounds_radius must be 0 (unlimited) or at least 1");
+    SearchContext context;
+    context.nThreads = n_threads;
+    context.maxLabels = max_labels;
+    context.maxPops = max_pops;
+    context.maxSeconds = max_seconds;
+    context.boundsRadius = bounds_radius;
+    context.cancelToken = cancel_token;
+    context.disabledEdges = disabled_edges;
+    return context;
+}
+
+// Returns (result, stats) if the stats were requested and the result only otherwise.
+template <typename Stats>
+py::object with_stats(py::object result, const Stats &stats, bool return_stats) {
+    if (return_stats)
+        return py::make_tuple(result, py::cast(stats));
+    return result;
+}
+
 
 PYBIND11_MODULE(ksp, m) {
-    m.def("k_shortest_paths", &k_shortest_paths);
-}
\ No newline at end of file
+    py::class_<RoadNetwork>(m, "RoadNetwork")
+        .def(py::init<const char *>(), py::arg("graph_file"))
+        .def(py::init([](int num_nodes, NodeIDArray sources, NodeIDArray targets, DoubleArray weights) {
+            if (sources.ndim() != 1 || sources.size() != targets.size() || sources.size() != weights.size())
+                throw std::invalid_argument("sources, targets and weights must be 1d arrays of equal length");
+            return new RoadNetwork(num_nodes, sources.size(), sources.data(), targets.data(), weights.data());
+        }), py::arg("num_nodes"), py::arg("sources"), py::arg("targets"), py::arg("weights"))
+        .def_readonly("num_nodes", &RoadNetwork::numNodes)
+        .def_readonly("num_edges", &RoadNetwork::numEdges)
+        // Writable numpy view on the edge weights (indexed by edge id, i.e. input order). No copy is made and
+        // the view keeps the graph alive, so weights can be changed in place between queries. Call weights_changed()
+        // afterwards, otherwise cached bounds computed for the old weights would still be used.
+        .def_property_readonly("weights", [](py::object self) {
+            return vector_view(self, self.cast<RoadNetwork &>().weights);
+        })
+        .def("update_weights", [](RoadNetwork &rN, EdgeIDArray edge_ids, DoubleArray weights) {
+            if (edge_ids.ndim() != 1 || edge_ids.size() != weights.size())
+                throw std::invalid_argument("edge_ids and weights must be 1d arrays of equal length");
+            rN.updateWeights(edge_ids.size(), edge_ids.data(), weights.data());
+        }, py::arg("edge_ids"), py::arg("weights"))
+        .def("weights_changed", &RoadNetwork::weightsChanged)
+        .def_readonly("weights_version", &RoadNetwork::weightsVersion)
+        // Number of targets for which the all-to-one search results are kept (least recently used are evicted first).
+        // The cache is disabled (0) by default.
+        .def_property("bounds_cache_size",
+            [](RoadNetwork &rN) { return rN.boundsCache.getCapacity(); },
+            [](RoadNetwork &rN, size_t size) { rN.boundsCache.setCapacity(size); })
+        .def("clear_bounds_cache", [](RoadNetwork &rN) { rN.boundsCache.clear(); })
+        // Number of ALT landmarks used by ESX to bound the searches of its edge priorities (0 disables them). The
+        // landmarks are computed on the first ESX query and reused as long as the weights do not decrease.
+        .def_property("num_landmarks",
+            [](RoadNetwork &rN) { return rN.landmarkCount; },
+            [](RoadNetwork &rN, int count) { rN.setLandmarkCount(count); })
+        // Computes the shortest paths and bounds of all queries with a customizable contraction hierarchy instead of
+        // Dijkstra. The hierarchy depends only on the node order and the topology. The order (a permutation of the
+        // node ids, most important last) is computed by nested dissection unless given, it can be read from cch_order
+        // and reused for other graphs with the same edges. After the weights changed, the hierarchy is re-customized
+        // on the next query.
+        .def("enable_cch", [](RoadNetwork &rN, py::object order) {
+            vector<NodeID> nodes;
+            if (!order.is_none()) {
+                NodeIDArray array = order.cast<NodeIDArray>();
+                if (array.ndim() != 1 || array.size() != rN.numNodes)
+                    throw std::invalid_argument("order must be a 1d array containing every node id exactly once");
+                nodes.assign(array.data(), array.data() + array.size());
+            }
+            py::gil_scoped_release release;
+            enable_cch(&rN, nodes);
+        }, py::arg("order") = py::none())
+        .def("disable_cch", [](RoadNetwork &rN) { disable_cch(&rN); })
+        .def_property_readonly("cch_order", [](RoadNetwork &rN) -> py::object {
+            if (!rN.cch)
+                return py::none();
+            return NodeIDArray(rN.cch->order.size(), rN.cch->order.data());
+        })
+        // Writes the graph with its current weights to a binary file. RoadNetwork(graph_file) maps such a file instead of
+        // parsing it, so processes opening the same file share one page-cached copy of the adjacency.
+        .def("save", &RoadNetwork::save, py::arg("graph_file"), py::call_guard<py::gil_scoped_release>())
+        // Binary graph file the graph was opened from, None if it was built from text or arrays.
+        .def_property_readonly("path", [](RoadNetwork &rN) -> py::object {
+            if (rN.mappedPath.empty())
+                return py::none();
+            return py::str(rN.mappedPath);
+        })
+        // Returns a PathStream which yields the paths of the query one by one as soon as they are final, see k_shortest_paths
+        // for the algorithms and the other arguments. k bounds the number of paths, iterating can stop before. The search
+        // runs on a native thread without holding the GIL and at most one path ahead of the consumer, so breaking off early
+        // saves the rest of the search. Closing the stream (or dropping it) stops the search.
+        .def("iter_paths", [](RoadNetwork &rN, NodeID source, NodeID target, double theta, string algo, double k, long long max_labels,
+                              long long max_pops, double max_seconds, double bounds_radius, shared_ptr<CancellationToken> cancel_token,
+                              py::object disabled_edges) {
+            return new PathStream(rN, k, theta, source, target, algo, make_context(1, max_labels, max_pops, max_seconds, bounds_radius,
+                                  cancel_token, to_disabled_edges(rN, disabled_edges)));
+        }, py::keep_alive<0, 1>(), py::arg("source"), py::arg("target"), py::arg("theta"), py::arg("algo"), py::arg("k") = 10,
+           py::arg("max_labels") = 0, py::arg("max_pops") = 0, py::arg("max_seconds") = 0.0, py::arg("bounds_radius") = 0.0,
+           py::arg("cancel_token") = py::none(), py::arg("disabled_edges") = py::none())
+        // Graphs opened from a binary file are pickled by path, so sending one to a worker process does not copy the
+        // adjacency. The weights are only included if they were changed (see weights_changed) and the settings are
+        // restored, the caches are not.
+        .def(py::pickle(
+            [](py::object self) {
+                RoadNetwork &rN = self.cast<RoadNetwork &>();
+                if (rN.mappedPath.empty())
+                    throw std::runtime_error("Only graphs opened from a binary graph file can be pickled, see RoadNetwork.save");
+                py::object weights = py::none();
+                if (rN.weightsVersion > 0)
+                    weights = DoubleArray(rN.weights.size(), rN.weights.data());
+                return py::make_tuple(rN.mappedPath, weights, rN.boundsCache.getCapacity(), rN.landmarkCount,
+                                      self.attr("cch_order"));
+            },
+            [](py::tuple state) {
+                if (state.size() != 5)
+                    throw std::runtime_error("Invalid RoadNetwork state");
+                unique_ptr<RoadNetwork> rN(new RoadNetwork(state[0].cast<string>().c_str()));
+                if (!state[1].is_none()) {
+                    DoubleArray weights = state[1].cast<DoubleArray>();
+                    if (weights.ndim() != 1 || weights.size() != rN->numEdges)
+                        throw std::runtime_error("Graph file does not match the pickled weights");
+                    copy(weights.data(), weights.data() + weights.size(), rN->weights.begin());
+                    rN->weightsChanged();
+                }
+                rN->boundsCache.setCapacity(state[2].cast<size_t>());
+                rN->setLandmarkCount(state[3].cast<int>());
+                if (!state[4].is_none()) {
+                    NodeIDArray order = state[4].cast<NodeIDArray>();
+                    enable_cch(rN.get(), vector<NodeID>(order.data(), order.data() + order.size()));
+                }
+                return rN.release();
+            }));
+
+    // Why a query stopped. Anything but complete means that a budget ran out (or that a PathStream was closed) and only
+    // the paths found until then were returned.
+    py::enum_<SearchStatus>(m, "SearchStatus")
+        .value("complete", SEARCH_COMPLETE)
+        .value("label_budget", SEARCH_LABEL_BUDGET)
+        .value("pop_budget", SEARCH_POP_BUDGET)
+        .value("time_budget", SEARCH_TIME_BUDGET)
+        .value("stopped", SEARCH_STOPPED)
+        .value("cancelled", SEARCH_CANCELLED);
+
+    // Counters of a query, returned by k_shortest_paths(..., return_stats=True). The times are in seconds.
+    py::class_<SearchStats>(m, "SearchStats")
+        .def_readonly("status", &SearchStats::status)
+        .def_readonly("labels", &SearchStats::labels)
+        .def_readonly("pops", &SearchStats::pops)
+        .def_readonly("skyline_size", &SearchStats::skylineSize)
+        .def_readonly("dominance_rejections", &SearchStats::dominanceRejections)
+        .def_readonly("overlap_rejections", &SearchStats::overlapRejections)
+        .def_readonly("bounds_seconds", &SearchStats::boundsSeconds)
+        .def_readonly("search_seconds", &SearchStats::searchSeconds)
+        .def("__repr__", [](const SearchStats &s) {
+            return "SearchStats(labels=" + to_string(s.labels) + ", pops=" + to_string(s.pops) + ", skyline_size=" +
+                to_string(s.skylineSize) + ", dominance_rejections=" + to_string(s.dominanceRejections) + ", overlap_rejections=" +
+                to_string(s.overlapRejections) + ", bounds_seconds=" + to_string(s.boundsSeconds) + ", search_seconds=" +
+                to_string(s.searchSeconds) + ")";
+        });
+
+    // Bits of PathArrays.flags. A path with flags 0 has a finite length which equals the sum of its edge weights. The
+    // check uses the weights at the end of the query, so changing them during a query is reported as length_mismatch.
+    py::enum_<PathFlag>(m, "PathFlag", py::arithmetic())
+        .value("valid", PATH_VALID)
+        .value("non_finite", PATH_NON_FINITE)
+        .value("length_mismatch", PATH_LENGTH_MISMATCH);
+
+    // Cancels the queries it is passed to (cancel_token=...) once cancel() is called, e.g. from another Python thread or
+    // a scheduler. The searches poll it at every queue pop, a cancelled query raises QueryCancelled. A token can be shared
+    // by many queries and cannot be reset.
+    py::class_<CancellationToken, shared_ptr<CancellationToken>>(m, "CancellationToken")
+        .def(py::init<>())
+        .def("cancel", &CancellationToken::cancel)
+        .def_property_readonly("cancelled", &CancellationToken::isCancelled);
+    py::register_exception<QueryCancelled>(m, "QueryCancelled", PyExc_RuntimeError);
+
+    // Columnar result of k_shortest_paths(..., columnar=True). Path i consists of nodes[offsets[i]:offsets[i+1]] and
+    // traverses the edges edges[edge_offsets[i]:edge_offsets[i+1]], where the edge ids refer to the graph's input order.
+    // flags[i] holds the PathFlag bits of path i.
+    py::class_<PathArrays>(m, "PathArrays")
+        .def_property_readonly("nodes", [](py::object self) { return vector_view(self, self.cast<PathArrays &>().nodes); })
+        .def_property_readonly("offsets", [](py::object self) { return vector_view(self, self.cast<PathArrays &>().offsets); })
+        .def_property_readonly("lengths", [](py::object self) { return vector_view(self, self.cast<PathArrays &>().lengths); })
+        .def_property_readonly("edges", [](py::object self) { return vector_view(self, self.cast<PathArrays &>().edges); })
+        .def_property_readonly("edge_offsets", [](py::object self) { return vector_view(self, self.cast<PathArrays &>().edgeOffsets); })
+        .def_property_readonly("flags", [](py::object self) { return vector_view(self, self.cast<PathArrays &>().flags); })
+        .def_readonly("status", &PathArrays::status)
+        .def("__len__", &PathArrays::size);
+
+    // Iterator over the paths of a query, returned by RoadNetwork.iter_paths. stats is None until the query has finished. If
+    // the cancel_token fires, the next call raises QueryCancelled.
+    py::class_<PathStream>(m, "PathStream")
+        .def("__iter__", [](PathStream &stream) -> PathStream & { return stream; })
+        .def("__next__", [](PathStream &stream) {
+            vector<double> path;
+            bool found;
+            {
+                py::gil_scoped_release release;
+                found = stream.next(path);
+            }
+            if (!found)
+                throw py::stop_iteration();
+            return path;
+        })
+        .def("close", &PathStream::close, py::call_guard<py::gil_scoped_release>())
+        .def_property_readonly("stats", [](PathStream &stream) -> py::object {
+            if (!stream.finished())
+                return py::none();
+            return py::cast(stream.getStats());
+        });
+
+    // The GIL is released during the search, so queries can run concurrently from Python threads. Concurrent queries
+    // may share a RoadNetwork, but its weights must not be modified while a query on it is running.
+    m.def("k_shortest_paths", static_cast<vector< vector<double> > (*)(string, double, double, NodeID, NodeID, string)>(&k_shortest_paths),
+        py::call_guard<py::gil_scoped_release>());
+    // n_threads is the number of native threads a single query may use internally (currently for the ESX edge priorities).
+    // max_labels, max_pops and max_seconds bound the labels created, the queue pops and the wall-clock time of the search
+    // (0 means unlimited, the all-to-one search for the lower bounds is not counted). A query which runs out of a budget
+    // returns the paths found so far, the status of the columnar result tells which budget ran out.
+    // bounds_radius > 0 stops the reverse search for the bounds at bounds_radius times the shortest distance from the
+    // source. Nodes further away from the target are skipped, as any path through them is longer than that (svp does not
+    // use the bounds and ignores it).
+    // disabled_edges excludes edges from the query without changing the graph, see to_disabled_edges. Such a query always
+    // computes its own bounds (no cache, no contraction hierarchy). A connection with several parallel edges is only
+    // closed once all of them are disabled. Disabling some of them raises ValueError if an enabled one has another weight
+    // than the one the graph uses for the connection (the first of them).
+    // With return_stats=True, a tuple (result, SearchStats) is returned. Invalid arguments raise ValueError, a query whose
+    // cancel_token fired raises QueryCancelled.
+    m.def("k_shortest_paths", [](RoadNetwork &rN, double k, double theta, NodeID source, NodeID target, string algo, bool columnar, int n_threads,
+                                 long long max_labels, long long max_pops, double max_seconds, double bounds_radius, bool return_stats,
+                                 shared_ptr<CancellationToken> cancel_token, py::object disabled_edges) -> py::object {
+        SearchContext context = make_context(n_threads, max_labels, max_pops, max_seconds, bounds_radius, cancel_token,
+                                             to_disabled_edges(rN, disabled_edges));
+        if (columnar) {
+            PathArrays result;
+            {
+                py::gil_scoped_release release;
+                result = k_shortest_paths_columnar(rN, k, theta, source, target, algo, context);
+            }
+            return with_stats(py::cast(std::move(result)), context.getStats(), return_stats);
+        }
+        vector< vector<double> > result;
+        {
+            py::gil_scoped_release release;
+            result = k_shortest_paths(rN, k, theta, source, target, algo, context);
+        }
+        return with_stats(py::cast(result), context.getStats(), return_stats);
+    }, py::arg("graph"), py::arg("k"), py::arg("theta"), py::arg("source"), py::arg("target"), py::arg("algo"), py::arg("columnar") = false,
+       py::arg("n_threads") = 1, py::arg("max_labels") = 0, py::arg("max_pops") = 0, py::arg("max_seconds") = 0.0,
+       py::arg("bounds_radius") = 0.0, py::arg("return_stats") = false, py::arg("cancel_token") = py::none(),
+       py::arg("disabled_edges") = py::none());
+
+    // queries is a (n, 2) array of (source, target) pairs. The searches run on n_threads native threads without holding the GIL.
+    // The budgets and the bounds radius apply to every query separately. With return_stats=True, a tuple (results, list of SearchStats) is returned.
+    // If the cancel_token fires, the remaining queries are dropped and QueryCancelled is raised. disabled_edges applies to all queries.
+    m.def("k_shortest_paths_batch", [](RoadNetwork &rN, NodeIDArray queries, double k, double theta, string algo, int n_threads, bool columnar,
+                                       long long max_labels, long long max_pops, double max_seconds, double bounds_radius, bool return_stats,
+                                       shared_ptr<CancellationToken> cancel_token, py::object disabled_edges) -> py::object {
+        vector< pair<NodeID,NodeID> > pairs = to_query_pairs(queries);
+        SearchContext settings = make_context(1, max_labels, max_pops, max_seconds, bounds_radius, cancel_token,
+                                              to_disabled_edges(rN, disabled_edges));
+        vector<SearchStats> stats;
+        if (columnar) {
+            vector<PathArrays> results;
+            {
+                py::gil_scoped_release release;
+                results = k_shortest_paths_batch_columnar(rN, pairs, k, theta, algo, n_threads, settings, stats);
+            }
+            return with_stats(py::cast(std::move(results)), stats, return_stats);
+        }
+        vector< vector< vector<double> > > results;
+        {
+            py::gil_scoped_release release;
+            results = k_shortest_paths_batch(rN, pairs, k, theta, algo, n_threads, settings, stats);
+        }
+        return with_stats(py::cast(results), stats, return_stats);
+    }, py::arg("graph"), py::arg("queries"), py::arg("k"), py::arg("theta"), py::arg("algo"), py::arg("n_threads") = 0, py::arg("columnar") = false,
+       py::arg("max_labels") = 0, py::arg("max_pops") = 0, py::arg("max_seconds") = 0.0, py::arg("bounds_radius") = 0.0,
+       py::arg("return_stats") = false, py::arg("cancel_token") = py::none(), py::arg("disabled_edges") = py::none());
+}
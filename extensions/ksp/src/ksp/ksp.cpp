@@ -4,6 +4,7 @@ Copyright (c) 2017 Theodoros Chondrogiannis
 
 #include <iostream>
 #include <fstream> 
+#include <cmath>
 #include <boost/regex.hpp>
 #include <boost/algorithm/string.hpp>
 
@@ -14,63 +15,265 @@ Copyright (c) 2017 Theodoros Chondrogiannis
 
 using namespace std;
 
-vector< vector<double> > k_shortest_paths(string graphFile, double k, double theta, NodeID source, NodeID target, string algo) {
+// Mfolini: Names accepted for algo by run_algorithm.
+static const char *ALGORITHMS[] = {"op", "mp", "opplus", "svp", "esx", "penalty", "plateau"};
 
-	RoadNetwork *rN = 0;
-	
-	//Input checking	
-	if(graphFile == "" ) {
-    	cerr << "Wrong arguments. Define graph file correctly." << endl;
-    	exit(1);
-    }
-    
-	if(k < 1) {
-    	cerr << "Define k between [1,+inf)" << endl;
-    	exit(2);
-    }
-    
-    if(theta < 0 || theta > 1) {
-    	cerr << "Define theta between [0,1]" << endl;
-    	exit(3);
-    }
+static invalid_argument unknown_algorithm(const string &algo) {
+	string names;
+	for (size_t i = 0; i < sizeof(ALGORITHMS)/sizeof(ALGORITHMS[0]); i++)
+		names += (i > 0 ? ", " : "") + string(ALGORITHMS[i]);
+	return invalid_argument("Unknown algorithm '" + algo + "', expected one of " + names);
+}
+
+// Mfolini: Throws invalid_argument instead of exiting, so bad input only fails the query and not the whole process.
+void check_arguments(RoadNetwork *rN, double k, double theta, NodeID source, NodeID target, const string &algo) {
+	bool known = false;
+	for (size_t i = 0; i < sizeof(ALGORITHMS)/sizeof(ALGORITHMS[0]) && !known; i++)
+		known = boost::iequals(algo, ALGORITHMS[i]);
+	if(!known)
+		throw unknown_algorithm(algo);
+
+	if(!(k >= 1))
+		throw invalid_argument("Define k between [1,+inf)");
     
-    if(source == target) {
-    	cerr << "Source and target are the same node" << endl;
-    	exit(4);
-    }
+	if(!(theta >= 0 && theta <= 1))
+		throw invalid_argument("Define theta between [0,1]");
     
-    // Loading road network
-    rN = new RoadNetwork(graphFile.c_str());
+	if(source == target)
+		throw invalid_argument("Source and target are the same node");
     
+	if(source < 0 || source >= rN->numNodes || target < 0 || target >= rN->numNodes)
+		throw invalid_argument("Source and target must be node ids in [0, numNodes)");
+}
+
+vector<Path> run_algorithm(RoadNetwork *rN, double k, double theta, NodeID source, NodeID target, string algo, SearchContext &context) {
 	vector<Path> shortest_paths;
+	context.restart();
+	if(context.cancelled())
+		throw QueryCancelled();
 
 	if(boost::iequals(algo, "op")) {
-		shortest_paths = onepass(rN,source,target,k,theta);
+		shortest_paths = onepass(rN,source,target,k,theta,context);
     }
     else if(boost::iequals(algo, "mp")) {
-		shortest_paths = multipass(rN,source,target,k,theta);
+		shortest_paths = multipass(rN,source,target,k,theta,context);
     }
     else if(boost::iequals(algo, "opplus")) {
-		shortest_paths = onepass_plus(rN,source,target,k,theta);
+		shortest_paths = onepass_plus(rN,source,target,k,theta,context);
     }
     else if(boost::iequals(algo, "svp")) {
-		shortest_paths = svp_plus(rN,source,target,k,theta);
+		shortest_paths = svp_plus(rN,source,target,k,theta,context);
     }
     else if(boost::iequals(algo, "esx")) {
-		shortest_paths = esx(rN,source,target,k,theta);
+		shortest_paths = esx(rN,source,target,k,theta,context);
     }
-    
-	// result_vector is a nested vector. The outer vector contains a vector of doubleegers for each path found, whereby the first entry
-	// corresponds to the total length of the path and all subsequent doubleegers correspond to the node ids of the path.
-	// A path length of 0 indicates, that somewhen during the calculation of said path an overflow error occured and the path calculation is corrupted.
+    else if(boost::iequals(algo, "penalty")) {
+		shortest_paths = penalty(rN,source,target,k,theta,context);
+    }
+    else if(boost::iequals(algo, "plateau")) {
+		shortest_paths = plateau(rN,source,target,k,theta,context);
+    }
+    else {
+		throw unknown_algorithm(algo);
+    }
+    context.finish();
+    if(context.getStatus() == SEARCH_CANCELLED)
+    	throw QueryCancelled();
+    return shortest_paths;
+}
+
+// result_vector is a nested vector. The outer vector contains a vector of doubleegers for each path found, whereby the first entry
+// corresponds to the total length of the path and all subsequent doubleegers correspond to the node ids of the path.
+// A path length of 0 indicates, that somewhen during the calculation of said path an overflow error occured and the path calculation is corrupted.
+vector<double> to_result_entry(const Path &path) {
+	vector<double> entry;
+	entry.push_back(path.length);
+	for (double i = 0; i < path.nodes.size(); i++) {
+		entry.push_back(path.nodes[i]);
+	}
+	return entry;
+}
+
+vector< vector<double> > to_result_vector(vector<Path> &shortest_paths) {
 	vector< vector<double> > result_vector(shortest_paths.size());
 	for (double j = 0; j < shortest_paths.size(); j++) {
-		result_vector[j].push_back(shortest_paths[j].length);
-		for (double i = 0; i < shortest_paths[j].nodes.size(); i++) {
-			result_vector[j].push_back(shortest_paths[j].nodes[i]);
+		result_vector[j] = to_result_entry(shortest_paths[j]);
+	}
+	return result_vector;
+}
+
+// Mfolini: Relative difference up to which a path length is considered equal to the sum of its edge weights.
+static const double PATH_LENGTH_TOLERANCE = 1e-9;
+
+// Mfolini: Re-sums the current weights of the edges of a path, which reveals overflows and corrupted lengths.
+unsigned char path_flags(RoadNetwork *rN, const Path &path) {
+	double weightSum = 0;
+	for (size_t i = 0; i < path.edgeIds.size(); i++)
+		weightSum += rN->weights[path.edgeIds[i]];
+	if (!std::isfinite(path.length) || !std::isfinite(weightSum))
+		return PATH_NON_FINITE;
+	if (fabs(path.length - weightSum) > PATH_LENGTH_TOLERANCE * fabs(weightSum))
+		return PATH_LENGTH_MISMATCH;
+	return PATH_VALID;
+}
+
+PathArrays to_path_arrays(RoadNetwork *rN, vector<Path> &shortest_paths, SearchStatus status) {
+	PathArrays result;
+	result.status = status;
+	for (size_t j = 0; j < shortest_paths.size(); j++) {
+		shortest_paths[j].index_edges(rN);
+		result.lengths.push_back(shortest_paths[j].length);
+		result.flags.push_back(path_flags(rN, shortest_paths[j]));
+		result.nodes.insert(result.nodes.end(), shortest_paths[j].nodes.begin(), shortest_paths[j].nodes.end());
+		result.edges.insert(result.edges.end(), shortest_paths[j].edgeIds.begin(), shortest_paths[j].edgeIds.end());
+		result.offsets.push_back(result.nodes.size());
+		result.edgeOffsets.push_back(result.edges.size());
+	}
+	return result;
+}
+
+vector< vector<double> > k_shortest_paths(string graphFile, double k, double theta, NodeID source, NodeID target, string algo) {
+
+	//Input checking	
+	if(graphFile == "" )
+		throw invalid_argument("Wrong arguments. Define graph file correctly.");
+    
+    // Loading road network
+    RoadNetwork rN(graphFile.c_str());
+    
+    SearchContext context;
+	return k_shortest_paths(rN, k, theta, source, target, algo, context);
+}
+
+// Mfolini: Same as above, but runs on an already loaded road network, which can be reused for many queries.
+vector< vector<double> > k_shortest_paths(RoadNetwork &rN, double k, double theta, NodeID source, NodeID target, string algo, SearchContext &context) {
+    check_arguments(&rN, k, theta, source, target, algo);
+    
+	vector<Path> shortest_paths = run_algorithm(&rN, k, theta, source, target, algo, context);
+	return to_result_vector(shortest_paths);
+}
+
+// Mfolini: Same as above, but returns the paths in columnar form, including the ids of the traversed edges.
+PathArrays k_shortest_paths_columnar(RoadNetwork &rN, double k, double theta, NodeID source, NodeID target, string algo, SearchContext &context) {
+    check_arguments(&rN, k, theta, source, target, algo);
+    
+	vector<Path> shortest_paths = run_algorithm(&rN, k, theta, source, target, algo, context);
+	return to_path_arrays(&rN, shortest_paths, context.getStatus());
+}
+
+// Mfolini: Runs many independent queries on the same road network concurrently. The queries are distributed dynamically
+// over nThreads native threads (nThreads < 1 uses all available cores). The results are returned in query order. Every
+// query gets its own budgets as given by settings, the counters of the queries are stored in stats.
+vector< vector<Path> > run_batch(RoadNetwork &rN, const vector< pair<NodeID,NodeID> > &queries, double k, double theta, string algo, int nThreads,
+		const SearchContext &settings, vector<SearchStats> &stats) {
+	for(size_t i = 0; i < queries.size(); i++)
+		check_arguments(&rN, k, theta, queries[i].first, queries[i].second, algo);
+	
+	vector< vector<Path> > results(queries.size());
+	stats.assign(queries.size(), SearchStats());
+	parallel_for(queries.size(), nThreads, [&](size_t i) {
+		// The queries already run in parallel, so each of them uses a single thread.
+		SearchContext context(settings);
+		context.nThreads = 1;
+		results[i] = run_algorithm(&rN, k, theta, queries[i].first, queries[i].second, algo, context);
+		stats[i] = context.getStats();
+	});
+	
+	return results;
+}
+
+vector< vector< vector<double> > > k_shortest_paths_batch(RoadNetwork &rN, const vector< pair<NodeID,NodeID> > &queries, double k, double theta, string algo, int nThreads, const SearchContext &settings,
+		vector<SearchStats> &stats) {
+	vector< vector<Path> > paths = run_batch(rN, queries, k, theta, algo, nThreads, settings, stats);
+	vector< vector< vector<double> > > results(paths.size());
+	for(size_t i = 0; i < paths.size(); i++)
+		results[i] = to_result_vector(paths[i]);
+	return results;
+}
+
+vector<PathArrays> k_shortest_paths_batch_columnar(RoadNetwork &rN, const vector< pair<NodeID,NodeID> > &queries, double k, double theta, string algo, int nThreads, const SearchContext &settings,
+		vector<SearchStats> &stats) {
+	vector< vector<Path> > paths = run_batch(rN, queries, k, theta, algo, nThreads, settings, stats);
+	vector<PathArrays> results(paths.size());
+	for(size_t i = 0; i < paths.size(); i++)
+		results[i] = to_path_arrays(&rN, paths[i], stats[i].status);
+	return results;
+}
+
+PathStream::PathStream(RoadNetwork &rN, double k, double theta, NodeID source, NodeID target, string algo, const SearchContext &settings)
+		: context(settings), hasPending(false), done(false), closed(false) {
+	check_arguments(&rN, k, theta, source, target, algo);
+	
+	// Hands a path over and waits until it has been taken. Returning false stops the search.
+	this->context.onPath = [this](const Path &path) {
+		unique_lock<mutex> guard(this->lock);
+		if(this->closed)
+			return false;
+		this->pending = to_result_entry(path);
+		this->hasPending = true;
+		this->changed.notify_all();
+		this->changed.wait(guard, [this]() { return !this->hasPending || this->closed; });
+		return !this->closed;
+	};
+	this->worker = thread([this, &rN, k, theta, source, target, algo]() {
+		exception_ptr error;
+		try {
+			run_algorithm(&rN, k, theta, source, target, algo, this->context);
 		}
+		catch(...) {
+			error = current_exception();
+		}
+		lock_guard<mutex> guard(this->lock);
+		this->error = error;
+		this->done = true;
+		this->changed.notify_all();
+	});
+}
+
+PathStream::~PathStream() {
+	close();
+	if(this->worker.joinable())
+		this->worker.join();
+}
+
+// Waits for the next path and stores it in path. Returns false once the query has finished and all of its paths have been
+// taken, or if the stream was closed. An exception thrown by the search is rethrown here.
+bool PathStream::next(vector<double> &path) {
+	unique_lock<mutex> guard(this->lock);
+	this->changed.wait(guard, [this]() { return this->hasPending || this->done || this->closed; });
+	if(this->closed)
+		return false;
+	if(this->hasPending) {
+		path.swap(this->pending);
+		this->hasPending = false;
+		this->changed.notify_all();
+		return true;
+	}
+	if(this->error) {
+		exception_ptr error = this->error;
+		this->error = nullptr;
+		rethrow_exception(error);
 	}
-    	
-    delete rN;
-    return result_vector;
+	return false;
+}
+
+void PathStream::close() {
+	lock_guard<mutex> guard(this->lock);
+	if(this->closed)
+		return;
+	this->closed = true;
+	if(!this->done)
+		this->context.interrupt(SEARCH_STOPPED);
+	this->changed.notify_all();
+}
+
+bool PathStream::finished() {
+	lock_guard<mutex> guard(this->lock);
+	return this->done;
+}
+
+// The counters of the query, which may only be read once it has finished.
+SearchStats PathStream::getStats() {
+	lock_guard<mutex> guard(this->lock);
+	return this->context.getStats();
 }
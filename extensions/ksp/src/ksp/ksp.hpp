@@ -1,7 +1,65 @@
 #pragma once
 
 #include <string>
+#include <thread>
+#include <mutex>
+#include <condition_variable>
 #include "algorithms/kspwlo.hpp"
 using namespace std;
 
-vector< vector<double> > k_shortest_paths(string graphFile, double k, double theta, NodeID source, NodeID target, string algo);
\ No newline at end of file
+// Checks of a path length against the weights of its edges, combined as bit flags (0 if the path is valid).
+enum PathFlag {
+	PATH_VALID = 0,
+	PATH_NON_FINITE = 1,      // The length or the sum of the edge weights is infinite or NaN, e.g. after an overflow
+	PATH_LENGTH_MISMATCH = 2  // The length differs from the sum of the edge weights
+};
+
+// Columnar representation of a set of paths. The nodes of path i are nodes[offsets[i]:offsets[i+1]] and the
+// ids of the edges it traverses are edges[edgeOffsets[i]:edgeOffsets[i+1]]. flags[i] holds the PathFlag bits of path i.
+// status tells whether the search completed or which budget ran out before.
+class PathArrays {
+public:
+	vector<NodeID> nodes;
+	vector<long long> offsets;
+	vector<double> lengths;
+	vector<EdgeID> edges;
+	vector<long long> edgeOffsets;
+	vector<unsigned char> flags;
+	SearchStatus status;
+	
+	PathArrays() : offsets(1, 0), edgeOffsets(1, 0), status(SEARCH_COMPLETE) {};
+	size_t size() const { return lengths.size(); }
+};
+
+// Runs a query on a native thread and hands over its paths one at a time, as soon as the algorithm adds them to the result.
+// The search waits until the previous path has been taken, so it runs at most one path ahead of the consumer. close() (also
+// called by the destructor) stops the search at its next queue pop. A path is given as by k_shortest_paths, i.e. its length
+// followed by its node ids.
+class PathStream {
+public:
+	PathStream(RoadNetwork &rN, double k, double theta, NodeID source, NodeID target, string algo, const SearchContext &settings);
+	~PathStream();
+	bool next(vector<double> &path);
+	void close();
+	bool finished();
+	SearchStats getStats();
+
+private:
+	SearchContext context;
+	mutex lock;
+	condition_variable changed;
+	vector<double> pending;
+	bool hasPending;
+	bool done;
+	bool closed;
+	exception_ptr error;
+	thread worker;
+};
+
+vector< vector<double> > k_shortest_paths(string graphFile, double k, double theta, NodeID source, NodeID target, string algo);
+vector< vector<double> > k_shortest_paths(RoadNetwork &rN, double k, double theta, NodeID source, NodeID target, string algo, SearchContext &context);
+PathArrays k_shortest_paths_columnar(RoadNetwork &rN, double k, double theta, NodeID source, NodeID target, string algo, SearchContext &context);
+vector< vector< vector<double> > > k_shortest_paths_batch(RoadNetwork &rN, const vector< pair<NodeID,NodeID> > &queries, double k, double theta, string algo, int nThreads, const SearchContext &settings,
+	vector<SearchStats> &stats);
+vector<PathArrays> k_shortest_paths_batch_columnar(RoadNetwork &rN, const vector< pair<NodeID,NodeID> > &queries, double k, double theta, string algo, int nThreads, const SearchContext &settings,
+	vector<SearchStats> &stats);
@@ -2,21 +2,78 @@
 Copyright (c) 2017 Theodoros Chondrogiannis
 */
 
+#include <cstring>
+#include <cmath>
+#include <climits>
+#include <cstdint>
+#include <cstdio>
+#include <atomic>
+
+#ifdef _WIN32
+#ifndef NOMINMAX
+#define NOMINMAX
+#endif
+#include <windows.h>
+#else
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
+
 #include "graph.hpp"
 
+// Mfolini: Binary graph file written by RoadNetwork::save. The header is followed by the sections weights (double),
+// outOffsets, outNodes, outEdges, incOffsets, incNodes, incEdges and edgePositions (int32), each starting at a
+// multiple of 8 bytes. The byte order field tells whether the file was written on a machine of the same endianness.
+static const char GRAPH_FILE_MAGIC[8] = {'K', 'S', 'P', 'G', 'R', 'A', 'P', 'H'};
+// Mfolini: Version 2 maps parallel edges which are not linked to the position of their linked twin in edgePositions.
+static const uint32_t GRAPH_FILE_VERSION = 2;
+static const uint32_t GRAPH_FILE_BYTE_ORDER = 0x01020304;
+
+// Mfolini: Largest weight counted as integer. Path lengths of such weights stay exact integers as doubles.
+static const double MAX_INTEGER_WEIGHT = 4294967296.0;
+
+static bool is_integer_weight(double weight) {
+    return weight >= 0 && weight <= MAX_INTEGER_WEIGHT && weight == floor(weight);
+}
+
+struct GraphFileHeader {
+    char magic[8];
+    uint32_t version;
+    uint32_t byteOrder;
+    int64_t numNodes;
+    int64_t numEdges;
+    int64_t numArcs;
+};
+
+static size_t aligned_size(size_t bytes) {
+    return (bytes + 7) & ~size_t(7);
+}
+
+static bool is_graph_file(const char *filename) {
+    ifstream in(filename, ios::binary);
+    char magic[sizeof(GRAPH_FILE_MAGIC)];
+    return in.read(magic, sizeof(magic)) && memcmp(magic, GRAPH_FILE_MAGIC, sizeof(magic)) == 0;
+}
+
 RoadNetwork::RoadNetwork(const char *filename) {
     
+    // Mfolini: Binary graph files are mapped instead of parsed.
+    if (is_graph_file(filename)) {
+        this->open(filename);
+        return;
+    }
+    
     FILE *fp;
-    NodeID lnode, rnode, tmp;
+    double lnode, rnode, tmp, nodes, edges;
     double w;
-    char c;
+    vector<NodeID> sources, targets;
 
     fp = fopen(filename, "r");
     // fscanf(fp, "%c\n", &c);	Mfolini: I guess this first line was doubleended to specify the tdatatype of weights. But as it is hardcoded as double, this is not necessary.
     //fscanf(fp, "%u %u\n", &this->numNodes, &this->numEdges); // Mfolini: Extended this line to accept also a third dummy value to facilitate generating this file by exporting from numpy/pandas.  
-	fscanf(fp, "%lf %lf %lf\n", &this->numNodes, &this->numEdges, &tmp);
-    this->adjListOut = vector<EdgeList>(this->numNodes);
-    this->adjListInc = vector<EdgeList>(this->numNodes);
+	fscanf(fp, "%lf %lf %lf\n", &nodes, &edges, &tmp);
     
 	// Mfolini: Removed 4th dummy value as it does not seem to be used. Now the adjacency list consists of 3 columns (source node, target node, weight).
 	/*
@@ -27,19 +84,425 @@ RoadNetwork::RoadNetwork(const char *filename) {
 	*/
 
     while (fscanf(fp, "%lf %lf %lf\n", &lnode, &rnode, &w) != EOF) {
-        this->adjListOut[lnode].insert(make_pair(rnode, w));
-        this->adjListInc[rnode].insert(make_pair(lnode, w));
+        sources.push_back(NodeID(lnode));
+        targets.push_back(NodeID(rnode));
+        this->weights.push_back(w);
     }
     fclose(fp);
+    this->build(int(nodes), sources, targets);
+}
+
+// Mfolini: Builds the network directly from edge arrays (e.g. numpy columns source_id0, target_id0, ta), avoiding the round trip via a .gr file.
+RoadNetwork::RoadNetwork(int numNodes, int numEdges, const NodeID *sources, const NodeID *targets, const double *weights) {
+    this->weights.assign(weights, weights + numEdges);
+    this->build(numNodes, vector<NodeID>(sources, sources + numEdges), vector<NodeID>(targets, targets + numEdges));
+}
+
+// Mfolini: Edge ids follow the input order, so that weights can be addressed with the row index of the edge list.
+void RoadNetwork::build(int numNodes, const vector<NodeID> &sources, const vector<NodeID> &targets) {
+    size_t m = sources.size();
+    this->numNodes = numNodes;
+    this->numEdges = m;
+    this->weightsVersion = 0;
+    this->repairableVersion = 0;
+    this->increasedEdges.clear();
+    this->landmarkCount = 0;
+    this->countNonIntegerWeights();
+
+    for (size_t i = 0; i < m; i++) {
+        if (sources[i] < 0 || sources[i] >= numNodes || targets[i] < 0 || targets[i] >= numNodes)
+            throw invalid_argument("Edge node id out of range [0, numNodes)");
+    }
+
+    // Bucket the edges by source node, keeping the input order within each bucket.
+    vector<EdgeID> offsets(numNodes + 1, 0), bySource(m);
+    for (size_t i = 0; i < m; i++)
+        offsets[sources[i] + 1]++;
+    for (int u = 0; u < numNodes; u++)
+        offsets[u + 1] += offsets[u];
+    vector<EdgeID> next(offsets.begin(), offsets.end() - 1);
+    for (size_t i = 0; i < m; i++)
+        bySource[next[sources[i]]++] = i;
+
+    // Outgoing edges. lastSource[v] == u marks that the edge (u,v) is already linked at linkedPosition[v], so parallel
+    // edges are skipped and refer to that position instead.
+    vector<NodeID> lastSource(numNodes, -1);
+    vector<EdgeID> linkedPosition(numNodes, -1);
+    vector<EdgeID> outOffsets(numNodes + 1, 0), outEdges, edgePositions(m, -1);
+    vector<NodeID> outNodes;
+    outNodes.reserve(m);
+    outEdges.reserve(m);
+    for (NodeID u = 0; u < numNodes; u++) {
+        outOffsets[u] = outNodes.size();
+        for (EdgeID j = offsets[u]; j < offsets[u + 1]; j++) {
+            NodeID v = targets[bySource[j]];
+            if (lastSource[v] == u) {
+                edgePositions[bySource[j]] = linkedPosition[v];
+                continue;
+            }
+            lastSource[v] = u;
+            linkedPosition[v] = outNodes.size();
+            edgePositions[bySource[j]] = outNodes.size();
+            outNodes.push_back(v);
+            outEdges.push_back(bySource[j]);
+        }
+    }
+    outOffsets[numNodes] = outNodes.size();
+
+    // Incoming edges, transposed from the outgoing ones.
+    size_t linked = outNodes.size();
+    vector<EdgeID> incOffsets(numNodes + 1, 0), incEdges(linked);
+    vector<NodeID> incNodes(linked);
+    for (size_t j = 0; j < linked; j++)
+        incOffsets[outNodes[j] + 1]++;
+    for (int v = 0; v < numNodes; v++)
+        incOffsets[v + 1] += incOffsets[v];
+    next.assign(incOffsets.begin(), incOffsets.end() - 1);
+    for (NodeID u = 0; u < numNodes; u++) {
+        for (EdgeID j = outOffsets[u]; j < outOffsets[u + 1]; j++) {
+            EdgeID pos = next[outNodes[j]]++;
+            incNodes[pos] = u;
+            incEdges[pos] = outEdges[j];
+        }
+    }
+
+    this->outOffsets.assign(outOffsets);
+    this->outNodes.assign(outNodes);
+    this->outEdges.assign(outEdges);
+    this->incOffsets.assign(incOffsets);
+    this->incNodes.assign(incNodes);
+    this->incEdges.assign(incEdges);
+    this->edgePositions.assign(edgePositions);
+    this->mappedPath.clear();
+    this->mapping.reset();
+}
+
+template <typename T>
+static void write_section(ofstream &out, const T *data, size_t count) {
+    static const char padding[8] = {0};
+    size_t bytes = count * sizeof(T);
+    out.write(reinterpret_cast<const char *>(data), bytes);
+    out.write(padding, aligned_size(bytes) - bytes);
+}
+
+// Mfolini: Moves the written temporary file over the target. Existing mappings of the target keep the replaced file.
+// Windows refuses to replace a file which is still mapped.
+static void replace_file(const string &from, const string &to) {
+#ifdef _WIN32
+    bool replaced = MoveFileExA(from.c_str(), to.c_str(), MOVEFILE_REPLACE_EXISTING) != 0;
+#else
+    bool replaced = ::rename(from.c_str(), to.c_str()) == 0;
+#endif
+    if (!replaced) {
+        remove(from.c_str());
+        throw runtime_error("Cannot replace graph file " + to + " (is it still opened by a road network?)");
+    }
+}
+
+// Mfolini: Writes the network including the current weights to a binary graph file, which can be opened again with
+// RoadNetwork(filename). The file is written next to the target under a temporary name and then renamed, so road
+// networks which have mapped an earlier version of the file are not affected.
+void RoadNetwork::save(const char *filename) const {
+    static atomic<unsigned long> saveCount(0);
+    GraphFileHeader header;
+    memcpy(header.magic, GRAPH_FILE_MAGIC, sizeof(header.magic));
+    header.version = GRAPH_FILE_VERSION;
+    header.byteOrder = GRAPH_FILE_BYTE_ORDER;
+    header.numNodes = this->numNodes;
+    header.numEdges = this->numEdges;
+    header.numArcs = this->outNodes.size();
+
+#ifdef _WIN32
+    unsigned long processId = GetCurrentProcessId();
+#else
+    unsigned long processId = getpid();
+#endif
+    string tempName = string(filename) + ".tmp" + to_string(processId) + "_" + to_string(saveCount++);
+    ofstream out(tempName.c_str(), ios::binary | ios::trunc);
+    if (!out)
+        throw runtime_error(string("Cannot write graph file ") + filename);
+    out.write(reinterpret_cast<const char *>(&header), sizeof(header));
+    write_section(out, this->weights.data(), this->weights.size());
+    write_section(out, this->outOffsets.data(), this->outOffsets.size());
+    write_section(out, this->outNodes.data(), this->outNodes.size());
+    write_section(out, this->outEdges.data(), this->outEdges.size());
+    write_section(out, this->incOffsets.data(), this->incOffsets.size());
+    write_section(out, this->incNodes.data(), this->incNodes.size());
+    write_section(out, this->incEdges.data(), this->incEdges.size());
+    write_section(out, this->edgePositions.data(), this->edgePositions.size());
+    out.close();
+    if (!out) {
+        remove(tempName.c_str());
+        throw runtime_error(string("Cannot write graph file ") + filename);
+    }
+    replace_file(tempName, filename);
+}
+
+template <typename T>
+static const T *read_section(const MappedFile &file, size_t &offset, size_t count) {
+    size_t bytes = count * sizeof(T);
+    if (offset + bytes > file.size())
+        throw runtime_error("Graph file is truncated");
+    const T *data = reinterpret_cast<const T *>(file.data() + offset);
+    offset += aligned_size(bytes);
+    return data;
+}
+
+static void check_offsets(const EdgeID *offsets, size_t numNodes, size_t numArcs) {
+    if (offsets[0] != 0 || size_t(offsets[numNodes]) != numArcs)
+        throw runtime_error("Graph file is corrupt (adjacency offsets)");
+    for (size_t u = 0; u < numNodes; u++) {
+        if (offsets[u + 1] < offsets[u])
+            throw runtime_error("Graph file is corrupt (adjacency offsets)");
+    }
+}
+
+static void check_range(const int *values, size_t count, int lower, int upper) {
+    for (size_t i = 0; i < count; i++) {
+        if (values[i] < lower || values[i] >= upper)
+            throw runtime_error("Graph file is corrupt (id out of range)");
+    }
+}
+
+// Mfolini: Maps a binary graph file. The adjacency arrays refer to the mapping, so processes opening the same file
+// share a single page-cached copy. The weights are copied, as they can be modified per network.
+void RoadNetwork::open(const char *filename) {
+    shared_ptr<MappedFile> file = make_shared<MappedFile>(filename);
+    GraphFileHeader header;
+    if (file->size() < sizeof(header))
+        throw runtime_error("Graph file is truncated");
+    memcpy(&header, file->data(), sizeof(header));
+    if (memcmp(header.magic, GRAPH_FILE_MAGIC, sizeof(header.magic)) != 0 || header.version != GRAPH_FILE_VERSION)
+        throw runtime_error("Unsupported graph file version");
+    if (header.byteOrder != GRAPH_FILE_BYTE_ORDER)
+        throw runtime_error("Graph file was written with a different byte order");
+    if (header.numNodes < 0 || header.numNodes >= INT_MAX || header.numEdges < 0 || header.numEdges > INT_MAX ||
+            header.numArcs < 0 || header.numArcs > header.numEdges)
+        throw runtime_error("Graph file is corrupt (header)");
+
+    size_t n = header.numNodes, m = header.numEdges, arcs = header.numArcs;
+    size_t offset = sizeof(header);
+    const double *weights = read_section<double>(*file, offset, m);
+    const EdgeID *outOffsets = read_section<EdgeID>(*file, offset, n + 1);
+    const NodeID *outNodes = read_section<NodeID>(*file, offset, arcs);
+    const EdgeID *outEdges = read_section<EdgeID>(*file, offset, arcs);
+    const EdgeID *incOffsets = read_section<EdgeID>(*file, offset, n + 1);
+    const NodeID *incNodes = read_section<NodeID>(*file, offset, arcs);
+    const EdgeID *incEdges = read_section<EdgeID>(*file, offset, arcs);
+    const EdgeID *edgePositions = read_section<EdgeID>(*file, offset, m);
+
+    // A corrupt file must not make the searches read out of bounds.
+    check_offsets(outOffsets, n, arcs);
+    check_offsets(incOffsets, n, arcs);
+    check_range(outNodes, arcs, 0, n);
+    check_range(incNodes, arcs, 0, n);
+    check_range(outEdges, arcs, 0, m);
+    check_range(incEdges, arcs, 0, m);
+    check_range(edgePositions, m, 0, arcs);
+
+    this->numNodes = n;
+    this->numEdges = m;
+    this->weightsVersion = 0;
+    this->repairableVersion = 0;
+    this->increasedEdges.clear();
+    this->landmarkCount = 0;
+    this->weights.assign(weights, weights + m);
+    this->countNonIntegerWeights();
+    this->outOffsets.refer(outOffsets, n + 1);
+    this->outNodes.refer(outNodes, arcs);
+    this->outEdges.refer(outEdges, arcs);
+    this->incOffsets.refer(incOffsets, n + 1);
+    this->incNodes.refer(incNodes, arcs);
+    this->incEdges.refer(incEdges, arcs);
+    this->edgePositions.refer(edgePositions, m);
+    this->mappedPath = filename;
+    this->mapping = file;
+}
+
+#ifdef _WIN32
+MappedFile::MappedFile(const string &path) : address(NULL), length(0) {
+    HANDLE file = CreateFileA(path.c_str(), GENERIC_READ, FILE_SHARE_READ, NULL, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (file == INVALID_HANDLE_VALUE)
+        throw runtime_error("Cannot open graph file " + path);
+    LARGE_INTEGER size;
+    if (!GetFileSizeEx(file, &size)) {
+        CloseHandle(file);
+        throw runtime_error("Cannot open graph file " + path);
+    }
+    this->length = size_t(size.QuadPart);
+    if (this->length > 0) {
+        // The view keeps the mapping and the file open, so both handles can be closed right away.
+        HANDLE mapping = CreateFileMappingA(file, NULL, PAGE_READONLY, 0, 0, NULL);
+        if (mapping != NULL) {
+            this->address = MapViewOfFile(mapping, FILE_MAP_READ, 0, 0, 0);
+            CloseHandle(mapping);
+        }
+    }
+    CloseHandle(file);
+    if (this->length > 0 && this->address == NULL)
+        throw runtime_error("Cannot map graph file " + path);
+}
+
+MappedFile::~MappedFile() {
+    if (this->address != NULL)
+        UnmapViewOfFile(this->address);
+}
+#else
+MappedFile::MappedFile(const string &path) : address(NULL), length(0) {
+    int fd = ::open(path.c_str(), O_RDONLY);
+    if (fd == -1)
+        throw runtime_error("Cannot open graph file " + path);
+    struct stat info;
+    if (fstat(fd, &info) == -1) {
+        close(fd);
+        throw runtime_error("Cannot open graph file " + path);
+    }
+    this->length = size_t(info.st_size);
+    if (this->length > 0) {
+        void *address = mmap(NULL, this->length, PROT_READ, MAP_SHARED, fd, 0);
+        if (address != MAP_FAILED)
+            this->address = address;
+    }
+    // The mapping stays valid after the descriptor is closed.
+    close(fd);
+    if (this->length > 0 && this->address == NULL)
+        throw runtime_error("Cannot map graph file " + path);
+}
+
+MappedFile::~MappedFile() {
+    if (this->address != NULL)
+        munmap(this->address, this->length);
+}
+#endif
+
+// Mfolini: Turns a mask of disabled edge ids into one of disabled links. A link is only disabled if all its parallel
+// edges are, as removing just some of them would keep the connection. Disabling the linked edge while a parallel edge
+// of another weight stays enabled would change the weight of the connection, which a mask cannot express, so it throws
+// invalid_argument.
+void RoadNetwork::linkDisabledEdges(vector<char> &disabled) const {
+    vector<EdgeID> enabledTwins;
+    for (EdgeID i = 0; i < this->numEdges; i++) {
+        EdgeID linked = this->outEdges[this->edgePositions[i]];
+        if (linked != i && !disabled[i])
+            enabledTwins.push_back(i);
+    }
+    for (size_t j = 0; j < enabledTwins.size(); j++) {
+        EdgeID twin = enabledTwins[j];
+        EdgeID linked = this->outEdges[this->edgePositions[twin]];
+        if (disabled[linked] && !(this->weights[twin] == this->weights[linked]))
+            throw invalid_argument("Edge " + to_string(linked) + " cannot be disabled without its parallel edge " + to_string(twin) +
+                ", which has another weight");
+    }
+    for (size_t j = 0; j < enabledTwins.size(); j++)
+        disabled[this->outEdges[this->edgePositions[enabledTwins[j]]]] = 0;
 }
 
 double RoadNetwork::getEdgeWeight(NodeID lnode, NodeID rnode) {
-    return this->adjListOut[lnode][rnode];
+    return this->weights[this->getEdgeID(lnode, rnode)];
+}
+
+EdgeID RoadNetwork::getEdgeID(NodeID lnode, NodeID rnode) {
+    for (EdgeID j = this->outOffsets[lnode]; j < this->outOffsets[lnode + 1]; j++) {
+        if (this->outNodes[j] == rnode)
+            return this->outEdges[j];
+    }
+    throw out_of_range("No edge between the given nodes");
+}
+
+void RoadNetwork::updateWeights(size_t count, const EdgeID *edgeIds, const double *newWeights) {
+    for (size_t i = 0; i < count; i++) {
+        if (edgeIds[i] < 0 || edgeIds[i] >= this->numEdges)
+            throw out_of_range("Edge id out of range [0, numEdges)");
+    }
+    // Increases are journaled, any decrease makes the bounds of earlier versions unrepairable.
+    unsigned long long version = this->weightsVersion + 1;
+    bool decreased = false;
+    for (size_t i = 0; i < count; i++) {
+        if (newWeights[i] > this->weights[edgeIds[i]])
+            this->increasedEdges.push_back(make_pair(version, edgeIds[i]));
+        else if (!(newWeights[i] == this->weights[edgeIds[i]]))
+            decreased = true;
+        this->nonIntegerWeights += size_t(!is_integer_weight(newWeights[i])) - size_t(!is_integer_weight(this->weights[edgeIds[i]]));
+        this->weights[edgeIds[i]] = newWeights[i];
+    }
+    this->weightsVersion = version;
+    if (decreased || this->increasedEdges.size() > size_t(this->numEdges)) {
+        this->increasedEdges.clear();
+        this->repairableVersion = version;
+    }
+}
+
+// Mfolini: Must be called after the weights have been modified directly, as cached bounds would be stale otherwise.
+void RoadNetwork::weightsChanged() {
+    this->weightsVersion++;
+    this->increasedEdges.clear();
+    this->repairableVersion = this->weightsVersion;
+    this->countNonIntegerWeights();
+}
+
+void RoadNetwork::countNonIntegerWeights() {
+    this->nonIntegerWeights = 0;
+    for (size_t i = 0; i < this->weights.size(); i++)
+        this->nonIntegerWeights += !is_integer_weight(this->weights[i]);
+}
+
+void RoadNetwork::setLandmarkCount(int count) {
+    if (count < 0 || count > this->numNodes)
+        throw invalid_argument("Number of landmarks out of range [0, numNodes]");
+    lock_guard<mutex> guard(this->landmarksLock);
+    this->landmarkCount = count;
+    this->landmarks.reset();
+}
+
+// Mfolini: Source node of the edge at position pos of the out* arrays.
+NodeID RoadNetwork::outSource(EdgeID pos) const {
+    return upper_bound(this->outOffsets.begin(), this->outOffsets.end(), pos) - this->outOffsets.begin() - 1;
 }
 
 RoadNetwork::~RoadNetwork() {
-    this->adjListOut.clear();
-   	this->adjListInc.clear();
+}
+
+shared_ptr<const TargetBounds> BoundsCache::get(NodeID target) {
+    lock_guard<mutex> guard(this->lock);
+    for (list< shared_ptr<const TargetBounds> >::iterator it = this->entries.begin(); it != this->entries.end(); it++) {
+        if ((*it)->target == target) {
+            this->entries.splice(this->entries.begin(), this->entries, it);
+            return this->entries.front();
+        }
+    }
+    return shared_ptr<const TargetBounds>();
+}
+
+void BoundsCache::put(shared_ptr<const TargetBounds> bounds) {
+    lock_guard<mutex> guard(this->lock);
+    if (this->capacity == 0)
+        return;
+    for (list< shared_ptr<const TargetBounds> >::iterator it = this->entries.begin(); it != this->entries.end(); it++) {
+        if ((*it)->target == bounds->target) {
+            this->entries.erase(it);
+            break;
+        }
+    }
+    this->entries.push_front(bounds);
+    if (this->entries.size() > this->capacity)
+        this->entries.pop_back();
+}
+
+size_t BoundsCache::getCapacity() {
+    lock_guard<mutex> guard(this->lock);
+    return this->capacity;
+}
+
+void BoundsCache::setCapacity(size_t capacity) {
+    lock_guard<mutex> guard(this->lock);
+    this->capacity = capacity;
+    while (this->entries.size() > this->capacity)
+        this->entries.pop_back();
+}
+
+void BoundsCache::clear() {
+    lock_guard<mutex> guard(this->lock);
+    this->entries.clear();
 }
 
 bool operator==(const Edge& le, const Edge& re) {
@@ -59,14 +522,40 @@ bool Path::containsEdge(Edge e) {
     return res;
 }
 
+void Path::index_edges(RoadNetwork *rN) {
+	size_t edgeCount = this->nodes.size() > 0 ? this->nodes.size()-1 : 0;
+	if(this->edgeIds.size() == edgeCount && this->sortedEdgeIds.size() == edgeCount)
+		return;
+	this->edgeIds.resize(edgeCount);
+	this->sortedEdgeIds.resize(edgeCount);
+	for(size_t i=0;i<edgeCount;i++) {
+		this->edgeIds[i] = rN->getEdgeID(this->nodes[i],this->nodes[i+1]);
+		this->sortedEdgeIds[i] = make_pair(this->edgeIds[i], int(i));
+	}
+	sort(this->sortedEdgeIds.begin(), this->sortedEdgeIds.end());
+}
+
+// Mfolini: The shared edges are found by merging the sorted edge ids of both paths. Their weights are then summed
+// in the order of path2 as before.
 double Path::overlap_ratio(RoadNetwork *rN, Path &path2) {
 	double sharedLength = 0;
+	this->index_edges(rN);
+	path2.index_edges(rN);
 	
-	for(double i=0;i<path2.nodes.size()-1;i++) {
-		Edge e = make_pair(path2.nodes[i],path2.nodes[i+1]);
-		if(this->containsEdge(e))
-			sharedLength += rN->getEdgeWeight(path2.nodes[i],path2.nodes[i+1]);
+	vector<char> shared(path2.edgeIds.size(), 0);
+	size_t i = 0, j = 0;
+	while(i < this->sortedEdgeIds.size() && j < path2.sortedEdgeIds.size()) {
+		if(this->sortedEdgeIds[i].first < path2.sortedEdgeIds[j].first)
+			i++;
+		else if(path2.sortedEdgeIds[j].first < this->sortedEdgeIds[i].first)
+			j++;
+		else
+			shared[path2.sortedEdgeIds[j++].second] = 1;
+	}
+	for(size_t k=0;k<shared.size();k++) {
+		if(shared[k])
+			sharedLength += rN->weights[path2.edgeIds[k]];
 	}
 
     return sharedLength/path2.length;
-}
\ No newline at end of file
+}
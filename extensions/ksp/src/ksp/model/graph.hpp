@@ -6,35 +6,219 @@ Copyright (c) 2017 Theodoros Chondrogiannis
 #define GRAPH_HPP
 
 #include <iostream>
+#include <cfloat>
 #include <fstream>
 #include <queue>
 #include <unordered_set>
 #include <unordered_map>
+#include <vector>
+#include <list>
+#include <algorithm>
+#include <memory>
+#include <mutex>
+#include <stdexcept>
+#include <string>
 
 #include <boost/functional/hash.hpp>
 
 using namespace std;
 
-typedef double NodeID;
+// Mfolini: Node ids are dense integers in [0, numNodes).
+typedef int NodeID;
 typedef pair<NodeID,NodeID> Edge;
 
-typedef unordered_map<NodeID,double> EdgeList;
+typedef int EdgeID;
 
+// Mfolini: Read-only array which either owns its elements or refers to memory owned elsewhere, e.g. a memory mapped
+// graph file.
+template <typename T>
+class GraphArray {
+public:
+    GraphArray() : ptr(NULL), count(0) {};
+    
+    void assign(vector<T> &values) {
+        this->storage.swap(values);
+        this->ptr = this->storage.data();
+        this->count = this->storage.size();
+    };
+    
+    void refer(const T *data, size_t count) {
+        vector<T>().swap(this->storage);
+        this->ptr = data;
+        this->count = count;
+    };
+    
+    inline const T &operator[](size_t i) const { return ptr[i]; }
+    inline size_t size() const { return count; }
+    inline const T *data() const { return ptr; }
+    inline const T *begin() const { return ptr; }
+    inline const T *end() const { return ptr + count; }
+
+private:
+    vector<T> storage;
+    const T *ptr;
+    size_t count;
+};
+
+// Mfolini: Read-only memory mapping of a whole file, shared with all other mappings of the same file.
+class MappedFile {
+public:
+    MappedFile(const string &path);
+    ~MappedFile();
+    const char *data() const { return static_cast<const char *>(this->address); }
+    size_t size() const { return this->length; }
+
+private:
+    void *address;
+    size_t length;
+    MappedFile(const MappedFile &);
+    MappedFile &operator=(const MappedFile &);
+};
+
+// Mfolini: Result of an all-to-one Dijkstra towards target for a given weights version: the distance of every node to
+// the target (DBL_MAX if it cannot reach it) and the next node on its shortest path (-1 for the target and unreachable nodes).
+// A pruned search only settles the nodes up to distance limit, the others are treated as unreachable.
+class TargetBounds {
+public:
+    NodeID target;
+    unsigned long long weightsVersion;
+    double limit;
+    vector<double> distances;
+    vector<NodeID> nextHop;
+    
+    TargetBounds() : target(-1), weightsVersion(0), limit(DBL_MAX) {};
+    
+    // Whether the bounds are complete enough for a query from source pruned at radius times its distance (see
+    // SearchContext::boundsRadius).
+    bool covers(NodeID source, double radius) const {
+        if (limit == DBL_MAX)
+            return true;
+        return radius > 0 && distances[source] != DBL_MAX && distances[source] * radius <= limit;
+    };
+};
+
+// Mfolini: ALT landmarks for a given weights version. The distances from and to the landmarks are stored node major,
+// i.e. the distances of node v are at [v*nodes.size(), (v+1)*nodes.size()) of fromLandmarks and toLandmarks (DBL_MAX if
+// not connected). By the triangle inequality they give lower bounds on the distance between any two nodes, which remain
+// valid if edges are deleted or their weights increased.
+class Landmarks {
+public:
+    unsigned long long weightsVersion;
+    vector<NodeID> nodes;
+    vector<double> fromLandmarks;
+    vector<double> toLandmarks;
+};
+
+// Mfolini: Topology of a customizable contraction hierarchy (CCH) for a given node order, see tools/cch.cpp. Nodes are
+// referred to by their rank, i.e. their position in order. The hierarchy edges leading from rank r to higher ranks are
+// the positions [upOffsets[r], upOffsets[r+1]) of upHead (higher rank, ascending) and upTail (r). The first of them
+// leads to the parent of r in the elimination tree. arcEdges gives the hierarchy edge of every position of the out*
+// arrays of the road network, arcUpward whether the edge leads from a lower to a higher rank.
+class ContractionHierarchy {
+public:
+    vector<NodeID> order;
+    vector<int> rank;
+    vector<EdgeID> upOffsets;
+    vector<int> upHead;
+    vector<int> upTail;
+    vector<EdgeID> arcEdges;
+    vector<char> arcUpward;
+};
+
+// Mfolini: Weights of the hierarchy edges for a given weights version. Every edge has an upward arc (lower to higher
+// rank) and a downward arc (higher to lower rank), DBL_MAX if there is no such path. For arcs which are shortcuts the
+// middle rank they were obtained over is kept to unpack them, -1 for arcs of the road network.
+class CchMetric {
+public:
+    unsigned long long weightsVersion;
+    vector<double> upWeights;
+    vector<double> downWeights;
+    vector<int> upMiddle;
+    vector<int> downMiddle;
+};
+
+// Mfolini: LRU cache of TargetBounds. Holds at most one entry per target, which may be for an older weights version.
+// A capacity of 0 disables the cache. All methods are thread safe.
+class BoundsCache {
+public:
+    BoundsCache() : capacity(0) {};
+    shared_ptr<const TargetBounds> get(NodeID target);
+    void put(shared_ptr<const TargetBounds> bounds);
+    size_t getCapacity();
+    void setCapacity(size_t capacity);
+    void clear();
+
+private:
+    size_t capacity;
+    list< shared_ptr<const TargetBounds> > entries; // Most recently used first
+    mutex lock;
+};
+
+// Mfolini: The adjacency is stored in compressed sparse row form. The outgoing edges of node u occupy the positions
+// [outOffsets[u], outOffsets[u+1]) of outNodes (adjacent node) and outEdges (edge id), the incoming edges likewise in the
+// inc* arrays. Edge ids index weights, which is kept in input order. As before, only the first of several parallel edges
+// is part of the adjacency. A road network saved with save() can be opened again from the binary file, in which case
+// the adjacency refers to a memory mapping of the file, shared by all processes which opened it. The weights are always
+// a private copy.
 class RoadNetwork {
 public:
-    double numNodes;
-    double numEdges;
-   	vector<EdgeList> adjListOut;
-   	vector<EdgeList> adjListInc;
+    int numNodes;
+    int numEdges;
+    GraphArray<EdgeID> outOffsets;
+    GraphArray<NodeID> outNodes;
+    GraphArray<EdgeID> outEdges;
+    GraphArray<EdgeID> incOffsets;
+    GraphArray<NodeID> incNodes;
+    GraphArray<EdgeID> incEdges;
+   	vector<double> weights;
+   	// Mfolini: Incremented whenever the weights change, so that cached search results can be told apart.
+   	unsigned long long weightsVersion;
+   	BoundsCache boundsCache;
+   	// Mfolini: Journal of the edges whose weight increased, as (version, edge id). Bounds computed for a version
+   	// >= repairableVersion can be brought up to date with the later entries instead of being recomputed.
+   	vector< pair<unsigned long long, EdgeID> > increasedEdges;
+   	unsigned long long repairableVersion;
+   	// Mfolini: Number of weights which are not integers in [0, MAX_INTEGER_WEIGHT]. If there are none, the searches use
+   	// radix heaps instead of binary heaps (see hasIntegerWeights).
+   	size_t nonIntegerWeights;
+   	// Mfolini: Position of every edge id in the out* arrays. Parallel edges which are not linked refer to the position of
+   	// the linked one, i.e. outEdges[edgePositions[e]] != e for them.
+   	GraphArray<EdgeID> edgePositions;
+   	// Mfolini: Binary graph file the adjacency is mapped from, empty if it is owned.
+   	string mappedPath;
+   	shared_ptr<MappedFile> mapping;
+   	// Mfolini: Number of ALT landmarks used by ESX (0 disables them). The landmarks are computed on first use and
+   	// refreshed once the weights have decreased (see graph_landmarks).
+   	int landmarkCount;
+   	shared_ptr<const Landmarks> landmarks;
+   	mutex landmarksLock;
+   	// Mfolini: Contraction hierarchy used instead of Dijkstra for the bounds if set (see enable_cch). Its metric is
+   	// customized on first use after the weights changed.
+   	shared_ptr<const ContractionHierarchy> cch;
+   	shared_ptr<const CchMetric> cchMetric;
+   	mutex cchLock;
    	   
     RoadNetwork(const char *filename);
+    RoadNetwork(int numNodes, int numEdges, const NodeID *sources, const NodeID *targets, const double *weights);
     double getEdgeWeight(NodeID lnode, NodeID rnode);
-    void prdouble();
-    RoadNetwork(){};
+    EdgeID getEdgeID(NodeID lnode, NodeID rnode);
+    void updateWeights(size_t count, const EdgeID *edgeIds, const double *newWeights);
+    void weightsChanged();
+    void setLandmarkCount(int count);
+    void save(const char *filename) const;
+    void linkDisabledEdges(vector<char> &disabled) const;
+    RoadNetwork() : weightsVersion(0), repairableVersion(0), nonIntegerWeights(0), landmarkCount(0) {};
     ~RoadNetwork();
     
-    EdgeList ougoingEdgesOf(NodeID);
-    EdgeList incomingEdgesOf(NodeID);    
+    inline double outWeight(EdgeID pos) const { return weights[outEdges[pos]]; }
+    inline double incWeight(EdgeID pos) const { return weights[incEdges[pos]]; }
+    NodeID outSource(EdgeID pos) const;
+    inline bool hasIntegerWeights() const { return nonIntegerWeights == 0; }
+
+private:
+    void build(int numNodes, const vector<NodeID> &sources, const vector<NodeID> &targets);
+    void open(const char *filename);
+    void countNonIntegerWeights();
 };
 
 // This is to ensure that edges are considered in a bidirectional fashion for the computation of the overlap.
@@ -43,7 +227,10 @@ bool operator==(const Edge& le, const Edge& re);
 class Path {
 public:
 	vector<NodeID> nodes;
-	unordered_set<Edge,boost::hash<Edge>> edges;
+	// Mfolini: Ids of the traversed edges in path order, and sorted together with their position in the path.
+	// Both are filled on demand by index_edges.
+	vector<EdgeID> edgeIds;
+	vector< pair<EdgeID,int> > sortedEdgeIds;
 	double length;
 	
 	Path() {
@@ -51,6 +238,7 @@ public:
 	}
 	
 	bool containsEdge(Edge e);
+	void index_edges(RoadNetwork *rN);
 	double overlap_ratio(RoadNetwork *rN, Path &path2);
 };
 
@@ -13,29 +13,52 @@ Copyright (c) 2017 Theodoros Chondrogiannis
  *  Therefore, the resulting path is not the shortest path, but the shortest
  *	path which at the same time avoids the deleted edges. This function
  *	is used by ESX
+ *	Mfolini: Returns an empty path as well if the budgets of the context
+ *	run out. If all weights are integers, a radix heap is used instead of a
+ *	binary heap.
  *
  */
 
-Path astar_limited(RoadNetwork *rN, NodeID source, NodeID target, vector<double> &bounds, unordered_set<Edge,boost::hash<Edge>> &deletedEdges) {
-    PriorityQueueAS queue;
+// Mfolini: Lower bounds given by a vector of distances to the target.
+class VectorBound {
+	const vector<double> &bounds;
+public:
+	VectorBound(const vector<double> &bounds) : bounds(bounds) {};
+	double operator()(NodeID node) const { return bounds[node]; }
+};
+
+// Mfolini: Lower bounds given by ALT landmarks.
+class LandmarkBound {
+	const Landmarks &landmarks;
+	NodeID target;
+public:
+	LandmarkBound(const Landmarks &landmarks, NodeID target) : landmarks(landmarks), target(target) {};
+	double operator()(NodeID node) const { return landmark_bound(landmarks, node, target); }
+};
+
+template <typename Queue, typename Bound>
+Path astar_limited_bound(RoadNetwork *rN, NodeID source, NodeID target, const Bound &bound, unordered_set<Edge,boost::hash<Edge>> &deletedEdges, SearchContext &context) {
+    Queue queue;
     Path resPath;
     double newLength = 0;
-    EdgeList::iterator iterAdj;
     vector<double> distances(rN->numNodes, DBL_MAX);
     vector<bool> visited(rN->numNodes);
     Label* targetLabel = NULL;
     distances[source]=0;
     vector<Label*> allCreatedLabels;
     
-    double newLowerBound = bounds[source];
+    double newLowerBound = bound(source);
+    // Mfolini: Nodes without a bound cannot reach the target (within the bounds radius), unless the bounds are
+    // towards another node from which the target cannot be reached either.
+    bool prune = bound(target) != DBL_MAX;
     Label* srcLabel = new Label(source, newLength, newLowerBound);
     queue.push(srcLabel);
     allCreatedLabels.push_back(srcLabel);
-    double pops = 0;
     while (!queue.empty()) {
         Label* curLabel = queue.top();
         queue.pop();
-        pops++;
+        if (!context.pop())
+            break;
         if (visited[curLabel->node_id])
             continue;
         
@@ -48,19 +71,25 @@ Path astar_limited(RoadNetwork *rN, NodeID source, NodeID target, vector<double>
             break;
         }
         else { // Expand search
-            for (iterAdj = rN->adjListOut[curLabel->node_id].begin(); iterAdj != rN->adjListOut[curLabel->node_id].end(); iterAdj++) {
-                newLength = curLabel->length + iterAdj->second;
-                newLowerBound = newLength + bounds[iterAdj->first];
+            for (EdgeID iterAdj = rN->outOffsets[curLabel->node_id]; iterAdj < rN->outOffsets[curLabel->node_id+1]; iterAdj++) {
+                if(context.disabled(rN->outEdges[iterAdj]))
+                    continue;
+                newLength = curLabel->length + rN->outWeight(iterAdj);
                 Label* newPrevious = curLabel;
-                Edge e(make_pair(curLabel->node_id,iterAdj->first));
+                Edge e(make_pair(curLabel->node_id,rN->outNodes[iterAdj]));
                 
                 if(deletedEdges.find(e) != deletedEdges.end()) 
                 	continue;
                 
-                if (distances[iterAdj->first] > newLength) {
-                	Label* label = new Label(iterAdj->first, newLength, newLowerBound, newPrevious);
+                if (distances[rN->outNodes[iterAdj]] > newLength) {
+                	double nodeBound = bound(rN->outNodes[iterAdj]);
+                	if (prune && nodeBound == DBL_MAX)
+                		continue;
+                	newLowerBound = newLength + nodeBound;
+                	Label* label = new Label(rN->outNodes[iterAdj], newLength, newLowerBound, newPrevious);
                 	allCreatedLabels.push_back(label);
                     queue.push(label);
+                    context.addLabel();
                 }
             }
         }
@@ -79,3 +108,15 @@ Path astar_limited(RoadNetwork *rN, NodeID source, NodeID target, vector<double>
     return resPath;
 }
 
+Path astar_limited(RoadNetwork *rN, NodeID source, NodeID target, const vector<double> &bounds, unordered_set<Edge,boost::hash<Edge>> &deletedEdges, SearchContext &context) {
+	if (rN->hasIntegerWeights())
+		return astar_limited_bound<RadixQueueAS>(rN, source, target, VectorBound(bounds), deletedEdges, context);
+	return astar_limited_bound<PriorityQueueAS>(rN, source, target, VectorBound(bounds), deletedEdges, context);
+}
+
+// Mfolini: Same as above, but with the landmark bounds, which are valid for any target.
+Path astar_limited(RoadNetwork *rN, NodeID source, NodeID target, const Landmarks &landmarks, unordered_set<Edge,boost::hash<Edge>> &deletedEdges, SearchContext &context) {
+	if (rN->hasIntegerWeights())
+		return astar_limited_bound<RadixQueueAS>(rN, source, target, LandmarkBound(landmarks, target), deletedEdges, context);
+	return astar_limited_bound<PriorityQueueAS>(rN, source, target, LandmarkBound(landmarks, target), deletedEdges, context);
+}
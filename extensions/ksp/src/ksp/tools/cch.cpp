@@ -0,0 +1,441 @@
+/*
+Copyright (c) 2017 Theodoros Chondrogiannis
+*/
+
+#include "tools.hpp"
+
+// Parts of at most this many nodes are not dissected any further.
+#define CCH_LEAF_SIZE 4
+
+/*
+ *
+ *	undirected_adjacency(RoadNetwork*, vector<EdgeID>, vector<NodeID>)
+ *	-----
+ *	Mfolini: Adjacency of the road network without edge directions, loops
+ *	and duplicates, in compressed sparse row form.
+ *
+ */
+
+void undirected_adjacency(RoadNetwork *rN, vector<EdgeID> &offsets, vector<NodeID> &adjNodes) {
+	offsets.assign(rN->numNodes + 1, 0);
+	adjNodes.clear();
+	vector<NodeID> neighbours;
+	for (NodeID v = 0; v < rN->numNodes; v++) {
+		neighbours.assign(rN->outNodes.begin() + rN->outOffsets[v], rN->outNodes.begin() + rN->outOffsets[v+1]);
+		neighbours.insert(neighbours.end(), rN->incNodes.begin() + rN->incOffsets[v], rN->incNodes.begin() + rN->incOffsets[v+1]);
+		sort(neighbours.begin(), neighbours.end());
+		neighbours.erase(unique(neighbours.begin(), neighbours.end()), neighbours.end());
+		for (size_t i = 0; i < neighbours.size(); i++) {
+			if (neighbours[i] != v)
+				adjNodes.push_back(neighbours[i]);
+		}
+		offsets[v+1] = adjNodes.size();
+	}
+}
+
+/*
+ *
+ *	nested_dissection_order(RoadNetwork*)
+ *	-----
+ *	Mfolini: Node order for a contraction hierarchy, obtained by recursive
+ *	bisection of the road network. A part is split along a level of a
+ *	breadth first search started from a pseudo-peripheral node. The level is
+ *	chosen as small as possible while leaving at least a fifth of the part
+ *	on both sides. Its nodes adjacent to the next level form the separator,
+ *	which is ranked above both halves. Disconnected parts are split into
+ *	their components first.
+ *
+ */
+
+vector<NodeID> nested_dissection_order(RoadNetwork *rN) {
+	int n = rN->numNodes;
+	vector<EdgeID> offsets;
+	vector<NodeID> adjNodes;
+	undirected_adjacency(rN, offsets, adjNodes);
+
+	vector<NodeID> order(n);
+	int nextRank = n;
+	vector<int> part(n, 0);
+	int partCount = 1;
+	vector<int> level(n, -1);
+	vector< vector<NodeID> > parts(1);
+	for (NodeID v = 0; v < n; v++)
+		parts[0].push_back(v);
+
+	// Breadth first search within the part of source, returns the nodes in the order they were reached.
+	auto bfs = [&](NodeID source, vector<NodeID> &reached) {
+		reached.clear();
+		reached.push_back(source);
+		level[source] = 0;
+		for (size_t i = 0; i < reached.size(); i++) {
+			NodeID v = reached[i];
+			for (EdgeID iterAdj = offsets[v]; iterAdj < offsets[v+1]; iterAdj++) {
+				NodeID w = adjNodes[iterAdj];
+				if (part[w] == part[v] && level[w] == -1) {
+					level[w] = level[v] + 1;
+					reached.push_back(w);
+				}
+			}
+		}
+	};
+	auto resetLevels = [&](const vector<NodeID> &reached) {
+		for (size_t i = 0; i < reached.size(); i++)
+			level[reached[i]] = -1;
+	};
+
+	vector<NodeID> reached;
+	while (!parts.empty()) {
+		vector<NodeID> nodes;
+		nodes.swap(parts.back());
+		parts.pop_back();
+		if (nodes.size() <= CCH_LEAF_SIZE) {
+			for (size_t i = 0; i < nodes.size(); i++)
+				order[--nextRank] = nodes[i];
+			continue;
+		}
+
+		bfs(nodes[0], reached);
+		if (reached.size() < nodes.size()) {
+			// Split off the component of the first node, the remaining nodes keep their part.
+			vector<NodeID> rest;
+			for (size_t i = 0; i < nodes.size(); i++) {
+				if (level[nodes[i]] == -1)
+					rest.push_back(nodes[i]);
+			}
+			for (size_t i = 0; i < reached.size(); i++)
+				part[reached[i]] = partCount;
+			partCount++;
+			resetLevels(reached);
+			parts.push_back(rest);
+			parts.push_back(reached);
+			continue;
+		}
+		NodeID peripheral = reached.back();
+		resetLevels(reached);
+		bfs(peripheral, reached);
+
+		int maxLevel = level[reached.back()];
+		if (maxLevel < 2) {
+			resetLevels(reached);
+			for (size_t i = 0; i < nodes.size(); i++)
+				order[--nextRank] = nodes[i];
+			continue;
+		}
+		vector<size_t> levelSizes(maxLevel + 1, 0);
+		for (size_t i = 0; i < reached.size(); i++)
+			levelSizes[level[reached[i]]]++;
+		int sepLevel = -1;
+		size_t before = levelSizes[0], median = 0;
+		for (int l = 1; l < maxLevel; l++) {
+			size_t after = reached.size() - before - levelSizes[l];
+			if (median == 0 && before + levelSizes[l] >= reached.size() / 2)
+				median = l;
+			if (min(before, after) >= reached.size() / 5 && (sepLevel == -1 || levelSizes[l] < levelSizes[sepLevel]))
+				sepLevel = l;
+			before += levelSizes[l];
+		}
+		if (sepLevel == -1)
+			sepLevel = median > 0 ? median : 1;
+
+		vector<NodeID> lower, upper;
+		for (size_t i = 0; i < reached.size(); i++) {
+			NodeID v = reached[i];
+			if (level[v] < sepLevel)
+				lower.push_back(v);
+			else if (level[v] > sepLevel)
+				upper.push_back(v);
+			else {
+				bool separates = false;
+				for (EdgeID iterAdj = offsets[v]; iterAdj < offsets[v+1] && !separates; iterAdj++)
+					separates = part[adjNodes[iterAdj]] == part[v] && level[adjNodes[iterAdj]] == sepLevel + 1;
+				if (separates)
+					order[--nextRank] = v;
+				else
+					lower.push_back(v);
+			}
+		}
+		resetLevels(reached);
+		for (size_t i = 0; i < lower.size(); i++)
+			part[lower[i]] = partCount;
+		for (size_t i = 0; i < upper.size(); i++)
+			part[upper[i]] = partCount + 1;
+		partCount += 2;
+		parts.push_back(lower);
+		parts.push_back(upper);
+	}
+	return order;
+}
+
+/*
+ *
+ *	build_cch(RoadNetwork*, vector<NodeID>)
+ *	-----
+ *	Mfolini: Builds the hierarchy edges for the given node order. Contracting
+ *	a node connects all of its higher ranked neighbours. It suffices to add
+ *	them to the neighbours of the lowest ranked one, its parent in the
+ *	elimination tree, whose contraction propagates them further.
+ *
+ */
+
+shared_ptr<const ContractionHierarchy> build_cch(RoadNetwork *rN, const vector<NodeID> &order) {
+	int n = rN->numNodes;
+	if (int(order.size()) != n)
+		throw invalid_argument("The node order must contain every node exactly once");
+	shared_ptr<ContractionHierarchy> cch = make_shared<ContractionHierarchy>();
+	cch->order = order;
+	cch->rank.assign(n, -1);
+	for (int r = 0; r < n; r++) {
+		if (order[r] < 0 || order[r] >= n || cch->rank[order[r]] != -1)
+			throw invalid_argument("The node order must contain every node exactly once");
+		cch->rank[order[r]] = r;
+	}
+
+	vector<EdgeID> offsets;
+	vector<NodeID> adjNodes;
+	undirected_adjacency(rN, offsets, adjNodes);
+	vector< vector<int> > up(n);
+	for (NodeID v = 0; v < n; v++) {
+		for (EdgeID iterAdj = offsets[v]; iterAdj < offsets[v+1]; iterAdj++) {
+			if (cch->rank[adjNodes[iterAdj]] > cch->rank[v])
+				up[cch->rank[v]].push_back(cch->rank[adjNodes[iterAdj]]);
+		}
+	}
+
+	cch->upOffsets.assign(n + 1, 0);
+	for (int r = 0; r < n; r++) {
+		sort(up[r].begin(), up[r].end());
+		up[r].erase(unique(up[r].begin(), up[r].end()), up[r].end());
+		if (up[r].size() > 1)
+			up[up[r][0]].insert(up[up[r][0]].end(), up[r].begin() + 1, up[r].end());
+		cch->upHead.insert(cch->upHead.end(), up[r].begin(), up[r].end());
+		cch->upTail.resize(cch->upHead.size(), r);
+		cch->upOffsets[r+1] = cch->upHead.size();
+		vector<int>().swap(up[r]);
+	}
+
+	cch->arcEdges.assign(rN->outNodes.size(), -1);
+	cch->arcUpward.assign(rN->outNodes.size(), 0);
+	for (NodeID v = 0; v < n; v++) {
+		for (EdgeID iterAdj = rN->outOffsets[v]; iterAdj < rN->outOffsets[v+1]; iterAdj++) {
+			int from = cch->rank[v], to = cch->rank[rN->outNodes[iterAdj]];
+			if (from == to)
+				continue;
+			int low = min(from, to), high = max(from, to);
+			cch->arcEdges[iterAdj] = lower_bound(cch->upHead.begin() + cch->upOffsets[low], cch->upHead.begin() + cch->upOffsets[low+1], high) - cch->upHead.begin();
+			cch->arcUpward[iterAdj] = from < to;
+		}
+	}
+	return cch;
+}
+
+/*
+ *
+ *	customize_cch(RoadNetwork*, ContractionHierarchy)
+ *	-----
+ *	Mfolini: Computes the weights of the hierarchy edges for the current
+ *	weights of the road network. The arcs start with the weights of the
+ *	road network edges and are improved over the lower triangles, i.e. over
+ *	every node of lower rank adjacent to both ends, in increasing rank.
+ *
+ */
+
+shared_ptr<const CchMetric> customize_cch(RoadNetwork *rN, const ContractionHierarchy &cch) {
+	size_t m = cch.upHead.size();
+	shared_ptr<CchMetric> metric = make_shared<CchMetric>();
+	metric->weightsVersion = rN->weightsVersion;
+	metric->upWeights.assign(m, DBL_MAX);
+	metric->downWeights.assign(m, DBL_MAX);
+	metric->upMiddle.assign(m, -1);
+	metric->downMiddle.assign(m, -1);
+	vector<double> &up = metric->upWeights, &down = metric->downWeights;
+
+	for (size_t pos = 0; pos < cch.arcEdges.size(); pos++) {
+		EdgeID e = cch.arcEdges[pos];
+		if (e == -1)
+			continue;
+		vector<double> &arcs = cch.arcUpward[pos] ? up : down;
+		arcs[e] = min(arcs[e], rN->outWeight(pos));
+	}
+
+	int n = cch.order.size();
+	for (int r = 0; r < n; r++) {
+		for (EdgeID i = cch.upOffsets[r]; i < cch.upOffsets[r+1]; i++) {
+			int a = cch.upHead[i];
+			EdgeID p = cch.upOffsets[a];
+			for (EdgeID j = i + 1; j < cch.upOffsets[r+1]; j++) {
+				while (cch.upHead[p] != cch.upHead[j])
+					p++;
+				// a -> r -> b and b -> r -> a
+				if (down[i] != DBL_MAX && up[j] != DBL_MAX && down[i] + up[j] < up[p]) {
+					up[p] = down[i] + up[j];
+					metric->upMiddle[p] = r;
+				}
+				if (down[j] != DBL_MAX && up[i] != DBL_MAX && down[j] + up[i] < down[p]) {
+					down[p] = down[j] + up[i];
+					metric->downMiddle[p] = r;
+				}
+			}
+		}
+	}
+	return metric;
+}
+
+/*
+ *
+ *	enable_cch(RoadNetwork*, vector<NodeID>)
+ *	-----
+ *	Mfolini: Makes the road network compute its bounds with a contraction
+ *	hierarchy for the given node order (nested dissection if empty).
+ *
+ */
+
+void enable_cch(RoadNetwork *rN, const vector<NodeID> &order) {
+	shared_ptr<const ContractionHierarchy> cch = build_cch(rN, order.empty() ? nested_dissection_order(rN) : order);
+	lock_guard<mutex> guard(rN->cchLock);
+	rN->cch = cch;
+	rN->cchMetric.reset();
+}
+
+void disable_cch(RoadNetwork *rN) {
+	lock_guard<mutex> guard(rN->cchLock);
+	rN->cch.reset();
+	rN->cchMetric.reset();
+}
+
+/*
+ *
+ *	cch_metric(RoadNetwork*, shared_ptr<const ContractionHierarchy>)
+ *	-----
+ *	Mfolini: Returns the hierarchy of the road network (in cch) together with
+ *	its metric for the current weights, which is customized if necessary.
+ *	Returns NULL if the road network has no hierarchy.
+ *
+ */
+
+shared_ptr<const CchMetric> cch_metric(RoadNetwork *rN, shared_ptr<const ContractionHierarchy> &cch) {
+	lock_guard<mutex> guard(rN->cchLock);
+	cch = rN->cch;
+	if (!cch)
+		return shared_ptr<const CchMetric>();
+	if (!rN->cchMetric || rN->cchMetric->weightsVersion != rN->weightsVersion)
+		rN->cchMetric = customize_cch(rN, *cch);
+	return rN->cchMetric;
+}
+
+// Hierarchy edge between rank low and the higher rank high.
+static EdgeID cch_edge(const ContractionHierarchy &cch, int low, int high) {
+	return lower_bound(cch.upHead.begin() + cch.upOffsets[low], cch.upHead.begin() + cch.upOffsets[low+1], high) - cch.upHead.begin();
+}
+
+/*
+ *
+ *	cch_bounds(RoadNetwork*, NodeID)
+ *	-----
+ *	Mfolini: Same result as reverse_dijkstra, computed with the contraction
+ *	hierarchy of the road network: an upward search from the target over the
+ *	downward arcs, which only visits its ancestors in the elimination tree,
+ *	followed by a sweep over all ranks in decreasing order which relaxes
+ *	their upward arcs (PHAST). The arcs the distances were obtained over are
+ *	then unpacked into the next hops of the shortest path tree. Finally the
+ *	distances are summed up along the tree like reverse_dijkstra does, so
+ *	that both give the same distances for the same tree. Returns NULL if the
+ *	road network has no hierarchy.
+ *
+ */
+
+shared_ptr<const TargetBounds> cch_bounds(RoadNetwork *rN, NodeID target) {
+	shared_ptr<const ContractionHierarchy> cchPtr;
+	shared_ptr<const CchMetric> metricPtr = cch_metric(rN, cchPtr);
+	if (!metricPtr)
+		return shared_ptr<const TargetBounds>();
+	const ContractionHierarchy &cch = *cchPtr;
+	const CchMetric &metric = *metricPtr;
+	int n = cch.order.size();
+
+	vector<double> distances(n, DBL_MAX);
+	vector<EdgeID> via(n, -1);
+	vector<char> viaUp(n, 0);
+	int rt = cch.rank[target];
+	distances[rt] = 0;
+	for (int r = rt; r != -1; r = cch.upOffsets[r] < cch.upOffsets[r+1] ? cch.upHead[cch.upOffsets[r]] : -1) {
+		for (EdgeID e = cch.upOffsets[r]; e < cch.upOffsets[r+1]; e++) {
+			int u = cch.upHead[e];
+			if (metric.downWeights[e] != DBL_MAX && distances[r] + metric.downWeights[e] < distances[u]) {
+				distances[u] = distances[r] + metric.downWeights[e];
+				via[u] = e;
+				viaUp[u] = 0;
+			}
+		}
+	}
+	for (int r = n - 1; r >= 0; r--) {
+		for (EdgeID e = cch.upOffsets[r]; e < cch.upOffsets[r+1]; e++) {
+			int u = cch.upHead[e];
+			if (distances[u] != DBL_MAX && metric.upWeights[e] != DBL_MAX && metric.upWeights[e] + distances[u] < distances[r]) {
+				distances[r] = metric.upWeights[e] + distances[u];
+				via[r] = e;
+				viaUp[r] = 1;
+			}
+		}
+	}
+
+	shared_ptr<TargetBounds> bounds = make_shared<TargetBounds>();
+	bounds->target = target;
+	bounds->weightsVersion = metric.weightsVersion;
+	bounds->distances.assign(rN->numNodes, DBL_MAX);
+	bounds->nextHop.assign(rN->numNodes, -1);
+	vector<double> nextWeight(rN->numNodes, 0);
+
+	// Every rank is linked to the tree once the arc it was reached over has been unpacked up to the first rank which
+	// is already linked. Ranks are linked after the rank their arc leads to, so the tree stays acyclic.
+	vector<char> linked(n, 0);
+	linked[rt] = 1;
+	vector<int> chain;
+	vector< pair<EdgeID,char> > arcs;
+	for (int start = 0; start < n; start++) {
+		chain.clear();
+		for (int r = start; !linked[r] && via[r] != -1; r = viaUp[r] ? cch.upHead[via[r]] : cch.upTail[via[r]])
+			chain.push_back(r);
+		while (!chain.empty()) {
+			int cur = chain.back();
+			chain.pop_back();
+			if (linked[cur])
+				continue;
+			linked[cur] = 1;
+			arcs.assign(1, make_pair(via[cur], viaUp[cur]));
+			while (!arcs.empty()) {
+				EdgeID e = arcs.back().first;
+				bool upward = arcs.back().second;
+				arcs.pop_back();
+				int low = cch.upTail[e], high = cch.upHead[e];
+				int middle = upward ? metric.upMiddle[e] : metric.downMiddle[e];
+				if (middle == -1) {
+					int next = upward ? high : low;
+					bounds->nextHop[cch.order[cur]] = cch.order[next];
+					nextWeight[cch.order[cur]] = upward ? metric.upWeights[e] : metric.downWeights[e];
+					if (linked[next])
+						break;
+					linked[next] = 1;
+					cur = next;
+				}
+				else if (upward) { // low -> middle -> high
+					arcs.push_back(make_pair(cch_edge(cch, middle, high), 1));
+					arcs.push_back(make_pair(cch_edge(cch, middle, low), 0));
+				}
+				else { // high -> middle -> low
+					arcs.push_back(make_pair(cch_edge(cch, middle, low), 1));
+					arcs.push_back(make_pair(cch_edge(cch, middle, high), 0));
+				}
+			}
+		}
+	}
+
+	vector<NodeID> pending;
+	bounds->distances[target] = 0;
+	for (NodeID v = 0; v < rN->numNodes; v++) {
+		for (NodeID node = v; bounds->distances[node] == DBL_MAX && bounds->nextHop[node] != -1; node = bounds->nextHop[node])
+			pending.push_back(node);
+		for (; !pending.empty(); pending.pop_back())
+			bounds->distances[pending.back()] = bounds->distances[bounds->nextHop[pending.back()]] + nextWeight[pending.back()];
+	}
+	return bounds;
+}
@@ -6,24 +6,30 @@ Copyright (c) 2017 Theodoros Chondrogiannis
 
 /*
  *
- *	dijkstra_path_and_bounds(RoadNetwork, NodeID, NodeID, vector<double>, unordered_set<Edge,boost::hash<Edge>>)
+ *	reverse_dijkstra(RoadNetwork*, NodeID, NodeID, double, vector<char>*)
  *	-----
- *	This algorithm is essentially an all-to-one Dijkstra and returns at the same
- *	time the shortest path from the source to the target AND the distances of
- *	all nodes to the target. This algorithm is used way to compute the shortest
- *	path along with exact lower bounds for OnePas, MultiPass and OnePass+.
+ *	All-to-one Dijkstra computing the distances of all nodes to the target
+ *	together with the shortest path tree towards it.
+ *	Mfolini: If radius > 0, the search stops once it is more than radius times
+ *	the distance of the source away from the target. Any path through a node
+ *	further away is longer than that anyway. Edges disabled in disabledEdges
+ *	(if given) are skipped. If all weights are integers, a radix heap is
+ *	used instead of a binary heap.
  *
  */
 
-pair<Path,vector<double>> dijkstra_path_and_bounds(RoadNetwork *rN, NodeID source, NodeID target) {
+template <typename Queue>
+static shared_ptr<const TargetBounds> reverse_dijkstra_queue(RoadNetwork *rN, NodeID target, NodeID source, double radius, const vector<char> *disabledEdges) {
 	double count = 0;
-    PriorityQueue queue;
-    Path resPath;
+    Queue queue;
     double newLength = 0;
-    EdgeList::iterator iterAdj;
-    vector<double> distances(rN->numNodes, DBL_MAX);
+    shared_ptr<TargetBounds> bounds = make_shared<TargetBounds>();
+    bounds->target = target;
+    bounds->weightsVersion = rN->weightsVersion;
+    bounds->distances.assign(rN->numNodes, DBL_MAX);
+    bounds->nextHop.assign(rN->numNodes, -1);
+    vector<double> &distances = bounds->distances;
     vector<bool> visited(rN->numNodes);
-    Label *targetLabel=NULL;
     distances[target]=0;
     vector<Label*> allCreatedLabels;
     Label* srcLabel = new Label(target, newLength);
@@ -36,29 +42,28 @@ pair<Path,vector<double>> dijkstra_path_and_bounds(RoadNetwork *rN, NodeID sourc
         
         if (visited[curLabel->node_id])
             continue;
+        if (curLabel->length > bounds->limit)
+            break;
         
         visited[curLabel->node_id] = true;
         distances[curLabel->node_id] = curLabel->length;
-        
-        if (curLabel->node_id == source) { // Destination has been found
-        	targetLabel = curLabel;
-            resPath.length = curLabel->length;
-            while(targetLabel != NULL) {
-    			resPath.nodes.push_back(targetLabel->node_id);
-    			targetLabel = targetLabel->previous;
-    		}
-        }
+        if (curLabel->previous != NULL)
+        	bounds->nextHop[curLabel->node_id] = curLabel->previous->node_id;
+        if (curLabel->node_id == source && radius > 0)
+        	bounds->limit = radius * curLabel->length;
         
         if(++count == rN->numNodes)
         	break;
         
         else { // Expand search
             // For each incoming edge.
-            for (iterAdj = rN->adjListInc[curLabel->node_id].begin(); iterAdj != rN->adjListInc[curLabel->node_id].end(); iterAdj++) {
-                newLength = curLabel->length + iterAdj->second;
+            for (EdgeID iterAdj = rN->incOffsets[curLabel->node_id]; iterAdj < rN->incOffsets[curLabel->node_id+1]; iterAdj++) {
+                if (disabledEdges && (*disabledEdges)[rN->incEdges[iterAdj]])
+                    continue;
+                newLength = curLabel->length + rN->incWeight(iterAdj);
                 Label* newPrevious = curLabel;
-                if (distances[iterAdj->first] > newLength) {
-                	Label* label = new Label(iterAdj->first, newLength, newPrevious);
+                if (distances[rN->incNodes[iterAdj]] > newLength) {
+                	Label* label = new Label(rN->incNodes[iterAdj], newLength, newPrevious);
                 	allCreatedLabels.push_back(label);
                     queue.push(label);
                 }
@@ -68,5 +73,159 @@ pair<Path,vector<double>> dijkstra_path_and_bounds(RoadNetwork *rN, NodeID sourc
     for(double i=0;i<allCreatedLabels.size();i++)
     	delete allCreatedLabels[i];
     
-    return make_pair(resPath, distances);
-}
\ No newline at end of file
+    return bounds;
+}
+
+shared_ptr<const TargetBounds> reverse_dijkstra(RoadNetwork *rN, NodeID target, NodeID source, double radius, const vector<char> *disabledEdges) {
+	if (rN->hasIntegerWeights())
+		return reverse_dijkstra_queue<RadixQueue>(rN, target, source, radius, disabledEdges);
+	return reverse_dijkstra_queue<PriorityQueue>(rN, target, source, radius, disabledEdges);
+}
+
+/*
+ *
+ *	repair_bounds(RoadNetwork*, TargetBounds)
+ *	-----
+ *	Mfolini: Brings bounds computed for an older weights version up to date,
+ *	provided that the weights have only increased since (see
+ *	RoadNetwork::increasedEdges). Only the nodes whose shortest path tree
+ *	branch contains an increased edge can get a new distance. Their
+ *	distances are recomputed by a Dijkstra restricted to them, seeded with
+ *	the distances over their edges to unaffected nodes. Returns NULL if the
+ *	bounds cannot be repaired, which includes bounds of a pruned search.
+ *
+ */
+
+shared_ptr<const TargetBounds> repair_bounds(RoadNetwork *rN, const TargetBounds &old) {
+	if (old.weightsVersion < rN->repairableVersion || old.limit != DBL_MAX)
+		return shared_ptr<const TargetBounds>();
+	
+	shared_ptr<TargetBounds> bounds = make_shared<TargetBounds>(old);
+	bounds->weightsVersion = rN->weightsVersion;
+	vector<double> &distances = bounds->distances;
+	vector<NodeID> &nextHop = bounds->nextHop;
+	vector<NodeID> affected;
+	vector<bool> isAffected(rN->numNodes, false);
+	
+	// Tails of the increased edges which are part of the tree.
+	for (size_t i = rN->increasedEdges.size(); i > 0 && rN->increasedEdges[i-1].first > old.weightsVersion; i--) {
+		EdgeID pos = rN->edgePositions[rN->increasedEdges[i-1].second];
+		if (rN->outEdges[pos] != rN->increasedEdges[i-1].second)
+			continue;
+		NodeID node = rN->outSource(pos);
+		if (nextHop[node] == rN->outNodes[pos] && !isAffected[node]) {
+			isAffected[node] = true;
+			affected.push_back(node);
+		}
+	}
+	
+	// All nodes whose tree path passes through one of them.
+	for (size_t i = 0; i < affected.size(); i++) {
+		for (EdgeID iterAdj = rN->incOffsets[affected[i]]; iterAdj < rN->incOffsets[affected[i]+1]; iterAdj++) {
+			NodeID adjNode = rN->incNodes[iterAdj];
+			if (!isAffected[adjNode] && nextHop[adjNode] == affected[i]) {
+				isAffected[adjNode] = true;
+				affected.push_back(adjNode);
+			}
+		}
+	}
+	
+	priority_queue< pair<double,NodeID>, vector< pair<double,NodeID> >, greater< pair<double,NodeID> > > queue;
+	for (size_t i = 0; i < affected.size(); i++) {
+		NodeID node = affected[i];
+		distances[node] = DBL_MAX;
+		nextHop[node] = -1;
+	}
+	for (size_t i = 0; i < affected.size(); i++) {
+		NodeID node = affected[i];
+		for (EdgeID iterAdj = rN->outOffsets[node]; iterAdj < rN->outOffsets[node+1]; iterAdj++) {
+			NodeID adjNode = rN->outNodes[iterAdj];
+			if (!isAffected[adjNode] && distances[adjNode] != DBL_MAX && distances[adjNode] + rN->outWeight(iterAdj) < distances[node]) {
+				distances[node] = distances[adjNode] + rN->outWeight(iterAdj);
+				nextHop[node] = adjNode;
+			}
+		}
+		if (distances[node] != DBL_MAX)
+			queue.push(make_pair(distances[node], node));
+	}
+	
+	while (!queue.empty()) {
+		pair<double,NodeID> cur = queue.top();
+		queue.pop();
+		if (cur.first > distances[cur.second])
+			continue;
+		for (EdgeID iterAdj = rN->incOffsets[cur.second]; iterAdj < rN->incOffsets[cur.second+1]; iterAdj++) {
+			NodeID adjNode = rN->incNodes[iterAdj];
+			double newLength = cur.first + rN->incWeight(iterAdj);
+			if (isAffected[adjNode] && newLength < distances[adjNode]) {
+				distances[adjNode] = newLength;
+				nextHop[adjNode] = cur.second;
+				queue.push(make_pair(newLength, adjNode));
+			}
+		}
+	}
+	
+	return bounds;
+}
+
+/*
+ *
+ *	target_bounds(RoadNetwork*, NodeID, NodeID, SearchContext)
+ *	-----
+ *	Returns the result of reverse_dijkstra for the current weights, taking it
+ *	from the bounds cache of the road network if possible. Cached bounds of
+ *	an older weights version are repaired if the weights only increased.
+ *	Mfolini: If the road network has a contraction hierarchy, the bounds are
+ *	computed with it instead of being repaired. Otherwise the search is
+ *	pruned for the given source and the bounds radius of the context (see
+ *	reverse_dijkstra), cached bounds of a pruned search are only reused if
+ *	they cover the source. Queries with disabled edges always get their own
+ *	search, which skips these edges and bypasses the cache.
+ *
+ */
+
+shared_ptr<const TargetBounds> target_bounds(RoadNetwork *rN, NodeID target, NodeID source, const SearchContext &context) {
+	double radius = context.boundsRadius;
+	if (context.disabledEdges)
+		return reverse_dijkstra(rN, target, source, radius, context.disabledEdges.get());
+	shared_ptr<const TargetBounds> cached = rN->boundsCache.get(target);
+	if (cached && cached->weightsVersion == rN->weightsVersion && cached->covers(source, radius))
+		return cached;
+	shared_ptr<const TargetBounds> bounds = cch_bounds(rN, target);
+	if (!bounds && cached)
+		bounds = repair_bounds(rN, *cached);
+	if (!bounds)
+		bounds = reverse_dijkstra(rN, target, source, radius);
+	rN->boundsCache.put(bounds);
+	return bounds;
+}
+
+/*
+ *
+ *	dijkstra_path_and_bounds(RoadNetwork, NodeID, NodeID)
+ *	-----
+ *	This algorithm is essentially an all-to-one Dijkstra and returns at the same
+ *	time the shortest path from the source to the target AND the distances of
+ *	all nodes to the target. This algorithm is used way to compute the shortest
+ *	path along with exact lower bounds for OnePas, MultiPass and OnePass+.
+ *	Mfolini: The all-to-one search itself is done by target_bounds, so queries
+ *	towards the same target can reuse it through the bounds cache. Its time
+ *	is recorded in the search context. The bounds are returned as shared
+ *	with the cache, so the distances are not copied per query.
+ *
+ */
+
+pair<Path,shared_ptr<const TargetBounds>> dijkstra_path_and_bounds(RoadNetwork *rN, NodeID source, NodeID target, SearchContext &context) {
+    Path resPath;
+    double start = context.elapsed();
+    shared_ptr<const TargetBounds> bounds = target_bounds(rN, target, source, context);
+    context.boundsSeconds += context.elapsed() - start;
+    
+    if (bounds->distances[source] != DBL_MAX) { // Destination has been found
+        resPath.length = bounds->distances[source];
+        for (NodeID node = source; node != -1; node = bounds->nextHop[node])
+        	resPath.nodes.push_back(node);
+    }
+    
+    return make_pair(resPath, bounds);
+}
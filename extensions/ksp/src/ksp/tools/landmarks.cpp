@@ -0,0 +1,143 @@
+/*
+Copyright (c) 2017 Theodoros Chondrogiannis
+*/
+
+#include "tools.hpp"
+
+/*
+ *
+ *	dijkstra_distances(RoadNetwork*, NodeID, bool)
+ *	-----
+ *	Mfolini: One-to-all (or all-to-one if reverse is set) Dijkstra returning
+ *	only the distances (DBL_MAX for nodes which are not connected).
+ *
+ */
+
+vector<double> dijkstra_distances(RoadNetwork *rN, NodeID node, bool reverse) {
+	const GraphArray<EdgeID> &offsets = reverse ? rN->incOffsets : rN->outOffsets;
+	const GraphArray<NodeID> &adjNodes = reverse ? rN->incNodes : rN->outNodes;
+	const GraphArray<EdgeID> &edges = reverse ? rN->incEdges : rN->outEdges;
+	vector<double> distances(rN->numNodes, DBL_MAX);
+	priority_queue< pair<double,NodeID>, vector< pair<double,NodeID> >, greater< pair<double,NodeID> > > queue;
+	
+	distances[node] = 0;
+	queue.push(make_pair(0.0, node));
+	while (!queue.empty()) {
+		pair<double,NodeID> cur = queue.top();
+		queue.pop();
+		if (cur.first > distances[cur.second])
+			continue;
+		for (EdgeID iterAdj = offsets[cur.second]; iterAdj < offsets[cur.second+1]; iterAdj++) {
+			double newLength = cur.first + rN->weights[edges[iterAdj]];
+			if (newLength < distances[adjNodes[iterAdj]]) {
+				distances[adjNodes[iterAdj]] = newLength;
+				queue.push(make_pair(newLength, adjNodes[iterAdj]));
+			}
+		}
+	}
+	return distances;
+}
+
+/*
+ *
+ *	compute_landmarks(RoadNetwork*, vector<NodeID>)
+ *	-----
+ *	Mfolini: Computes the distances from and to the given landmarks.
+ *
+ */
+
+shared_ptr<const Landmarks> compute_landmarks(RoadNetwork *rN, const vector<NodeID> &nodes) {
+	shared_ptr<Landmarks> landmarks = make_shared<Landmarks>();
+	size_t count = nodes.size();
+	landmarks->weightsVersion = rN->weightsVersion;
+	landmarks->nodes = nodes;
+	landmarks->fromLandmarks.resize(count * rN->numNodes);
+	landmarks->toLandmarks.resize(count * rN->numNodes);
+	for (size_t i = 0; i < count; i++) {
+		vector<double> from = dijkstra_distances(rN, nodes[i], false);
+		vector<double> to = dijkstra_distances(rN, nodes[i], true);
+		for (NodeID v = 0; v < rN->numNodes; v++) {
+			landmarks->fromLandmarks[v * count + i] = from[v];
+			landmarks->toLandmarks[v * count + i] = to[v];
+		}
+	}
+	return landmarks;
+}
+
+/*
+ *
+ *	select_landmarks(RoadNetwork*, int)
+ *	-----
+ *	Mfolini: Farthest landmark selection. The first landmark is the node
+ *	farthest from node 0, every further one the node whose distance to the
+ *	closest landmark selected so far is largest.
+ *
+ */
+
+vector<NodeID> select_landmarks(RoadNetwork *rN, int count) {
+	vector<NodeID> nodes;
+	vector<double> closest = dijkstra_distances(rN, 0, false);
+	
+	while (int(nodes.size()) < count) {
+		NodeID farthest = -1;
+		for (NodeID v = 0; v < rN->numNodes; v++) {
+			if (closest[v] != DBL_MAX && closest[v] > 0 && (farthest == -1 || closest[v] > closest[farthest]))
+				farthest = v;
+		}
+		if (farthest == -1)
+			break;
+		nodes.push_back(farthest);
+		vector<double> distances = dijkstra_distances(rN, farthest, false);
+		if (nodes.size() == 1)
+			closest = distances;
+		for (NodeID v = 0; v < rN->numNodes; v++)
+			closest[v] = min(closest[v], distances[v]);
+	}
+	return nodes;
+}
+
+/*
+ *
+ *	graph_landmarks(RoadNetwork*)
+ *	-----
+ *	Mfolini: Returns the landmarks of the road network or NULL if they are
+ *	disabled. They are computed on first use. As long as the weights have
+ *	only increased since, their bounds remain valid and are reused. Otherwise
+ *	the distances are recomputed for the same landmark nodes.
+ *
+ */
+
+shared_ptr<const Landmarks> graph_landmarks(RoadNetwork *rN) {
+	lock_guard<mutex> guard(rN->landmarksLock);
+	if (rN->landmarkCount == 0)
+		return shared_ptr<const Landmarks>();
+	if (!rN->landmarks)
+		rN->landmarks = compute_landmarks(rN, select_landmarks(rN, rN->landmarkCount));
+	else if (rN->landmarks->weightsVersion < rN->repairableVersion)
+		rN->landmarks = compute_landmarks(rN, rN->landmarks->nodes);
+	return rN->landmarks;
+}
+
+/*
+ *
+ *	landmark_bound(Landmarks, NodeID, NodeID)
+ *	-----
+ *	Mfolini: Lower bound on the distance from node to target.
+ *
+ */
+
+double landmark_bound(const Landmarks &landmarks, NodeID node, NodeID target) {
+	size_t count = landmarks.nodes.size();
+	const double *fromNode = &landmarks.fromLandmarks[node * count], *fromTarget = &landmarks.fromLandmarks[target * count];
+	const double *toNode = &landmarks.toLandmarks[node * count], *toTarget = &landmarks.toLandmarks[target * count];
+	double bound = 0;
+	for (size_t i = 0; i < count; i++) {
+		// d(L,target) <= d(L,node) + d(node,target)
+		if (fromTarget[i] != DBL_MAX && fromNode[i] != DBL_MAX && fromTarget[i] - fromNode[i] > bound)
+			bound = fromTarget[i] - fromNode[i];
+		// d(node,L) <= d(node,target) + d(target,L)
+		if (toNode[i] != DBL_MAX && toTarget[i] != DBL_MAX && toNode[i] - toTarget[i] > bound)
+			bound = toNode[i] - toTarget[i];
+	}
+	return bound;
+}
@@ -6,10 +6,19 @@ Copyright (c) 2017 Theodoros Chondrogiannis
 #define TOOLS_HPP
 
 #include <iostream>
+#include <cfloat>
+#include <climits>
 #include <queue>
 #include <vector>
 #include <algorithm>
 #include <unordered_set>
+#include <thread>
+#include <atomic>
+#include <exception>
+#include <stdexcept>
+#include <memory>
+#include <chrono>
+#include <functional>
 
 #include "../model/graph.hpp"
 
@@ -73,10 +82,343 @@ public:
     }
 };
 
+// Mfolini: Keys of the labels for RadixHeap, matching MyComparator and AstarComparator.
+class LabelLength {
+public:
+    double operator() (const Label* label) const {
+        return label->length;
+    }
+};
+
+class LabelLowerBound {
+public:
+    double operator() (const Label* label) const {
+        return label->lowerBound;
+    }
+};
+
+// Mfolini: Monotone priority queue for non-negative integer keys (radix heap), with the interface of the priority_queue
+// it replaces. Key gives the key of an element as an integer valued double. The elements are bucketed by the highest bit
+// in which their key differs from the last key popped, so a push is O(1) and a pop amortized O(log C) for the largest
+// key C. No key may be smaller than the last key popped, which holds for Dijkstra and for A* with consistent bounds
+// (smaller keys are popped next as if they were equal to it). Equal keys are popped in no particular order.
+template <typename T, typename Key>
+class RadixHeap {
+public:
+    RadixHeap(const Key &key = Key()) : key(key), last(0), count(0) {};
+    
+    void push(const T &value) {
+    	unsigned long long k = to_key(this->key(value));
+    	this->buckets[bucket(k)].push_back(make_pair(k, value));
+    	this->count++;
+    };
+    
+    const T &top() {
+    	refill();
+    	return this->buckets[0].back().second;
+    };
+    
+    void pop() {
+    	refill();
+    	this->buckets[0].pop_back();
+    	this->count--;
+    };
+    
+    bool empty() const {
+    	return this->count == 0;
+    };
+    
+    size_t size() const {
+    	return this->count;
+    };
+
+private:
+    Key key;
+    unsigned long long last;
+    size_t count;
+    vector< pair<unsigned long long,T> > buckets[65];
+    
+    static unsigned long long to_key(double value) {
+    	if (!(value > 0))
+    		return 0;
+    	if (value >= 18446744073709551615.0)
+    		return ULLONG_MAX;
+    	return static_cast<unsigned long long>(value);
+    };
+    
+    // 0 for keys up to last, otherwise 1 + the index of the highest bit in which the key differs from last.
+    int bucket(unsigned long long k) const {
+    	if (k <= this->last)
+    		return 0;
+    	unsigned long long x = k ^ this->last;
+#if defined(__GNUC__)
+    	return 64 - __builtin_clzll(x);
+#else
+    	int b = 1;
+    	for (int shift = 32; shift > 0; shift >>= 1) {
+    		if (x >> shift) {
+    			x >>= shift;
+    			b += shift;
+    		}
+    	}
+    	return b;
+#endif
+    };
+    
+    // Moves the elements of the first non-empty bucket into lower buckets around their smallest key, which becomes last.
+    void refill() {
+    	if (!this->buckets[0].empty())
+    		return;
+    	int i = 1;
+    	while (this->buckets[i].empty())
+    		i++;
+    	vector< pair<unsigned long long,T> > &source = this->buckets[i];
+    	unsigned long long minKey = source[0].first;
+    	for (size_t j = 1; j < source.size(); j++)
+    		minKey = min(minKey, source[j].first);
+    	this->last = minKey;
+    	for (size_t j = 0; j < source.size(); j++)
+    		this->buckets[bucket(source[j].first)].push_back(source[j]);
+    	source.clear();
+    };
+};
+
+// Mfolini: Reasons for a query to stop before its search completed.
+enum SearchStatus {
+	SEARCH_COMPLETE = 0,
+	SEARCH_LABEL_BUDGET = 1,
+	SEARCH_POP_BUDGET = 2,
+	SEARCH_TIME_BUDGET = 3,
+	SEARCH_STOPPED = 4, // The path callback asked to stop, e.g. because the consumer of a path stream closed it.
+	SEARCH_CANCELLED = 5 // The cancellation token of the query fired.
+};
+
+// Mfolini: Cancels the queries it is passed to once cancel() has been called, from any thread. The algorithms poll it at
+// every queue pop, and a cancelled query throws QueryCancelled instead of returning its paths.
+class CancellationToken {
+public:
+    CancellationToken() : cancelled(false) {};
+    
+    void cancel() {
+    	this->cancelled = true;
+    };
+    
+    bool isCancelled() const {
+    	return this->cancelled;
+    };
+
+private:
+    atomic<bool> cancelled;
+};
+
+class QueryCancelled : public runtime_error {
+public:
+    QueryCancelled() : runtime_error("The query was cancelled") {};
+};
+
+// Mfolini: Counters of a query, see SearchContext.
+class SearchStats {
+public:
+    SearchStatus status;
+    long long labels;              // Labels created by the searches.
+    long long pops;                // Labels popped from their queues.
+    long long skylineSize;         // Labels inserted into the skylines of MultiPass and OnePass+.
+    long long dominanceRejections; // Labels dropped because a skyline dominated them.
+    long long overlapRejections;   // Labels and candidate paths dropped because they exceeded theta.
+    double boundsSeconds;          // Time spent in the all-to-one search for the lower bounds.
+    double searchSeconds;          // Time spent in the rest of the query.
+    
+    SearchStats() : status(SEARCH_COMPLETE), labels(0), pops(0), skylineSize(0), dominanceRejections(0), overlapRejections(0),
+    	boundsSeconds(0), searchSeconds(0) {};
+};
+
+// Mfolini: Per-query settings passed to the algorithms, together with the state of the query's budgets. The budgets
+// bound the number of labels created, the number of queue pops and the wall-clock seconds of a query (0 disables a
+// budget). Once one of them is exhausted the algorithms stop and return the paths found so far, and status tells which
+// budget ran out. The algorithms also record the counters returned by getStats() and pass every path to onPath as soon as
+// it is added to the result. Copying a context copies its settings only.
+class SearchContext {
+public:
+    int nThreads; // Native threads an algorithm may use internally (< 1 uses all available cores).
+    long long maxLabels;
+    long long maxPops;
+    double maxSeconds;
+    // Mfolini: If > 0, the reverse search for the bounds stops beyond boundsRadius times the distance from the source
+    // to the target. Nodes further away are treated as unreachable, which only excludes paths longer than that.
+    double boundsRadius;
+    // Mfolini: Called with every path once it is final (may be empty). Returning false stops the query.
+    function<bool(const Path &)> onPath;
+    // Mfolini: Cancels the query once it fires (none by default). May be shared by many queries.
+    shared_ptr<const CancellationToken> cancelToken;
+    // Mfolini: Edges the query treats as if they did not exist, indexed by edge id (nonzero if disabled, none by default).
+    // The bounds of such a query are computed by reverse_dijkstra on the remaining edges and neither cached nor taken
+    // from the contraction hierarchy.
+    shared_ptr<const vector<char>> disabledEdges;
+    
+    atomic<long long> labels;
+    atomic<long long> pops;
+    atomic<int> status;
+    long long skylineSize;
+    long long dominanceRejections;
+    long long overlapRejections;
+    double boundsSeconds;
+    
+    SearchContext() : nThreads(1), maxLabels(0), maxPops(0), maxSeconds(0), boundsRadius(0), labels(0), pops(0), status(SEARCH_COMPLETE),
+    	skylineSize(0), dominanceRejections(0), overlapRejections(0), boundsSeconds(0), seconds(0) {
+        this->startTime = chrono::steady_clock::now();
+    };
+    
+    SearchContext(const SearchContext &other) : nThreads(other.nThreads), maxLabels(other.maxLabels), maxPops(other.maxPops),
+    	maxSeconds(other.maxSeconds), boundsRadius(other.boundsRadius), onPath(other.onPath), cancelToken(other.cancelToken), disabledEdges(other.disabledEdges), labels(0), pops(0), status(SEARCH_COMPLETE), skylineSize(0), dominanceRejections(0),
+    	overlapRejections(0), boundsSeconds(0), seconds(0) {
+        this->startTime = chrono::steady_clock::now();
+    };
+    
+    // Resets the budgets at the start of a query.
+    void restart() {
+    	this->labels = 0;
+    	this->pops = 0;
+    	this->status = SEARCH_COMPLETE;
+    	this->skylineSize = 0;
+    	this->dominanceRejections = 0;
+    	this->overlapRejections = 0;
+    	this->boundsSeconds = 0;
+    	this->seconds = 0;
+    	this->startTime = chrono::steady_clock::now();
+    };
+    
+    // Stops the clock at the end of a query.
+    void finish() {
+    	this->seconds = elapsed();
+    };
+    
+    SearchStats getStats() const {
+    	SearchStats stats;
+    	stats.status = getStatus();
+    	stats.labels = this->labels;
+    	stats.pops = this->pops;
+    	stats.skylineSize = this->skylineSize;
+    	stats.dominanceRejections = this->dominanceRejections;
+    	stats.overlapRejections = this->overlapRejections;
+    	stats.boundsSeconds = this->boundsSeconds;
+    	stats.searchSeconds = max(0.0, this->seconds - this->boundsSeconds);
+    	return stats;
+    };
+    
+    void addLabel() {
+    	this->labels++;
+    };
+    
+    // Counts a queue pop and returns false if the query has to stop. The clock is only read every 256 pops.
+    bool pop() {
+    	long long count = ++this->pops;
+    	if(this->status != SEARCH_COMPLETE)
+    		return false;
+    	if(cancelled())
+    		return stop(SEARCH_CANCELLED);
+    	if(this->maxPops > 0 && count > this->maxPops)
+    		return stop(SEARCH_POP_BUDGET);
+    	if(this->maxLabels > 0 && this->labels > this->maxLabels)
+    		return stop(SEARCH_LABEL_BUDGET);
+    	if(this->maxSeconds > 0 && (count & 255) == 0 && elapsed() > this->maxSeconds)
+    		return stop(SEARCH_TIME_BUDGET);
+    	return true;
+    };
+    
+    // Passes a path which has just been added to the result to onPath and returns false if the query has to stop.
+    bool found(const Path &path) {
+    	if(this->onPath && !this->onPath(path))
+    		return stop(SEARCH_STOPPED);
+    	return true;
+    };
+    
+    // Stops the query from another thread. The algorithms return at their next queue pop.
+    void interrupt(SearchStatus reason) {
+    	stop(reason);
+    };
+    
+    bool disabled(EdgeID edge) const {
+    	return this->disabledEdges && (*this->disabledEdges)[edge];
+    };
+    
+    bool cancelled() const {
+    	return this->cancelToken && this->cancelToken->isCancelled();
+    };
+    
+    bool exhausted() const {
+    	return this->status != SEARCH_COMPLETE;
+    };
+    
+    SearchStatus getStatus() const {
+    	return static_cast<SearchStatus>(this->status.load());
+    };
+    
+    double elapsed() const {
+    	return chrono::duration<double>(chrono::steady_clock::now() - this->startTime).count();
+    };
+
+private:
+    chrono::steady_clock::time_point startTime;
+    double seconds;
+    
+    // Records the first exhausted budget.
+    bool stop(SearchStatus reason) {
+    	int expected = SEARCH_COMPLETE;
+    	this->status.compare_exchange_strong(expected, reason);
+    	return false;
+    };
+};
+
+// Mfolini: Calls body(i) for every i in [0, count), distributed dynamically over nThreads native threads (nThreads < 1
+// uses all available cores). The first exception thrown by body is rethrown once all threads have finished.
+template <typename Body>
+void parallel_for(size_t count, int nThreads, const Body &body) {
+	if(nThreads < 1)
+		nThreads = max(1u, thread::hardware_concurrency());
+	nThreads = min<size_t>(nThreads, count);
+	
+	atomic<size_t> next(0);
+	exception_ptr error;
+	atomic<bool> failed(false);
+	auto worker = [&]() {
+		for(size_t i = next++; i < count && !failed; i = next++) {
+			try {
+				body(i);
+			}
+			catch(...) {
+				if(!failed.exchange(true))
+					error = current_exception();
+			}
+		}
+	};
+	
+	vector<thread> threads;
+	for(int t = 1; t < nThreads; t++)
+		threads.push_back(thread(worker));
+	worker();
+	for(size_t t = 0; t < threads.size(); t++)
+		threads[t].join();
+	if(error)
+		rethrow_exception(error);
+}
+
 typedef priority_queue<Label*,std::vector<Label*>,MyComparator> PriorityQueue;
 typedef priority_queue<Label*,std::vector<Label*>,AstarComparator> PriorityQueueAS;
+typedef RadixHeap<Label*,LabelLength> RadixQueue;
+typedef RadixHeap<Label*,LabelLowerBound> RadixQueueAS;
 
-pair<Path,vector<double>> dijkstra_path_and_bounds(RoadNetwork *rN, NodeID source, NodeID target);
-Path astar_limited(RoadNetwork *rN, NodeID source, NodeID target, vector<double> &bounds, unordered_set<Edge, boost::hash<Edge>> &deletedEdges);
+shared_ptr<const TargetBounds> reverse_dijkstra(RoadNetwork *rN, NodeID target, NodeID source, double radius, const vector<char> *disabledEdges = NULL);
+shared_ptr<const TargetBounds> repair_bounds(RoadNetwork *rN, const TargetBounds &old);
+shared_ptr<const TargetBounds> target_bounds(RoadNetwork *rN, NodeID target, NodeID source, const SearchContext &context);
+pair<Path,shared_ptr<const TargetBounds>> dijkstra_path_and_bounds(RoadNetwork *rN, NodeID source, NodeID target, SearchContext &context);
+Path astar_limited(RoadNetwork *rN, NodeID source, NodeID target, const vector<double> &bounds, unordered_set<Edge, boost::hash<Edge>> &deletedEdges, SearchContext &context);
+Path astar_limited(RoadNetwork *rN, NodeID source, NodeID target, const Landmarks &landmarks, unordered_set<Edge, boost::hash<Edge>> &deletedEdges, SearchContext &context);
+vector<double> dijkstra_distances(RoadNetwork *rN, NodeID node, bool reverse);
+shared_ptr<const Landmarks> graph_landmarks(RoadNetwork *rN);
+double landmark_bound(const Landmarks &landmarks, NodeID node, NodeID target);
+vector<NodeID> nested_dissection_order(RoadNetwork *rN);
+void enable_cch(RoadNetwork *rN, const vector<NodeID> &order);
+void disable_cch(RoadNetwork *rN);
+shared_ptr<const TargetBounds> cch_bounds(RoadNetwork *rN, NodeID target);
 
 #endif
\ No newline at end of file
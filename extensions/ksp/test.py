@@ -3,3 +3,8 @@ import os
 p = os.path.join(os.getcwd(),'src','ksp','sample','sample.gr')
 res = ksp.k_shortest_paths(p,3,0.8,0,4,'mp')
 print(res)
+graph = ksp.RoadNetwork(5, [0,0,1,1,2,2,2,3,3,3,4,4], [1,3,0,2,1,3,4,0,2,4,2,3], [2,3,2,1,1,4,3,3,4,3,3,3])
+res = ksp.k_shortest_paths(graph,3,0.8,0,4,'mp')
+print(res)
+res = ksp.k_shortest_paths_batch(graph,[[0,4],[4,0],[1,3]],3,0.8,'mp',2)
+print(res)
@@ -1,17 +1,19 @@
 from .utilMixin import UtilMixin
 import itertools
-from pathos.pools import ProcessPool
+import os
+import tempfile
+from pathos.pools import ProcessPool, ThreadPool
 from numpy.random import beta
 import numpy as np
-from random import randint
-from os.path import isfile
-from os import remove
 
 #########################################
 # k-shortest Paths with limited overlap
 # FROM: https://github.com/tchond/kspwlo
 #########################################
-from ksp import k_shortest_paths
+from ksp import k_shortest_paths, RoadNetwork, SearchStatus
+
+SEARCH_STATS_FIELDS = ('labels', 'pops', 'skyline_size', 'dominance_rejections', 'overlap_rejections',
+                       'bounds_seconds', 'search_seconds')
 
 #########################################
 # Assignment package used for FW
@@ -34,6 +36,23 @@ class Simulation(UtilMixin):
             'capacity_cutoff': 3,
             'cols_in_result': ['source', 'target', 'ta0', 'ta', 'ca', 'va', 'length'], #source_id0 and target_id0 are also in results as they are the 2d row index.
             'n_cpus': 3,
+            'pool': 'process',  # 'process' or 'thread'. Threads share the edge data, the KSP searches run without the GIL.
+            # Number of targets whose reverse shortest path trees are kept by the ksp graph. As the BPR function only
+            # increases the weights, the cached tree is repaired after each drop instead of being recomputed. 0 disables it.
+            'bounds_cache_size': 1,
+            # Budgets of a single KSP search: labels created, queue pops and seconds (0 means unlimited). A search
+            # which runs out of one returns the paths found so far and the scenario is recorded as LACKING PATHS.
+            'ksp_max_labels': 0,
+            'ksp_max_pops': 0,
+            'ksp_max_seconds': 0,
+            # If > 0, the reverse search for the lower bounds of a KSP search stops at this multiple of the shortest
+            # source-target distance and nodes further away from the target are skipped, as any path through them would
+            # be longer. 0 searches the whole graph.
+            'ksp_bounds_radius': 0,
+            # 'dijkstra' or 'cch'. With 'cch', the shortest paths and bounds of the KSP searches are computed with a
+            # customizable contraction hierarchy. Its node order is computed once per simulation, the hierarchy is
+            # re-customized with the new weights after each drop.
+            'shortest_path_backend': 'dijkstra',
         })
         self.settings.update(edgelist_instance.get_settings())
         self.settings.update(user_settings if user_settings else {})
@@ -41,17 +60,52 @@ class Simulation(UtilMixin):
         self.data.update(self._edgelist_instance.get_data())
         self.data.update({
             'nr_nodes': len(self.data['osmid_to_id0_dict']),
-            'nr_edges': self.data['edgelist_cleaned'].shape[0]
+            'nr_edges': self.data['edgelist_cleaned'].shape[0],
         })
-        self.scenarios = None
-        self.initialized = False
-        self._run()
+        self.data['ksp_graph_file'] = self._save_ksp_graph()
+        try:
+            if self.settings['shortest_path_backend'] == 'cch':
+                self.data['cch_order'] = self._compute_cch_order()
+            self.scenarios = None
+            self.initialized = False
+            self._run()
+        finally:
+            self._remove_ksp_graph()
 
     def _run(self):
         self._generate_scenarios()
         # self._process_fw()
         self._process_scenarios()
 
+    def _save_ksp_graph(self):
+        # The ksp road network (edges in edgelist order with the initial weights ta) is written once to a binary graph
+        # file. The scenarios open it memory mapped, so all worker processes share one page-cached copy of the graph
+        # and only the file path has to be sent to them. Every simulation gets its own file in the workspace, so
+        # simulations running side by side never replace a file that is still in use. It is removed again once the
+        # scenarios have finished (see _remove_ksp_graph).
+        self._print()
+        self._create_workspace_if_not_exists()
+        edgelist = self.data['edgelist_cleaned']
+        ids_array = edgelist.reset_index()[['source_id0', 'target_id0']].values
+        fd, graph_file = tempfile.mkstemp(prefix='ksp_graph_', suffix='.bin', dir=str(self.settings['workspace_path']))
+        os.close(fd)
+        RoadNetwork(self.data['nr_nodes'], ids_array[:, 0], ids_array[:, 1], edgelist['ta'].values).save(str(graph_file))
+        return str(graph_file)
+
+    def _remove_ksp_graph(self):
+        # Graphs which still map the file keep their copy, only the name in the workspace is removed.
+        graph_file = self.data.get('ksp_graph_file')
+        if graph_file is not None and os.path.exists(graph_file):
+            os.remove(graph_file)
+
+    def _compute_cch_order(self):
+        # The node order of the contraction hierarchy only depends on the topology, so it is computed once and reused
+        # by the ksp graphs of all scenarios.
+        self._print()
+        ksp_graph = RoadNetwork(self.data['ksp_graph_file'])
+        ksp_graph.enable_cch()
+        return ksp_graph.cch_order
+
     def _generate_scenarios(self):
         self._print()
         scenario_params = self.settings['scenario_params']
@@ -60,7 +114,11 @@ class Simulation(UtilMixin):
 
     def _process_scenarios(self):
         self._print()
-        scenarios_results_list = ProcessPool(ncpus=self.settings['n_cpus']).map(self._calculate_scenario, self.scenarios)
+        if self.settings['pool'] == 'thread':
+            pool = ThreadPool(nodes=self.settings['n_cpus'])
+        else:
+            pool = ProcessPool(ncpus=self.settings['n_cpus'])
+        scenarios_results_list = pool.map(self._calculate_scenario, self.scenarios)
         scenarios_results_dict = {
             'scenario_id_name_ordering': self.settings['scenario_id_order'],
             'scenarios_summary': self.settings['scenario_params'],
@@ -85,43 +143,13 @@ class Simulation(UtilMixin):
 
             return get_route_index
 
-        def apply_bpr_to_row(row):
-            # if row['va'] / row['ca'] > self.settings['capacity_cutoff']:
-            #     print(str(row['va'] / row['ca']) + ' <> ' + str(self.settings['capacity_cutoff']) + ' -> ' + str(min(row['va'] / row['ca'], self.settings['capacity_cutoff'])))
-            capacity_utilization = min(row['va'] / row['ca'], self.settings['capacity_cutoff'])
-            #capacity_utilization = row['va'] / row['ca']
-            ta = row['ta0'] * (1 + self.settings['alpha'] * np.power(capacity_utilization, self.settings['beta']))
-            return int(ta)
-
-        def write_ksp_edgelist_factory(el, workspace_path):
-            # Target format is a first line containing meta data abour nr nodes and edges, then 3 entries per line
-            # describing an edge by from_node id, to_node id and associated weight.
-            meta_header = np.array([self.data['nr_nodes'], self.data['nr_edges'], 0], dtype=np.int64)
-            ids_array = el.reset_index()[['source_id0', 'target_id0']].values
-            # Add a column of zeros to be replaced by weight column later on
-            ids_array_with_weight_placeholder = np.hstack((ids_array, np.zeros((ids_array.shape[0], 1), dtype=ids_array.dtype)))
-            matrix_with_meta_header = np.vstack((meta_header, ids_array_with_weight_placeholder))
+        def apply_bpr(ta0, va, ca):
+            # Vectorized BPR function, evaluated only for the edges whose volume changed.
+            capacity_utilization = np.minimum(va / ca, self.settings['capacity_cutoff'])
+            #capacity_utilization = va / ca
+            ta = ta0 * (1 + self.settings['alpha'] * np.power(capacity_utilization, self.settings['beta']))
+            return ta.astype(np.int64)
 
-            def write_ksp_edgelist(weight_array):
-                matrix_with_meta_header[1:, 2] = weight_array
-                matrix_with_meta_header.astype(np.int64)
-                while True:
-                    possible_path = str(workspace_path / 'temp_ksp_edgelist_p') + str(randint(1, 1000000)) + '.gr'
-                    if not isfile(possible_path):
-                        break
-                np.savetxt(possible_path, matrix_with_meta_header, delimiter=" ", fmt='%s')
-                return possible_path
-
-            return write_ksp_edgelist
-
-        def valid_path_weight(el, path):
-            weight_from_k_shortest_path_function = path[0]
-            source_target = ((source, target) for source, target in zip(path[1:-1], path[2:]))
-            control_weight = el.loc[source_target, 'ta'].sum()
-            # print(str(scenario_params) + ' | ' + str(weight_from_k_shortest_path_function) + ' <--> ' + str(control_weight) + ' => ' + str(abs(weight_from_k_shortest_path_function - control_weight) < 0.01 * control_weight))
-            return abs(weight_from_k_shortest_path_function - control_weight) < (0.01 * control_weight)
-
-        workspace_path = self.settings['workspace_path']
         scenario_id_order = self.settings['scenario_id_order']
         k = int(scenario_params[scenario_id_order.index('K')])
         source, target = scenario_params[scenario_id_order.index('source_target')]
@@ -136,39 +164,63 @@ class Simulation(UtilMixin):
         #      .format(total_travel, drop_interval, source, target, mode, shape, k, theta))
 
         el = self.data['edgelist_cleaned'][self.settings['cols_in_result']].copy()
-        write_ksp_edgelist = write_ksp_edgelist_factory(el, workspace_path)
+        # The road network is opened once per scenario from the shared graph file, which contains the weights ta.
+        # Edge ids of the graph correspond to the row positions in el, so weights can be updated in place after each drop.
+        ksp_graph = RoadNetwork(self.data['ksp_graph_file'])
+        ksp_graph.bounds_cache_size = self.settings['bounds_cache_size']
+        if self.settings['shortest_path_backend'] == 'cch':
+            ksp_graph.enable_cch(self.data['cch_order'])
+        va_col, ta_col = el.columns.get_loc('va'), el.columns.get_loc('ta')
+        ta0, ca = el['ta0'].values, el['ca'].values
+        va, ta = el['va'].values.copy(), el['ta'].values.copy()
         get_route_index = beta_path_selection_factory(k, mode, shape)
 
         result_dict_scenario = {
             'status': 'OK',
             'status_detail': '',
             'drop': {},
+            # Counters of the KSP search of each drop (see ksp.SearchStats), including drops which failed.
+            'search_stats': {},
             'last_drop_index': None,
             'edge_list': None,
             'used_edge_ids': None,
         }
 
-        used_edge_ids = set()
+        used_edge_positions = set()
+        used_edge_ids = []
         travels_left = total_travel
         drop_counter = 0
         while travels_left > 0:
             travels_dropped = total_travel - travels_left
-            temp_file_ksp_edgelist = write_ksp_edgelist(el['ta'].values)
-            # calculate k-shortest paths. The resulting object is a nested list.
-            # Each nested list stands for a path, whereby the first entry indicates the
-            # cumulated weight along the path. The following entries are the node ids of the path.
-            paths = k_shortest_paths(temp_file_ksp_edgelist, k, theta, source, target, algorithm)
-            # check if overflow error occured by checking if path[k][0] == 0.
-            for path in paths:
-                if not valid_path_weight(el, path):
-                    result_dict_scenario['status'] = 'OVERFLOW'
-                    result_dict_scenario[
-                        'status_detail'] = 'An overflow error occured for the weights in drop {d}'.format(
-                        d=drop_counter
-                    )
-                    return scenario_params, result_dict_scenario
-            # if everything was fine, remove path weights from path lists.
-            paths = [path[1:] for path in paths]
+            # calculate k-shortest paths. The resulting object holds flat arrays: the concatenated node ids and
+            # edge ids (row positions in el) of all paths, the offsets of each path in these arrays and the path lengths.
+            # Invalid scenario parameters (e.g. source equals target) raise ValueError and only fail this scenario.
+            try:
+                ksp_paths, ksp_stats = k_shortest_paths(ksp_graph, k, theta, source, target, algorithm, columnar=True,
+                                                        max_labels=self.settings['ksp_max_labels'],
+                                                        max_pops=self.settings['ksp_max_pops'],
+                                                        max_seconds=self.settings['ksp_max_seconds'],
+                                                        bounds_radius=self.settings['ksp_bounds_radius'],
+                                                        return_stats=True)
+            except ValueError as e:
+                result_dict_scenario['status'] = 'INVALID QUERY'
+                result_dict_scenario['status_detail'] = '{e} in drop {d}'.format(e=e, d=drop_counter)
+                return scenario_params, result_dict_scenario
+            result_dict_scenario['search_stats'][drop_counter] = dict(
+                {name: getattr(ksp_stats, name) for name in SEARCH_STATS_FIELDS}, status=ksp_stats.status.name)
+            # check if overflow error occured. The extension flags every path whose length is not finite or does not
+            # match the sum of its edge weights.
+            if ksp_paths.flags.any():
+                result_dict_scenario['status'] = 'OVERFLOW'
+                result_dict_scenario[
+                    'status_detail'] = 'An overflow error occured for the weights in drop {d}'.format(
+                    d=drop_counter
+                )
+                return scenario_params, result_dict_scenario
+            # An empty result has offsets [0], which np.split would turn into a single empty path.
+            n_paths = len(ksp_paths)
+            paths = [] if n_paths == 0 else [nodes.tolist() for nodes in np.split(ksp_paths.nodes, ksp_paths.offsets[1:-1])]
+            path_edges = [] if n_paths == 0 else np.split(ksp_paths.edges, ksp_paths.edge_offsets[1:-1])
             # check if k paths were found. If not, set status accordingly and return.
             print(' --- Drop: ' + str(drop_counter) + ' | ' + str(scenario_params) + ' | LEN PATHS: ' + str(len(paths)) + ' | K=' + str(k))
             if len(paths) < k:
@@ -178,31 +230,37 @@ class Simulation(UtilMixin):
                     k=k,
                     d=drop_counter
                 )
+                if ksp_paths.status != SearchStatus.complete:
+                    result_dict_scenario['status_detail'] += ' (search stopped: {s})'.format(s=ksp_paths.status.name)
                 return scenario_params, result_dict_scenario
             n_travels = drop_interval if travels_left > drop_interval else travels_left
             path_choices = get_route_index(n_travels)
             path_indices, nr_cars = np.unique(path_choices, return_counts=True)
-            for path_index, nr_car in zip(path_indices, nr_cars):
-                path = paths[int(path_index)]
-                source_target = [(source, target) for source, target in zip(path[:-1], path[1:])]
-                el.loc[source_target, 'va'] = el.loc[source_target, 'va'] + nr_car
-                el['ta'] = el.apply(apply_bpr_to_row, axis=1)
-                used_edge_ids = used_edge_ids.union(set(source_target))
+            # Scatter the cars of all chosen paths onto their edges with a single np.add.at, then update the travel
+            # times of the loaded edges in the edge list and in the live ksp graph.
+            chosen_edges = [path_edges[int(path_index)] for path_index in path_indices]
+            np.add.at(va, np.concatenate(chosen_edges), np.repeat(nr_cars, [len(edges) for edges in chosen_edges]))
+            edge_positions = np.unique(np.concatenate(chosen_edges))
+            ta[edge_positions] = apply_bpr(ta0[edge_positions], va[edge_positions], ca[edge_positions])
+            el.iloc[edge_positions, va_col] = va[edge_positions]
+            el.iloc[edge_positions, ta_col] = ta[edge_positions]
+            ksp_graph.update_weights(edge_positions, ta[edge_positions])
+            used_edge_positions.update(edge_positions.tolist())
+            used_edge_ids = list(el.index[sorted(used_edge_positions)])
             travels_left -= n_travels
-            remove(temp_file_ksp_edgelist)
 
             result_dict_scenario['drop'][drop_counter] = {
                 'total_travels_this_drop': travels_dropped + n_travels,
                 'drop_size': n_travels,
                 'path_choices': [(int(i), int(n)) for i, n in zip(path_indices, nr_cars)],
                 'paths': paths,
-                'edge_list': el.loc[list(used_edge_ids)].copy(),
-                'used_edge_ids': list(used_edge_ids),
+                'edge_list': el.loc[used_edge_ids].copy(),
+                'used_edge_ids': used_edge_ids,
             }
             drop_counter += 1
         result_dict_scenario['last_drop_index'] = (total_travel - 1) // drop_interval
-        result_dict_scenario['edge_list'] = el.loc[list(used_edge_ids)].copy()
-        result_dict_scenario['used_edge_ids'] = list(used_edge_ids)
+        result_dict_scenario['edge_list'] = el.loc[used_edge_ids].copy()
+        result_dict_scenario['used_edge_ids'] = used_edge_ids
         print(
             'FINISHED scenario_params: Total Travels: {} | Drop Interval: {} | Source/Target: {}/{} | Mode: {} | Shape: {} | K: {} | Theta: {}'.format(
                 total_travel, drop_interval, source, target, mode, shape, k, theta))